@@ -1,3 +1,5 @@
+import json
+import click
 from flask import Flask
 from flask_session import Session
 from flask_cors import CORS
@@ -19,12 +21,57 @@ def create_app():
     # Register Blueprints
     from .routes.auth import auth_bp
     from .routes.playlist import playlist_bp
+    from .routes.chat import chat_bp
+    from .routes.usage import usage_bp
     
     app.register_blueprint(auth_bp)
     app.register_blueprint(playlist_bp)
+    app.register_blueprint(chat_bp)
+    app.register_blueprint(usage_bp)
     
     @app.route('/')
     def health_check():
-        return {"status": "ok", "service": "Spotify AI Backend"}
+        from .services.ai import provider_stats
+        from .services.resilience import breaker_states
+        from .services.admission import generation_admission
+        from .services.http_cache import http_cache
+        from .services.shared_cache import track_cache
+        from .services.catalog import local_catalog
+        return {
+            "status": "ok",
+            "service": "Spotify AI Backend",
+            "ai_providers": provider_stats(),
+            "circuit_breakers": breaker_states(),
+            # Queue depth and wait times, for sizing ADMISSION_MAX_ACTIVE
+            "admission": generation_admission.snapshot(),
+            # Hits served without a call or with a bodiless 304
+            "spotify_http_cache": http_cache.snapshot(),
+            "track_cache": track_cache.snapshot(),
+            "local_catalog": local_catalog.snapshot()
+        }
+
+    @app.cli.command("warmup")
+    @click.option("--top", type=int, default=None, help="Number of preference profiles to replay.")
+    @click.option("--profiles", "profiles_file", default=None, help="JSON file with a list of preference dicts.")
+    @click.option("--rate", type=float, default=None, help="Profiles started per second.")
+    @click.option("--market", "markets", multiple=True, help="Country to resolve songs for, repeatable.")
+    def warmup_command(top, profiles_file, rate, markets):
+        """Warm the shared caches (warm cache file, track index) with popular preferences."""
+        from .services.warmup import warm_up
+        click.echo(json.dumps(warm_up(top, profiles_file, rate, list(markets) or None), indent=2))
+
+    @app.cli.command("catalog-import")
+    @click.argument("path", required=False)
+    @click.option("--market", default=None, help="Market of tracks that don't name one.")
+    def catalog_import_command(path, market):
+        """Load tracks into the local catalog, by default from the track index."""
+        from .services.catalog import local_catalog
+        from .services.recommender import TrackIndex
+        path = path or TrackIndex().meta_path
+        click.echo(f"Imported {local_catalog.import_jsonl(path, market)} tracks from {path}")
+
+    # Reuse the last warm-up's AI answers and searches, wherever it ran
+    from .services.warmup import load_warm_cache
+    load_warm_cache()
 
     return app
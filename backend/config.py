@@ -1,4 +1,5 @@
 import os
+import json
 import secrets
 from datetime import timedelta
 from dotenv import load_dotenv
@@ -40,9 +41,169 @@ class Config:
     SPOTIFY_CLIENT_ID = os.getenv("CLIENT_ID")
     SPOTIFY_CLIENT_SECRET = os.getenv("CLIENT_SECRET")
     SPOTIFY_REDIRECT_URI = os.getenv("REDIRECT_URI")
+    # Search market when the user's profile has no country (and for warm-ups)
+    DEFAULT_MARKET = os.getenv("SPOTIFY_DEFAULT_MARKET", "US")
     
     # AI / Gemini
     GENAI_API_KEY = os.getenv("GENAI_API_KEY")
+    GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+    OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    GEMINI_TRANSPORT = os.getenv("GEMINI_TRANSPORT") # "rest" or "grpc", None lets the SDK pick (gRPC)
+
+    # Providers in priority order, the first is primary and the rest are hedges.
+    # e.g. "gemini,openai" or "gemini,gemini:gemini-2.0-flash-lite". "fake" runs offline.
+    AI_PROVIDERS = os.getenv("AI_PROVIDERS", "gemini")
+    AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", 30)) # Seconds for the whole race
+    AI_HEDGE_PERCENTILE = float(os.getenv("AI_HEDGE_PERCENTILE", 90)) # Hedge once the primary is slower than this
+    AI_HEDGE_MIN_DELAY = float(os.getenv("AI_HEDGE_MIN_DELAY", 1.0))
+    AI_HEDGE_DEFAULT_DELAY = float(os.getenv("AI_HEDGE_DEFAULT_DELAY", 5.0)) # Until enough latency samples exist
+    AI_SHARD_SIZE = int(os.getenv("AI_SHARD_SIZE", 25)) # Larger requests are split into concurrent shards
+    AI_MAX_SHARDS = int(os.getenv("AI_MAX_SHARDS", 8))
+    AI_WORKERS = int(os.getenv("AI_WORKERS", 16)) # Concurrent provider calls per process
+    AI_PREFETCH_SIZE = int(os.getenv("AI_PREFETCH_SIZE", 200)) # Answers kept from warm-ups
+    AI_PREFETCH_TTL = int(os.getenv("AI_PREFETCH_TTL", 6 * 3600)) # Seconds
+
+    # AI token accounting and budgets (rolling 24h, 0 = unlimited)
+    AI_USER_DAILY_TOKENS = int(os.getenv("AI_USER_DAILY_TOKENS", 500000))
+    AI_GLOBAL_DAILY_TOKENS = int(os.getenv("AI_GLOBAL_DAILY_TOKENS", 0))
+    AI_BUDGET_DEGRADE_AT = float(os.getenv("AI_BUDGET_DEGRADE_AT", 0.8)) # Share of a budget after which requests are trimmed
+    USAGE_RETENTION_HOURS = int(os.getenv("USAGE_RETENTION_HOURS", 7 * 24)) # Hourly usage kept for /AI_Usage
+    USAGE_DB_PATH = os.getenv("USAGE_DB_PATH", os.path.join(os.getcwd(), 'usage.sqlite3')) # Shared by the workers on a host
+    USAGE_REPORT_TOKEN = os.getenv("USAGE_REPORT_TOKEN") # Bearer token for the all-users /AI_Usage report
+    # USD per million (input, output) tokens, by model; JSON overrides e.g. {"gemini-2.0-flash": [0.1, 0.4]}
+    AI_TOKEN_PRICES = {
+        "gemini-2.0-flash": (0.10, 0.40),
+        "gemini-2.0-flash-lite": (0.075, 0.30),
+        "gpt-4o-mini": (0.15, 0.60),
+        **json.loads(os.getenv("AI_TOKEN_PRICES", "{}"))
+    }
+
+    # Upstream timeouts and circuit breakers
+    SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 20000)) # Resolved (title, artist) searches kept per process
+    SPOTIFY_TIMEOUT = float(os.getenv("SPOTIFY_TIMEOUT", 10)) # Default per-call timeout in seconds
+    PREVIEW_DEADLINE = float(os.getenv("PREVIEW_DEADLINE", 25)) # Budget for /Generate_Preview
+    CREATE_DEADLINE = float(os.getenv("CREATE_DEADLINE", 30)) # Budget for /Create_Playlist
+    EDIT_DEADLINE = float(os.getenv("EDIT_DEADLINE", 30)) # Budget for /Edit_Playlist
+    GENERATE_AND_SAVE_DEADLINE = float(os.getenv("GENERATE_AND_SAVE_DEADLINE", 40)) # Budget for /Generate_And_Save
+    BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5)) # Consecutive failures before opening
+    BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 30)) # Seconds before a trial call
+    # Private HTTP cache of Spotify GETs, revalidated with ETag/Last-Modified
+    SPOTIFY_HTTP_CACHE_ENABLED = os.getenv("SPOTIFY_HTTP_CACHE_ENABLED", "true").lower() == "true"
+    SPOTIFY_HTTP_CACHE_BYTES = int(os.getenv("SPOTIFY_HTTP_CACHE_BYTES", 64 * 1024 * 1024)) # Response bodies kept per process
+
+    # Playlist cover images
+    COVER_IMAGE_SIZE = int(os.getenv("COVER_IMAGE_SIZE", 640)) # Longest edge in px
+    COVER_MAX_BYTES = int(os.getenv("COVER_MAX_BYTES", 256 * 1024)) # Spotify limit on the Base64 body
+    COVER_MIN_QUALITY = int(os.getenv("COVER_MIN_QUALITY", 40))
+    COVER_WORKERS = int(os.getenv("COVER_WORKERS", 2))
+    COVER_CACHE_SIZE = int(os.getenv("COVER_CACHE_SIZE", 32))
+
+    # Artist catalog fallback for songs the search can't find
+    ARTIST_FALLBACK_ENABLED = os.getenv("ARTIST_FALLBACK_ENABLED", "true").lower() == "true"
+    ARTIST_FALLBACK_MIN_SIMILARITY = float(os.getenv("ARTIST_FALLBACK_MIN_SIMILARITY", 0.8)) # Title and artist name match ratio
+    ARTIST_FALLBACK_TOP_TRACKS = os.getenv("ARTIST_FALLBACK_TOP_TRACKS", "true").lower() == "true" # Else substitute a top track
+    ARTIST_CATALOG_ALBUMS = int(os.getenv("ARTIST_CATALOG_ALBUMS", 20)) # Recent albums cached per artist
+    ARTIST_CATALOG_SIZE = int(os.getenv("ARTIST_CATALOG_SIZE", 2000)) # Artists kept per process
+    ARTIST_CATALOG_TTL = int(os.getenv("ARTIST_CATALOG_TTL", 24 * 3600)) # Seconds
+
+    # Track cache shared by the worker processes on a host, a memory-mapped file
+    TRACK_CACHE_ENABLED = os.getenv("TRACK_CACHE_ENABLED", "true").lower() == "true"
+    TRACK_CACHE_FILE = os.getenv("TRACK_CACHE_FILE", os.path.join(os.getcwd(), 'track_cache.bin'))
+    TRACK_CACHE_SLOTS = int(os.getenv("TRACK_CACHE_SLOTS", 65536)) # Records, the file is slots x record bytes
+    TRACK_CACHE_RECORD_BYTES = int(os.getenv("TRACK_CACHE_RECORD_BYTES", 1024)) # Larger tracks aren't cached
+    TRACK_CACHE_TTL = int(os.getenv("TRACK_CACHE_TTL", 24 * 3600)) # Seconds
+    TRACK_CACHE_COMPACT_INTERVAL = int(os.getenv("TRACK_CACHE_COMPACT_INTERVAL", 600)) # Seconds between sweeps of expired records
+
+    # Local full-text catalog of resolved tracks (SQLite FTS5), searched before Spotify
+    CATALOG_ENABLED = os.getenv("CATALOG_ENABLED", "true").lower() == "true"
+    CATALOG_PATH = os.getenv("CATALOG_PATH", os.path.join(os.getcwd(), 'catalog.sqlite3'))
+    CATALOG_MIN_CONFIDENCE = float(os.getenv("CATALOG_MIN_CONFIDENCE", 0.9)) # Title and artist similarity for a local match
+    CATALOG_SEARCH_MIN_RESULTS = int(os.getenv("CATALOG_SEARCH_MIN_RESULTS", 5)) # Local /Search_Track hits before Spotify is skipped
+    CATALOG_OFFLINE = os.getenv("CATALOG_OFFLINE", "false").lower() == "true" # Never search Spotify (benchmarks, tests)
+
+    # Track/album/artist metadata fetched with the multi-ID endpoints
+    METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", 50000)) # Objects kept per process
+    METADATA_CACHE_TTL = int(os.getenv("METADATA_CACHE_TTL", 24 * 3600)) # Seconds
+    HYDRATION_WORKERS = int(os.getenv("HYDRATION_WORKERS", 5)) # Concurrent batch calls per request
+
+    # JSON responses of /Get_Playlists, /Search_Track and /Generate_Preview
+    RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", 1024)) # Smaller bodies go out uncompressed
+    RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", 6))
+    RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", 5)) # Used when the brotli package is installed
+
+    # Album art in previews
+    THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", 100)) # Smallest image at least this wide is used
+    IMAGE_PROXY_ENABLED = os.getenv("IMAGE_PROXY_ENABLED", "false").lower() == "true" # Serve art through /Image_Proxy
+    IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(os.getcwd(), 'image_cache'))
+    IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+
+    # Playlist statistics
+    STATS_CACHE_SIZE = int(os.getenv("STATS_CACHE_SIZE", 256))
+
+    # Track sequencing
+    SEQUENCING_TIME_BUDGET_MS = int(os.getenv("SEQUENCING_TIME_BUDGET_MS", 40))
+    SEQUENCING_CURVE_WINDOW = int(os.getenv("SEQUENCING_CURVE_WINDOW", 40)) # Max reversed segment with an energy curve
+
+    # Playlist editing
+    PLAYLIST_EDIT_RETRIES = int(os.getenv("PLAYLIST_EDIT_RETRIES", 2)) # Rebases after a stale snapshot
+
+    # Candidate pool (surplus preview tracks kept for swaps)
+    CANDIDATE_POOL_SIZE = int(os.getenv("CANDIDATE_POOL_SIZE", 100)) # Tracks per session
+    CANDIDATE_POOL_SESSIONS = int(os.getenv("CANDIDATE_POOL_SESSIONS", 1000))
+    CANDIDATE_POOL_TTL = int(os.getenv("CANDIDATE_POOL_TTL", 3600)) # Seconds
+    CANDIDATE_TOPUP_COUNT = int(os.getenv("CANDIDATE_TOPUP_COUNT", 10)) # Songs requested when the pool is empty
+
+    # Admission control for AI generation pipelines (/Generate_Preview, /Refine_Playlist)
+    ADMISSION_MAX_ACTIVE = int(os.getenv("ADMISSION_MAX_ACTIVE", 32)) # Pipelines running at once per process
+    ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 64)) # Waiting for a slot, beyond this 503
+    ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 5)) # Seconds waited before 503
+    ADMISSION_PER_USER = int(os.getenv("ADMISSION_PER_USER", 2)) # Running or waiting per user, beyond this 429
+
+    # Retries of /Create_Playlist with the same Idempotency-Key header
+    IDEMPOTENCY_KEYS = int(os.getenv("IDEMPOTENCY_KEYS", 10000)) # Records kept per process
+    IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", 24 * 3600)) # Seconds
+
+    # Conversational refinement
+    CHAT_HISTORY_TURNS = int(os.getenv("CHAT_HISTORY_TURNS", 3)) # Recent turns resent to the model
+
+    # Local recommendation index (AI-free previews)
+    RECOMMENDER_ENABLED = os.getenv("RECOMMENDER_ENABLED", "true").lower() == "true" # Index resolved tracks
+    RECOMMENDER_FAST_PATH = os.getenv("RECOMMENDER_FAST_PATH", "false").lower() == "true" # Try the index before the AI
+    RECOMMENDER_DIR = os.getenv("RECOMMENDER_DIR", os.path.join(os.getcwd(), 'track_index'))
+    RECOMMENDER_MIN_SCORE = float(os.getenv("RECOMMENDER_MIN_SCORE", 0.6)) # Weaker matches are not served
+    RECOMMENDER_CHUNK_ROWS = int(os.getenv("RECOMMENDER_CHUNK_ROWS", 65536)) # Rows scored per NumPy batch
+
+    # Cache warm-up ("flask --app run warmup", or on server startup)
+    WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() == "true" # Once per host, see warm_up_async
+    WARMUP_CACHE_FILE = os.getenv("WARMUP_CACHE_FILE", os.path.join(os.getcwd(), 'warm_cache.json')) # Loaded by every process on startup
+    WARMUP_MIN_INTERVAL = int(os.getenv("WARMUP_MIN_INTERVAL", 3600)) # Seconds before a startup warm-up runs again
+    WARMUP_TOP_N = int(os.getenv("WARMUP_TOP_N", 20)) # Preference profiles replayed
+    WARMUP_RATE = float(os.getenv("WARMUP_RATE", 0.5)) # Profiles started per second
+    WARMUP_MARKETS = os.getenv("WARMUP_MARKETS", DEFAULT_MARKET) # Comma separated countries searches are warmed for
+    WARMUP_PROFILES_FILE = os.getenv("WARMUP_PROFILES_FILE") # JSON list of preferences, overrides the history
+    WARMUP_HISTORY_FILE = os.getenv("WARMUP_HISTORY_FILE", os.path.join(os.getcwd(), 'generation_history.jsonl'))
+    WARMUP_HISTORY_LINES = int(os.getenv("WARMUP_HISTORY_LINES", 10000)) # Recent generations considered
+
+    # Production serving (gunicorn -c gunicorn.conf.py run:app)
+    # gevent workers hold many in-flight requests each, since every route
+    # mostly waits on Gemini and Spotify. "gthread" is the plain threaded model.
+    SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+    SERVER_PORT = int(os.getenv("SERVER_PORT", 5000))
+    SERVER_WORKER_CLASS = os.getenv("SERVER_WORKER_CLASS", "gevent")
+    # Candidate pools, chat sessions and warm caches live in process memory and
+    # sessions aren't sticky, so more than one worker breaks /Replace_Track and
+    # /Refine_Playlist for requests landing on another worker. Keep 1 unless
+    # a sticky load balancer pins each session to a worker.
+    SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", 1))
+    SERVER_WORKER_CONNECTIONS = int(os.getenv("SERVER_WORKER_CONNECTIONS", 500)) # In-flight requests per gevent worker
+    SERVER_THREADS = int(os.getenv("SERVER_THREADS", 8)) # Threads per gthread worker
+    SERVER_TIMEOUT = int(os.getenv("SERVER_TIMEOUT", 60)) # Seconds before a stuck worker is restarted
+
+    # Cold-start budget for create_app() in a fresh interpreter, checked by
+    # tests/test_startup_budget.py (report: python -m backend.startup_report)
+    STARTUP_TIME_BUDGET_MS = int(os.getenv("STARTUP_TIME_BUDGET_MS", 1000))
+    STARTUP_RSS_BUDGET_MB = int(os.getenv("STARTUP_RSS_BUDGET_MB", 120))
 
     @classmethod
     def validate(cls):
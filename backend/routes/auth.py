@@ -32,7 +32,8 @@ def login():
     session.modified = True
 
     # Construct Auth URL
-    scope = "user-read-email playlist-modify-public playlist-modify-private ugc-image-upload"
+    # user-read-private exposes the account's country, used as the search market
+    scope = "user-read-email user-read-private playlist-modify-public playlist-modify-private ugc-image-upload"
     params = {
         "client_id": Config.SPOTIFY_CLIENT_ID,
         "response_type": "code",
@@ -85,6 +86,8 @@ def callback():
         profile = spotify.get_user_profile(session['access_token'])
         session['spotify_user_id'] = profile.get('id')
         session['spotify_display_name'] = profile.get('display_name')
+        # Searches only return tracks playable in the user's country
+        session['spotify_market'] = profile.get('country') or Config.DEFAULT_MARKET
     except Exception as e:
         print(f"Warning: Failed to fetch profile on login: {e}")
         
@@ -0,0 +1,117 @@
+from flask import Blueprint, request, session, jsonify, Response, stream_with_context
+import json
+import time
+import concurrent.futures
+from ..config import Config
+from ..services.spotify import SpotifyService
+from ..services.ai import AIService
+from ..services.stats import StatsService
+from ..services.candidates import candidate_pool
+from ..services.chat import chat_sessions
+from ..services.resilience import Deadline, CircuitOpenError
+from ..services.admission import generation_admission, Rejected
+from ..services.usage import usage_ledger, BudgetExceeded
+from .playlist import iter_resolved, track_preview, rejected_response, user_market
+
+chat_bp = Blueprint('chat', __name__)
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@chat_bp.route('/Refine_Playlist', methods=['POST'])
+def refine_playlist():
+    """
+    Conversational refinement of the current preview ("more upbeat",
+    "drop the 90s tracks"). Streams Server-Sent Events:
+      reply   {"text"}           what the AI changed
+      removed {"id"}             per dropped track
+      added   {track preview}    per new track, as soon as it resolves
+      done    {"tracks", "count", "totalDuration"}
+      error   {"error", "details"}
+    Body: {"message": "..."}
+    """
+    if 'access_token' not in session:
+        return jsonify({"error": "Not authenticated", "redirect": "/login"}), 401
+
+    data = request.get_json() or {}
+    message = (data.get('message') or "").strip()
+    if not message:
+        return jsonify({"error": "No message provided"}), 400
+
+    pool_id = session.get('candidate_pool_id')
+    chat = chat_sessions.get(pool_id) if pool_id else None
+    if chat is None:
+        return jsonify({"error": "No active preview, generate one first"}), 409
+
+    # Read everything we need from the session before streaming starts
+    access_token = session['access_token']
+    deadline = Deadline(Config.PREVIEW_DEADLINE)
+    spotify_service = SpotifyService(Config.SPOTIFY_CLIENT_ID, Config.SPOTIFY_CLIENT_SECRET, deadline=deadline, market=user_market())
+    ai_service = AIService(deadline=deadline, user=session.get('spotify_user_id'), route="refine_playlist")
+
+    # Over budget: refuse before streaming rather than as an SSE error
+    try:
+        usage_ledger.check(session.get('spotify_user_id'))
+    except BudgetExceeded as e:
+        return jsonify({"error": str(e)}), e.status
+
+    user = session.get('spotify_user_id') or access_token
+    try:
+        generation_admission.acquire(user, timeout=deadline.remaining())
+    except Rejected as e:
+        return rejected_response(e)
+    started = time.monotonic()
+
+    def generate():
+        # One turn at a time per preview
+        if not chat.lock.acquire(blocking=False):
+            yield _sse("error", {"error": "A refinement is already in progress"})
+            return
+
+        try:
+            yield _sse("status", {"state": "thinking"})
+            try:
+                answer = ai_service.refine_playlist(chat.context(), message)
+            except Exception as e:
+                yield _sse("error", {"error": "AI refinement failed", "details": str(e)})
+                return
+
+            yield _sse("reply", {"text": answer["reply"]})
+
+            for track in chat.remove(refs=set(answer["remove"])):
+                yield _sse("removed", {"id": track['id']})
+
+            # Songs we already resolved for this preview skip the search entirely
+            reused, to_search = candidate_pool.claim(pool_id, answer["add"])
+            for track in chat.add(reused):
+                yield _sse("added", track_preview(track))
+
+            try:
+                for track in iter_resolved(spotify_service, access_token, to_search, deadline):
+                    for added in chat.add([track]):
+                        yield _sse("added", track_preview(added))
+            except concurrent.futures.TimeoutError:
+                yield _sse("status", {"state": "partial", "details": "Search deadline hit"})
+            except CircuitOpenError:
+                yield _sse("status", {"state": "partial", "details": "Spotify search unavailable"})
+
+            chat.record_turn(message, answer["reply"])
+
+            tracks = list(chat.tracks.values())
+            stats = StatsService().compute(tracks) if tracks else None
+            yield _sse("done", {
+                "tracks": [track_preview(t) for t in tracks],
+                "count": len(tracks),
+                "totalDuration": stats["totalDuration"] if stats else "0:00"
+            })
+        finally:
+            chat.lock.release()
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # The slot is held until the stream ends or the client goes away
+    response.call_on_close(lambda: generation_admission.release(user, time.monotonic() - started))
+    return response
@@ -1,55 +1,40 @@
-from flask import Blueprint, request, session, jsonify
+from flask import Blueprint, request, session, jsonify, url_for, Response
+import json
+import time
 import concurrent.futures
+import requests
 from ..config import Config
 from ..services.spotify import SpotifyService
-from ..services.ai import AIService
+from ..services.ai import AIService, buffered_count
+from ..services.images import ImageService
+from ..services.stats import StatsService, format_duration
+from ..services.sequencing import SequencingService
+from ..services.playlist_edit import PlaylistEditService, SnapshotConflict
+from ..services.candidates import candidate_pool
+from ..services.chat import chat_sessions
+from ..services.recommender import RecommenderService
+from ..services.playlist_stream import PlaylistAppender
+from ..services.hydration import HydrationService, track_id_from_uri
+from ..services.payloads import project, encode, compress
+from ..services.thumbnails import PLACEHOLDER_IMAGE, select_image, proxyable, thumbnail_cache
+from ..services.coalescing import preview_flights, idempotency_records
+from ..services.admission import generation_admission, Rejected
+from ..services.usage import BudgetExceeded, OK
+from ..services.warmup import record_profile
+from ..services.resilience import Deadline, DeadlineExceeded, CircuitOpenError
 
 playlist_bp = Blueprint('playlist', __name__)
 
-@playlist_bp.route('/Playlist_Generator', methods=['POST'])
-@playlist_bp.route('/Generate_Preview', methods=['POST'])
-def generate_preview():
-    # 1. Auth Check
-    if 'access_token' not in session:
-        return jsonify({"error": "Not authenticated", "redirect": "/login"}), 401
-    
-    # 2. Get Params
-    data = request.get_json() or {}
-    preferences = data.get('preferences')
-    if not preferences:
-        return jsonify({"error": "No preferences provided"}), 400
-        
-    playlist_length = preferences.get("playlistLength", 20)
-    # Handle if frontend sends a list (legacy support)
-    if isinstance(playlist_length, list):
-        playlist_length = playlist_length[0]
-        
-    try:
-        playlist_length = int(playlist_length)
-    except:
-        playlist_length = 20
 
-    # 3. AI Generation
-    # Request extra songs to buffer against those not found on Spotify
-    # Increase buffer to 100% of requested length or at least 10 songs to be safe
-    buffer_count = max(10, int(playlist_length * 1.0)) 
-    target_ai_count = playlist_length + buffer_count
-    
-    ai_service = AIService()
-    spotify_service = SpotifyService(Config.SPOTIFY_CLIENT_ID, Config.SPOTIFY_CLIENT_SECRET)
-    
-    try:
-        # Generate raw song list with buffer
-        ai_songs = ai_service.generate_playlist_params(preferences, count=target_ai_count)
-    except Exception as e:
-        return jsonify({"error": "AI Generation failed", "details": str(e)}), 500
+def iter_resolved(spotify_service, access_token, songs, deadline=None):
+    """
+    Searches Spotify for AI suggested songs in parallel, yielding each track
+    found (duplicates skipped) as its search finishes. Raises
+    concurrent.futures.TimeoutError if the deadline passes mid fan-out and
+    CircuitOpenError if Spotify search is unavailable.
+    """
+    seen = set()
 
-    # 4. Spotify Search (Parallelized)
-    found_tracks = []
-    
-    # Extract token from session in the main thread
-    access_token = session['access_token']
-    
     def search_worker(token, song_info):
         return spotify_service.search_track(
             token, 
@@ -58,51 +43,393 @@ def generate_preview():
         )
 
     # Use ThreadPool to search faster
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=5)
+    try:
         # Pass access_token explicitely to avoid context issues
-        future_to_song = {executor.submit(search_worker, access_token, song): song for song in ai_songs}
+        future_to_song = {executor.submit(search_worker, access_token, song): song for song in songs}
         
-        for future in concurrent.futures.as_completed(future_to_song):
+        for future in concurrent.futures.as_completed(future_to_song, timeout=deadline.remaining() if deadline else None):
             try:
                 track = future.result()
-                if track:
-                    found_tracks.append(track)
+                if track and track['id'] not in seen:
+                    seen.add(track['id'])
+                    yield track
+            except CircuitOpenError:
+                raise
+            except DeadlineExceeded:
+                raise concurrent.futures.TimeoutError()
             except Exception as e:
                 print(f"Search error: {e}")
+    finally:
+        # Don't block on stragglers, their own timeouts are capped by the deadline
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def resolve_songs(spotify_service, access_token, songs, deadline=None):
+    """
+    Returns (unique tracks found in the order searches finished, timed_out).
+    If the deadline passes or the search circuit opens mid fan-out, whatever
+    resolved so far is returned. CircuitOpenError is raised if nothing did.
+    """
+    found_tracks = []
+    try:
+        for track in iter_resolved(spotify_service, access_token, songs, deadline):
+            found_tracks.append(track)
+    except concurrent.futures.TimeoutError:
+        print(f"Search deadline hit, returning {len(found_tracks)} resolved tracks")
+        return found_tracks, True
+    except CircuitOpenError:
+        if not found_tracks:
+            raise
+        print(f"Search circuit opened, returning {len(found_tracks)} resolved tracks")
+        return found_tracks, True
+    return found_tracks, False
+
+def playable_uris(spotify_service, access_token, uris):
+    """
+    Hydrates user supplied track URIs or links in batches (preview tracks
+    are mostly metadata cache hits) and returns (URIs to add, skipped
+    uris): tracks unknown or unplayable in the user's market, and anything
+    that isn't a Spotify track or episode, are skipped. Episode URIs are
+    kept unchecked, in place. If hydration fails every URI is kept.
+    """
+    ids = {uri: track_id_from_uri(uri) for uri in uris}
+    try:
+        tracks = HydrationService(spotify_service, access_token).add("tracks", ids.values()).hydrate()["tracks"]
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        print(f"Track hydration failed, adding URIs unchecked: {e}")
+        return list(uris), []
 
-    if not found_tracks:
-        return jsonify({"error": "No songs found on Spotify matching the criteria"}), 404
+    keep, skipped = [], []
+    for uri in uris:
+        if isinstance(uri, str) and uri.startswith("spotify:episode:"):
+            # Playlists take podcast episodes too, Spotify validates those on insert
+            keep.append(uri)
+            continue
+        track = tracks.get(ids[uri]) if ids[uri] else None
+        if track and track.get('is_playable', True):
+            # Track links are added as URIs, the API only takes those
+            keep.append(f"spotify:track:{ids[uri]}")
+        else:
+            skipped.append(uri)
+    return keep, skipped
+
+def user_market():
+    """The logged in user's country (stored at login), for searches and their caches."""
+    return session.get('spotify_market') or Config.DEFAULT_MARKET
+
+def session_user_id(spotify_service):
+    """The logged in user's Spotify ID, fetched (with their market) into the session if missing."""
+    if not session.get('spotify_user_id'):
+        profile = spotify_service.get_user_profile(session['access_token'])
+        session['spotify_user_id'] = profile['id']
+        session['spotify_market'] = profile.get('country') or Config.DEFAULT_MARKET
+    return session['spotify_user_id']
+
+def rejected_response(e):
+    """429/503 with Retry-After for a request admission control turned away."""
+    response = jsonify({"error": str(e), "retryAfter": e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, e.status
+
+def api_response(payload):
+    """
+    JSON response with ?fields= projection (see payloads.project), a weak
+    ETag from the payload hash that turns a matching If-None-Match on a GET
+    into a 304, and gzip/brotli when accepted and the body is big enough.
+    """
+    body, etag = encode(project(payload, request.args.get('fields')))
+    # no-cache: browsers keep the body but revalidate, which is cheap now
+    headers = {"Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+    if request.method in ("GET", "HEAD") and request.if_none_match.contains_weak(etag):
+        response = Response(status=304, headers=headers)
+    else:
+        body, encoding = compress(body, {c for c in ("br", "gzip") if request.accept_encodings[c]})
+        response = Response(body, mimetype="application/json", headers=headers)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(etag, weak=True)
+    return response
+
+def album_image(t):
+    """
+    Thumbnail-sized album art for a track (the smallest image at least
+    THUMBNAIL_SIZE px), through /Image_Proxy when IMAGE_PROXY_ENABLED.
+    """
+    url = select_image(t.get('album', {}).get('images'), Config.THUMBNAIL_SIZE)
+    if not url:
+        return PLACEHOLDER_IMAGE
+    if Config.IMAGE_PROXY_ENABLED and proxyable(url):
+        return url_for('playlist.image_proxy', url=url, _external=True)
+    return url
+
+def track_preview(t):
+    """Formats a Spotify track object for the frontend."""
+    image = album_image(t)
+
+    return {
+        "id": t['id'],
+        "uri": t['uri'],
+        "title": t['name'],
+        "artist": t['artists'][0]['name'],
+        "album": t['album']['name'],
+        "duration": format_duration(t['duration_ms']),
+        "image": image,
+        "preview_url": t.get('preview_url')
+    }
+
+def requested_length(preferences):
+    playlist_length = preferences.get("playlistLength", 20)
+    # Handle if frontend sends a list (legacy support)
+    if isinstance(playlist_length, list):
+        playlist_length = playlist_length[0]
+
+    try:
+        return int(playlist_length)
+    except:
+        return 20
+
+def suggest_songs(preferences, playlist_length, ai_service, market):
+    """
+    First stage of a generation. Returns (source, items, error): "ai" and
+    the AI suggested songs still to be resolved on Spotify, or "index" and
+    confident matches from the local index. error is a (body, status) pair
+    when neither can serve.
+    """
+    # Request extra songs to buffer against those not found on Spotify
+    target_ai_count = buffered_count(playlist_length)
+    recommender = RecommenderService()
+
+    # Low on AI budget: the local index is tried first even without the fast path
+    if Config.RECOMMENDER_FAST_PATH or ai_service.budget_state() != OK:
+        # Confident matches from the local index skip the AI and search entirely
+        found_tracks = recommender.recommend(preferences, target_ai_count, market=market)
+        if len(found_tracks) >= playlist_length:
+            return "index", found_tracks, None
+
+    try:
+        # Generate raw song list with buffer
+        return "ai", ai_service.generate_playlist_params(
+            preferences, count=target_ai_count, lean_count=buffered_count(playlist_length, lean=True)
+        ), None
+    except Exception as e:
+        # Model slow or down: serve from the local index if it has enough good matches
+        found_tracks = recommender.recommend(preferences, target_ai_count, market=market)
+        if len(found_tracks) < playlist_length:
+            if isinstance(e, BudgetExceeded):
+                return "ai", [], ({"error": str(e)}, e.status)
+            if isinstance(e, CircuitOpenError):
+                return "ai", [], ({"error": "AI Generation unavailable", "details": str(e)}, 503)
+            if isinstance(e, (TimeoutError, DeadlineExceeded)):
+                return "ai", [], ({"error": "AI Generation timed out", "details": str(e)}, 504)
+            return "ai", [], ({"error": "AI Generation failed", "details": str(e)}, 500)
+        print(f"AI Generation failed, serving {len(found_tracks)} tracks from the local index: {e}")
+        return "index", found_tracks, None
+
+def find_preview_tracks(preferences, playlist_length, access_token, deadline, user=None, market=None):
+    """
+    The expensive part of a preview: AI suggestions resolved on Spotify, or
+    confident matches from the local index. Returns (tracks, partial,
+    source, error), error being a (body, status) pair when nothing can be
+    served.
+    """
+    ai_service = AIService(deadline=deadline, user=user, route="generate_preview")
+    spotify_service = SpotifyService(Config.SPOTIFY_CLIENT_ID, Config.SPOTIFY_CLIENT_SECRET, deadline=deadline, market=market)
+    source, found_tracks, error = suggest_songs(preferences, playlist_length, ai_service, spotify_service.market)
+    if error:
+        return [], False, source, error
+    partial = False
+
+    if source == "ai":
+        # Spotify Search (Parallelized)
+        try:
+            found_tracks, partial = resolve_songs(spotify_service, access_token, found_tracks, deadline)
+        except CircuitOpenError as e:
+            return [], False, source, ({"error": "Spotify search unavailable", "details": str(e)}, 503)
+
+        if not found_tracks:
+            if partial:
+                return [], partial, source, ({"error": "Spotify search timed out"}, 504)
+            return [], partial, source, ({"error": "No songs found on Spotify matching the criteria"}, 404)
+
+        # Grow the local index in the background, without this request's deadline
+        RecommenderService(
+            SpotifyService(Config.SPOTIFY_CLIENT_ID, Config.SPOTIFY_CLIENT_SECRET, market=market), access_token
+        ).index_tracks_async(found_tracks)
+
+    # Popular preference combinations are replayed by the cache warm-up
+    record_profile(preferences)
+    return found_tracks, partial, source, None
+
+@playlist_bp.route('/Playlist_Generator', methods=['POST'])
+@playlist_bp.route('/Generate_Preview', methods=['POST'])
+def generate_preview():
+    # 1. Auth Check
+    if 'access_token' not in session:
+        return jsonify({"error": "Not authenticated", "redirect": "/login"}), 401
+    
+    # 2. Get Params
+    data = request.get_json() or {}
+    preferences = data.get('preferences')
+    if not preferences:
+        return jsonify({"error": "No preferences provided"}), 400
         
-    # Trim to requested length if we found extra
+    playlist_length = requested_length(preferences)
+
+    # 3. AI Generation + Spotify Search
+    # One time budget for the whole pipeline, shared by every upstream call
+    deadline = Deadline(Config.PREVIEW_DEADLINE)
+    spotify_service = SpotifyService(Config.SPOTIFY_CLIENT_ID, Config.SPOTIFY_CLIENT_SECRET, deadline=deadline, market=user_market())
+    access_token = session['access_token']
+
+    # A double click or frontend retry joins the identical preview already
+    # in flight instead of running the AI and searches again
+    user_id = session.get('spotify_user_id')
+    user = user_id or access_token
+
+    def find():
+        # Only the computation takes an admission slot, joined requests don't
+        with generation_admission.admit(user, timeout=deadline.remaining()):
+            return find_preview_tracks(
+                preferences, playlist_length, access_token, deadline, user=user_id, market=spotify_service.market
+            )
+
+    try:
+        (found_tracks, partial, source, error), shared = preview_flights.do(
+            (user, spotify_service.market, json.dumps(preferences, sort_keys=True)), find
+        )
+    except Rejected as e:
+        return rejected_response(e)
+    if shared:
+        print("Joined an identical in-flight preview")
+    if error:
+        return jsonify(error[0]), error[1]
+
+    # Trim to requested length if we found extra, keeping the surplus
+    # around for track swaps
+    surplus = found_tracks[playlist_length:]
     found_tracks = found_tracks[:playlist_length]
 
+    pool_id = session.get('candidate_pool_id') or candidate_pool.new_id()
+    session['candidate_pool_id'] = pool_id
+    candidate_pool.reset(pool_id, preferences, surplus, in_playlist=found_tracks)
+
+    # Searches finish in arbitrary order, sequence for smooth transitions
+    # e.g. energyCurve: "build_up", "wind_down", "peak", "wave"
+    energy_curve = data.get('energyCurve') or preferences.get('energyCurve')
+    try:
+        found_tracks = SequencingService(spotify_service, access_token).order(found_tracks, energy_curve)
+    except Exception as e:
+        print(f"Sequencing failed, keeping search order: {e}")
+
+    # Conversation state for /Refine_Playlist starts from this preview
+    chat_sessions.start(pool_id, preferences, found_tracks)
+
     # Return preview data (no playlist created yet)
-    track_previews = []
-    for t in found_tracks:
-        # Check if we have image
-        image = "https://images.unsplash.com/photo-1493225457124-a3eb161ffa5f?w=100&h=100&fit=crop" # Default
-        if t.get('album', {}).get('images'):
-            image = t['album']['images'][0]['url']
-            
-        track_previews.append({
-            "id": t['id'],
-            "uri": t['uri'],
-            "title": t['name'],
-            "artist": t['artists'][0]['name'],
-            "album": t['album']['name'],
-            "duration": f"{int(t['duration_ms']/60000)}:{int((t['duration_ms']%60000)/1000):02d}",
-            "image": image,
-            "preview_url": t.get('preview_url')
-        })
+    track_previews = [track_preview(t) for t in found_tracks]
 
-    return jsonify({
+    stats = StatsService(spotify_service, access_token).compute(found_tracks)
+
+    return api_response({
         "tracks": track_previews,
         "count": len(found_tracks),
-        "totalDuration": "Calculating..." # Frontend can calc precise duration
+        "totalDuration": stats["totalDuration"],
+        "stats": stats,
+        # True when the deadline cut the search short and fewer tracks came back
+        "partial": partial,
+        # "ai", or "index" when served from the local recommendation index
+        "source": source
+    })
+
+@playlist_bp.route('/Replace_Track', methods=['POST'])
+def replace_track():
+    """
+    Serves replacement tracks from the session's candidate pool, topping the
+    pool up with a small AI request only when it runs dry.
+    Body: {"exclude": [track ids already in the playlist], "count": 1}
+    """
+    if 'access_token' not in session:
+        return jsonify({"error": "Not authenticated", "redirect": "/login"}), 401
+
+    pool_id = session.get('candidate_pool_id')
+    preferences = candidate_pool.preferences(pool_id) if pool_id else None
+    if not preferences:
+        return jsonify({"error": "No active preview, generate one first"}), 409
+
+    data = request.get_json() or {}
+    exclude = set(data.get('exclude') or [])
+    if data.get('track_id'):
+        exclude.add(data['track_id'])
+    try:
+        count = max(1, min(int(data.get('count', 1)), Config.CANDIDATE_POOL_SIZE))
+    except (TypeError, ValueError):
+        count = 1
+
+    tracks = candidate_pool.take(pool_id, count, exclude)
+    refilled = False
+
+    if len(tracks) < count:
+        # Pool ran dry: ask the AI for a few more, avoiding songs already seen
+        deadline = Deadline(Config.PREVIEW_DEADLINE)
+        spotify_service = SpotifyService(Config.SPOTIFY_CLIENT_ID, Config.SPOTIFY_CLIENT_SECRET, deadline=deadline, market=user_market())
+        access_token = session['access_token']
+        missing = count - len(tracks)
+
+        try:
+            ai_songs = AIService(
+                deadline=deadline, user=session.get('spotify_user_id'), route="replace_track"
+            ).generate_playlist_params(
+                preferences,
+                count=max(Config.CANDIDATE_TOPUP_COUNT, missing * 2),
+                exclude_tracks=candidate_pool.seen_labels(pool_id)
+            )
+        except BudgetExceeded as e:
+            if not tracks:
+                return jsonify({"error": str(e)}), e.status
+            ai_songs = []
+        except Exception as e:
+            if not tracks:
+                return jsonify({"error": "AI Generation failed", "details": str(e)}), 500
+            ai_songs = []
+
+        # The pool drops anything this session has already seen
+        try:
+            fresh, _ = resolve_songs(spotify_service, access_token, ai_songs, deadline)
+        except CircuitOpenError as e:
+            if not tracks:
+                return jsonify({"error": "Spotify search unavailable", "details": str(e)}), 503
+            fresh = []
+        candidate_pool.add(pool_id, fresh)
+        tracks += candidate_pool.take(pool_id, missing, exclude)
+        refilled = True
+
+    if not tracks:
+        return jsonify({"error": "No replacement tracks found"}), 404
+
+    # Keep the refinement conversation in sync with swaps made here
+    chat = chat_sessions.get(pool_id)
+    if chat is not None and chat.lock.acquire(timeout=1):
+        try:
+            chat.remove(track_ids=[data['track_id']] if data.get('track_id') else [])
+            chat.add(tracks)
+        finally:
+            chat.lock.release()
+
+    return jsonify({
+        "tracks": [track_preview(t) for t in tracks],
+        "remaining": candidate_pool.size(pool_id),
+        "refilled": refilled
     })
 
 @playlist_bp.route('/Create_Playlist', methods=['POST'])
 def create_playlist():
+    """
+    Creates the playlist, adds the tracks and uploads the cover. With an
+    Idempotency-Key header, a retry returns the first attempt's response, or
+    resumes after the steps it already completed, instead of creating a
+    duplicate playlist.
+    """
     if 'access_token' not in session:
         return jsonify({"error": "Not authenticated", "redirect": "/login"}), 401
 
@@ -115,53 +442,340 @@ def create_playlist():
     if not uris:
          return jsonify({"error": "No tracks provided"}), 400
 
-    spotify_service = SpotifyService(Config.SPOTIFY_CLIENT_ID, Config.SPOTIFY_CLIENT_SECRET)
-
+    deadline = Deadline(Config.CREATE_DEADLINE)
     try:
-        user_id = session.get('spotify_user_id')
-        if not user_id:
-            # Try to fetch if missing
-            profile = spotify_service.get_user_profile(session['access_token'])
-            user_id = profile['id']
-            session['spotify_user_id'] = user_id
-
-        playlist = spotify_service.create_playlist(
-            session['access_token'],
-            user_id,
-            name=name,
-            description=description,
-            public=True
-        )
-        
-        # Add Tracks
-        spotify_service.add_tracks_to_playlist(
-            session['access_token'],
-            playlist['id'],
-            uris
-        )
+        # Retries must share a key even if the first attempt predates the profile fetch
+        user_id = session_user_id(SpotifyService(Config.SPOTIFY_CLIENT_ID, Config.SPOTIFY_CLIENT_SECRET, deadline=deadline))
+    except CircuitOpenError as e:
+        return jsonify({"error": "Spotify unavailable", "details": str(e)}), 503
+    except DeadlineExceeded as e:
+        return jsonify({"error": "Playlist creation timed out", "details": str(e)}), 504
+    except Exception as e:
+        print(f"Profile fetch failed: {e}")
+        return jsonify({"error": "Failed to create playlist on Spotify", "details": str(e)}), 500
 
-        # Upload Image if provided
-        if image:
+    def create(record):
+        # Start resizing/recompressing the cover now so it overlaps with the
+        # playlist creation calls below. Bad Base64 is rejected before we create anything.
+        cover = None
+        if image and not record.get('cover_uploaded'):
             try:
-                # Add slight delay to ensure playlist is ready? 
-                # Spotify API usually handles it fine, but sometimes it takes a moment.
-                spotify_service.upload_playlist_cover(
+                cover = ImageService().prepare_cover_async(image)
+            except ValueError as e:
+                return {"error": "Invalid cover image", "details": str(e)}, 400
+
+        spotify_service = SpotifyService(Config.SPOTIFY_CLIENT_ID, Config.SPOTIFY_CLIENT_SECRET, deadline=deadline, market=user_market())
+
+        try:
+            # Unknown or unplayable tracks are dropped before anything is created
+            if 'uris' not in record:
+                record['uris'], record['skipped'] = playable_uris(spotify_service, session['access_token'], uris)
+            if not record['uris']:
+                return {"error": "None of the tracks are playable", "skipped": record['skipped']}, 400
+
+            if not record.get('playlist_id'):
+                playlist = spotify_service.create_playlist(
+                    session['access_token'],
+                    user_id,
+                    name=name,
+                    description=description,
+                    public=True
+                )
+                record['playlist_id'] = playlist['id']
+
+            # Add Tracks
+            if not record.get('tracks_added'):
+                spotify_service.add_tracks_to_playlist(
                     session['access_token'],
-                    playlist['id'],
-                    image
+                    record['playlist_id'],
+                    record['uris']
+                )
+                record['tracks_added'] = True
+
+            # Upload Image if provided
+            if cover:
+                try:
+                    # Add slight delay to ensure playlist is ready? 
+                    # Spotify API usually handles it fine, but sometimes it takes a moment.
+                    spotify_service.upload_playlist_cover(
+                        session['access_token'],
+                        record['playlist_id'],
+                        cover
+                    )
+                    record['cover_uploaded'] = True
+                except Exception as img_err:
+                    print(f"Failed to upload image: {img_err}")
+                    # Don't fail the whole request, just log it
+
+            return {
+                "playlist_id": record['playlist_id'],
+                "message": "Playlist created successfully",
+                # URIs left out as unknown or unplayable
+                "skipped": record['skipped']
+            }, 200
+
+        except CircuitOpenError as e:
+            return {"error": "Spotify unavailable", "details": str(e)}, 503
+        except DeadlineExceeded as e:
+            return {"error": "Playlist creation timed out", "details": str(e)}, 504
+        except Exception as e:
+            print(f"Playlist creation failed: {e}")
+            return {"error": "Failed to create playlist on Spotify", "details": str(e)}, 500
+
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key:
+        body, status = idempotency_records.run(
+            (user_id, idempotency_key),
+            idempotency_records.fingerprint(request.get_data()),
+            create
+        )
+    else:
+        body, status = create({})
+    return jsonify(body), status
+
+@playlist_bp.route('/Generate_And_Save', methods=['POST'])
+def generate_and_save():
+    """
+    /Generate_Preview and /Create_Playlist in one pipelined request: the
+    empty playlist is created while the AI generates, resolved tracks are
+    appended in order while the search is still running, and the cover
+    uploads alongside. The total is about the slowest stage, not the sum.
+    Honors Idempotency-Key like /Create_Playlist.
+    """
+    if 'access_token' not in session:
+        return jsonify({"error": "Not authenticated", "redirect": "/login"}), 401
+
+    data = request.get_json() or {}
+    preferences = data.get('preferences')
+    if not preferences:
+        return jsonify({"error": "No preferences provided"}), 400
+
+    playlist_length = requested_length(preferences)
+    name = data.get('name', 'AI Generated Bundle')
+    description = data.get('description', 'Generated by PlaylistAI')
+    image = data.get('image') # Base64 string
+    access_token = session['access_token']
+    try:
+        # Retries must share a key even if the first attempt predates the profile fetch
+        user_id = session_user_id(SpotifyService(
+            Config.SPOTIFY_CLIENT_ID, Config.SPOTIFY_CLIENT_SECRET, deadline=Deadline(Config.GENERATE_AND_SAVE_DEADLINE)
+        ))
+    except CircuitOpenError as e:
+        return jsonify({"error": "Spotify unavailable", "details": str(e)}), 503
+    except DeadlineExceeded as e:
+        return jsonify({"error": "Playlist creation timed out", "details": str(e)}), 504
+    except Exception as e:
+        print(f"Profile fetch failed: {e}")
+        return jsonify({"error": "Failed to create playlist on Spotify", "details": str(e)}), 500
+    market = user_market()
+
+    def run(record):
+        cover = None
+        if image and not record.get('cover_uploaded'):
+            try:
+                cover = ImageService().prepare_cover_async(image)
+            except ValueError as e:
+                return {"error": "Invalid cover image", "details": str(e)}, 400
+
+        deadline = Deadline(Config.GENERATE_AND_SAVE_DEADLINE)
+        spotify_service = SpotifyService(Config.SPOTIFY_CLIENT_ID, Config.SPOTIFY_CLIENT_SECRET, deadline=deadline, market=market)
+        ai_service = AIService(deadline=deadline, user=user_id, route="generate_and_save")
+        start = time.monotonic()
+        # Milliseconds from the start until each stage finished
+        timings = {}
+
+        def stage_done(stage):
+            timings[f"{stage}_ms"] = round((time.monotonic() - start) * 1000)
+
+        def create_empty():
+            # A retry after a failure reuses the playlist the first attempt created
+            if not record.get('playlist_id'):
+                playlist = spotify_service.create_playlist(
+                    access_token, user_id, name=name, description=description, public=True
                 )
+                record['playlist_id'] = playlist['id']
+            stage_done("create")
+            return record['playlist_id']
+
+        def upload_cover():
+            try:
+                spotify_service.upload_playlist_cover(access_token, playlist_future.result(), cover)
+                record['cover_uploaded'] = True
             except Exception as img_err:
-                print(f"Failed to upload image: {img_err}")
                 # Don't fail the whole request, just log it
-        
-        return jsonify({
-            "playlist_id": playlist['id'],
-            "message": "Playlist created successfully"
-        })
+                print(f"Failed to upload image: {img_err}")
+            stage_done("cover")
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        playlist_future = executor.submit(create_empty)
+        cover_future = executor.submit(upload_cover) if cover else None
+        appender = PlaylistAppender(spotify_service, access_token, playlist_future, record.setdefault('added', []))
+
+        def fail(body, status):
+            # Don't leave an empty playlist behind, a retry creates a new one
+            try:
+                added = appender.close(timeout=Config.SPOTIFY_TIMEOUT)
+            except Exception:
+                added = appender.added
+            if not added and playlist_future.done() and not playlist_future.exception():
+                try:
+                    # Without the deadline, it may be what ran out
+                    SpotifyService(Config.SPOTIFY_CLIENT_ID, Config.SPOTIFY_CLIENT_SECRET).unfollow_playlist(
+                        access_token, playlist_future.result()
+                    )
+                    record.pop('playlist_id', None)
+                except Exception as e:
+                    print(f"Failed to remove empty playlist: {e}")
+            return body, status
+
+        # A retry only tops up what the failed attempt didn't add, and its
+        # previews are kept so the response matches the playlist
+        already_added = set(record['added'])
+        missing = playlist_length - len(already_added)
+        previews = record.setdefault('previews', {})
+        source = record.setdefault('source', "ai")
 
+        def take(track):
+            previews.setdefault(track['uri'], track_preview(track))
+            appender.add([track['uri']])
+
+        found_tracks, partial = [], False
+        try:
+            if missing > 0:
+                source, items, error = suggest_songs(preferences, missing, ai_service, market)
+                record['source'] = source
+                stage_done("generate")
+                if error:
+                    return fail(*error)
+            else:
+                items = []
+
+            if source == "index":
+                found_tracks = [t for t in items if t['uri'] not in already_added][:max(0, missing)]
+                for track in found_tracks:
+                    take(track)
+            else:
+                # Each track is queued for insertion as soon as its search returns
+                try:
+                    for track in iter_resolved(spotify_service, access_token, items, deadline):
+                        if track['uri'] in already_added:
+                            continue
+                        found_tracks.append(track)
+                        take(track)
+                        if len(found_tracks) >= missing:
+                            break
+                except concurrent.futures.TimeoutError:
+                    print(f"Search deadline hit, saving {len(found_tracks)} resolved tracks")
+                    partial = True
+                except CircuitOpenError:
+                    if not found_tracks:
+                        raise
+                    partial = True
+            stage_done("resolve")
+
+            added = appender.close(timeout=deadline.remaining())
+            stage_done("insert")
+            if not added:
+                if partial:
+                    return fail({"error": "Spotify search timed out"}, 504)
+                return fail({"error": "No songs found on Spotify matching the criteria"}, 404)
+
+            if cover_future:
+                try:
+                    cover_future.result(timeout=deadline.remaining())
+                except concurrent.futures.TimeoutError:
+                    print("Cover upload still running at the deadline")
+        except CircuitOpenError as e:
+            return fail({"error": "Spotify unavailable", "details": str(e)}, 503)
+        except DeadlineExceeded as e:
+            return fail({"error": "Playlist creation timed out", "details": str(e)}, 504)
+        except Exception as e:
+            print(f"Generate and save failed: {e}")
+            return fail({"error": "Failed to create playlist on Spotify", "details": str(e)}, 500)
+        finally:
+            executor.shutdown(wait=False)
+        stage_done("total")
+
+        if source == "ai" and found_tracks:
+            # Grow the local index in the background, without this request's deadline
+            RecommenderService(
+                SpotifyService(Config.SPOTIFY_CLIENT_ID, Config.SPOTIFY_CLIENT_SECRET, market=market), access_token
+            ).index_tracks_async(found_tracks)
+        record_profile(preferences)
+
+        return {
+            "playlist_id": record['playlist_id'],
+            "message": "Playlist created successfully",
+            # Everything in the playlist, including tracks a failed attempt added
+            "tracks": [previews[uri] for uri in added if uri in previews],
+            "count": len(added),
+            # True when the deadline cut the search short and fewer tracks were saved
+            "partial": partial,
+            "source": source,
+            "timings": timings
+        }, 200
+
+    try:
+        # The slot covers the whole pipeline, inserts included
+        with generation_admission.admit(user_id, timeout=Config.GENERATE_AND_SAVE_DEADLINE):
+            idempotency_key = request.headers.get('Idempotency-Key')
+            if idempotency_key:
+                body, status = idempotency_records.run(
+                    (user_id, "generate_and_save", idempotency_key), idempotency_records.fingerprint(request.get_data()), run
+                )
+            else:
+                body, status = run({})
+    except Rejected as e:
+        return rejected_response(e)
+    return jsonify(body), status
+
+@playlist_bp.route('/Edit_Playlist', methods=['POST'])
+def edit_playlist():
+    """
+    Makes an existing playlist match the given track list using the fewest
+    batched remove/move/insert calls.
+    Body: {"playlist_id", "uris", "snapshot_id" (optional), "dry_run" (optional)}
+    """
+    if 'access_token' not in session:
+        return jsonify({"error": "Not authenticated", "redirect": "/login"}), 401
+
+    data = request.get_json() or {}
+    playlist_id = data.get('playlist_id')
+    uris = data.get('uris')
+    if not playlist_id or not isinstance(uris, list):
+        return jsonify({"error": "playlist_id and uris are required"}), 400
+
+    deadline = Deadline(Config.EDIT_DEADLINE)
+    spotify_service = SpotifyService(Config.SPOTIFY_CLIENT_ID, Config.SPOTIFY_CLIENT_SECRET, deadline=deadline)
+    editor = PlaylistEditService(spotify_service, session['access_token'])
+
+    try:
+        snapshot_id, changes = editor.apply(
+            playlist_id,
+            uris,
+            expected_snapshot=data.get('snapshot_id'),
+            dry_run=bool(data.get('dry_run'))
+        )
+    except SnapshotConflict as e:
+        # Client edited an old version, send the current one back to rebase on
+        return jsonify({
+            "error": str(e),
+            "snapshot_id": e.snapshot_id,
+            "uris": e.uris
+        }), 409
+    except CircuitOpenError as e:
+        return jsonify({"error": "Spotify unavailable", "details": str(e)}), 503
+    except DeadlineExceeded as e:
+        return jsonify({"error": "Playlist edit timed out", "details": str(e)}), 504
     except Exception as e:
-        print(f"Playlist creation failed: {e}")
-        return jsonify({"error": "Failed to create playlist on Spotify", "details": str(e)}), 500
+        print(f"Playlist edit failed: {e}")
+        return jsonify({"error": "Failed to edit playlist on Spotify", "details": str(e)}), 500
+
+    return jsonify({
+        "playlist_id": playlist_id,
+        "snapshot_id": snapshot_id,
+        "changes": changes
+    })
 
 @playlist_bp.route('/Search_Track', methods=['GET'])
 def search_spotify_track():
@@ -172,42 +786,20 @@ def search_spotify_track():
     if not query:
         return jsonify({"error": "Missing query"}), 400
 
-    spotify_service = SpotifyService(Config.SPOTIFY_CLIENT_ID, Config.SPOTIFY_CLIENT_SECRET)
-    
-    # We'll use a direct search here, reusing search_track logic or calling raw search
-    # Since search_track in service is specific to track/artist, let's just do a raw search here or add a general search to service.
-    # For now, let's use the service's existing base URL but we need a general search.
-    # Actually, let's just use requests here for simplicity or extend service.
-    # Extending service is cleaner.
+    spotify_service = SpotifyService(Config.SPOTIFY_CLIENT_ID, Config.SPOTIFY_CLIENT_SECRET, market=user_market())
     
     try:
-        # Reuse search_track logic but treat query as song name and ignore artist if not provided?
-        # Or better, just call Spotify Search API directly here for flexible search
-        params = {
-            "q": query,
-            "type": "track",
-            "market": "US",
-            "limit": 10
-        }
-        
-        response = requests.get(
-            f"{SpotifyService.BASE_URL}/search", 
-            headers=spotify_service.get_auth_headers(session['access_token']),
-            params=params
-        )
-        
-        if response.status_code != 200:
-             return jsonify({"error": "Spotify search failed"}), response.status_code
-             
-        data = response.json()
-        tracks = data.get('tracks', {}).get('items', [])
+        try:
+            tracks = spotify_service.search_tracks(session['access_token'], query, limit=10)
+        except requests.HTTPError as e:
+            return jsonify({"error": "Spotify search failed"}), e.response.status_code
+        except CircuitOpenError as e:
+            return jsonify({"error": "Spotify search unavailable", "details": str(e)}), 503
         
         # Format for frontend
         results = []
         for t in tracks:
-            image = "https://images.unsplash.com/photo-1493225457124-a3eb161ffa5f?w=100&h=100&fit=crop"
-            if t.get('album', {}).get('images'):
-                image = t['album']['images'][0]['url']
+            image = album_image(t)
                 
             results.append({
                 "id": t['id'],
@@ -215,11 +807,11 @@ def search_spotify_track():
                 "title": t['name'],
                 "artist": t['artists'][0]['name'],
                 "album": t['album']['name'],
-                "duration": f"{int(t['duration_ms']/60000)}:{int((t['duration_ms']%60000)/1000):02d}",
+                "duration": format_duration(t['duration_ms']),
                 "image": image
             })
             
-        return jsonify(results)
+        return api_response(results)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -234,13 +826,40 @@ def get_playlists():
         # Simplified for now, just getting user's playlists
         # Logic from main2.py could be adapted if specific playlist fetching is needed
         # But this route seemed generic in main2.py
-        
-        params = {"limit": 50}
-        response = requests.get(
-            f"{SpotifyService.BASE_URL}/me/playlists",
-            headers=spotify_service.get_auth_headers(session['access_token']),
-            params=params
-        )
-        return jsonify(response.json())
+        return api_response(spotify_service.get_current_user_playlists(session['access_token'], limit=50))
+    except CircuitOpenError as e:
+        return jsonify({"error": "Spotify unavailable", "details": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+@playlist_bp.route('/Image_Proxy', methods=['GET'])
+def image_proxy():
+    """
+    Serves Spotify album art from a disk-backed cache with an ETag and a
+    one year immutable Cache-Control, so browsers fetch each image once.
+    Query: ?url=<Spotify image CDN URL>
+    """
+    url = request.args.get('url', '')
+    if not proxyable(url):
+        return jsonify({"error": "Only Spotify image URLs can be proxied"}), 400
+
+    cache_headers = {"Cache-Control": "public, max-age=31536000, immutable"}
+    etag = thumbnail_cache.etag(url)
+    if etag in request.if_none_match:
+        response = Response(status=304, headers=cache_headers)
+        response.set_etag(etag)
+        return response
+
+    try:
+        data, content_type, etag = thumbnail_cache.get(url)
+    except CircuitOpenError as e:
+        return jsonify({"error": "Image CDN unavailable", "details": str(e)}), 503
+    except requests.HTTPError as e:
+        return jsonify({"error": "Image fetch failed"}), e.response.status_code
+    except Exception as e:
+        print(f"Image proxy failed for {url}: {e}")
+        return jsonify({"error": "Image fetch failed", "details": str(e)}), 502
+
+    response = Response(data, mimetype=content_type, headers=cache_headers)
+    response.set_etag(etag)
+    return response
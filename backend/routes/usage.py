@@ -0,0 +1,28 @@
+from flask import Blueprint, request, session, jsonify
+import hmac
+from ..config import Config
+from ..services.usage import usage_ledger
+
+usage_bp = Blueprint('usage', __name__)
+
+@usage_bp.route('/AI_Usage', methods=['GET'])
+def ai_usage():
+    """
+    AI token use and estimated cost over the last ?hours= (default 24), by
+    hour, route and model, plus budget state. Logged in users see their
+    own; "Authorization: Bearer <USAGE_REPORT_TOKEN>" shows every user.
+    """
+    try:
+        hours = max(1, min(int(request.args.get('hours', 24)), Config.USAGE_RETENTION_HOURS))
+    except ValueError:
+        return jsonify({"error": "hours must be an integer"}), 400
+
+    auth = request.headers.get('Authorization', '')
+    if Config.USAGE_REPORT_TOKEN and hmac.compare_digest(auth, f"Bearer {Config.USAGE_REPORT_TOKEN}"):
+        return jsonify(usage_ledger.report(hours))
+
+    if not session.get('spotify_user_id'):
+        return jsonify({"error": "Not authenticated", "redirect": "/login"}), 401
+    report = usage_ledger.report(hours, user=session['spotify_user_id'])
+    report["daily_budget"] = Config.AI_USER_DAILY_TOKENS or None
+    return jsonify(report)
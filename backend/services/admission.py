@@ -0,0 +1,126 @@
+import math
+import time
+import threading
+from collections import deque, Counter
+from contextlib import contextmanager
+from ..config import Config
+from .providers import _percentile, _ms
+
+
+class Rejected(Exception):
+    """The request was not admitted. status is 429 or 503, retry_after in seconds."""
+
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Caps how many expensive pipelines run at once. Up to max_active run, up
+    to max_queue more wait in FIFO order for a slot, and each user has at
+    most per_user admitted or waiting. A user over their cap gets 429, a
+    full queue or a wait that times out gets 503, both with a Retry-After
+    estimated from recent run times.
+    """
+
+    def __init__(self, name, max_active=None, max_queue=None, per_user=None, queue_timeout=None, window=500):
+        self.name = name
+        self.max_active = max_active or Config.ADMISSION_MAX_ACTIVE
+        self.max_queue = Config.ADMISSION_MAX_QUEUE if max_queue is None else max_queue
+        self.per_user = per_user or Config.ADMISSION_PER_USER
+        self.queue_timeout = Config.ADMISSION_QUEUE_TIMEOUT if queue_timeout is None else queue_timeout
+        self.active = 0
+        self._waiting = deque()
+        self._users = Counter()
+        self._waits = deque(maxlen=window)
+        self._run_times = deque(maxlen=window)
+        self._admitted = 0
+        self._rejected = Counter()
+        self._cond = threading.Condition()
+
+    def _retry_after(self, backlog):
+        # Slots free up every run_time / max_active seconds on average
+        run_time = _percentile(self._run_times, 50) or 1.0
+        return max(1, math.ceil(run_time * (backlog + 1) / self.max_active))
+
+    def _reject(self, reason, message, status, backlog):
+        self._rejected[reason] += 1
+        raise Rejected(message, status, self._retry_after(backlog))
+
+    def acquire(self, user, timeout=None):
+        """
+        Waits for a slot, at most queue_timeout (or timeout, if shorter).
+        Raises Rejected if the request is not admitted.
+        """
+        timeout = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+        start = time.monotonic()
+        with self._cond:
+            if self._users[user] >= self.per_user:
+                self._reject("user_limit", f"Too many {self.name} requests in progress", 429, 0)
+
+            if self.active >= self.max_active or self._waiting:
+                if len(self._waiting) >= self.max_queue:
+                    self._reject("queue_full", f"{self.name} is at capacity", 503, len(self._waiting))
+                ticket = object()
+                self._waiting.append(ticket)
+                self._users[user] += 1
+                admitted = self._cond.wait_for(
+                    lambda: self._waiting[0] is ticket and self.active < self.max_active,
+                    timeout=max(0.0, timeout)
+                )
+                self._waiting.remove(ticket)
+                if not admitted:
+                    self._release_user(user)
+                    # Whoever is next may be admissible now that we left the queue
+                    self._cond.notify_all()
+                    self._reject("queue_timeout", f"Timed out waiting for {self.name} capacity", 503, len(self._waiting))
+            else:
+                self._users[user] += 1
+
+            self.active += 1
+            self._admitted += 1
+            self._waits.append(time.monotonic() - start)
+            self._cond.notify_all()
+
+    def _release_user(self, user):
+        self._users[user] -= 1
+        if self._users[user] <= 0:
+            del self._users[user]
+
+    def release(self, user, run_time=None):
+        with self._cond:
+            self.active -= 1
+            self._release_user(user)
+            if run_time is not None:
+                self._run_times.append(run_time)
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, user, timeout=None):
+        """acquire()/release() around a block, recording how long it ran."""
+        self.acquire(user, timeout)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(user, time.monotonic() - start)
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                "active": self.active,
+                "queued": len(self._waiting),
+                "max_active": self.max_active,
+                "max_queue": self.max_queue,
+                "admitted": self._admitted,
+                "rejected": dict(self._rejected),
+                "wait_p50_ms": _ms(_percentile(self._waits, 50)),
+                "wait_p95_ms": _ms(_percentile(self._waits, 95)),
+                "run_p50_ms": _ms(_percentile(self._run_times, 50)),
+            }
+
+
+# AI generation + Spotify fan-out, shared by every route that runs it
+generation_admission = AdmissionController("generation")
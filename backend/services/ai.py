@@ -1,57 +1,414 @@
-import os
+import re
 import json
-import google.generativeai as genai
+import time
+import hashlib
+import itertools
+import threading
+import concurrent.futures
+from collections import OrderedDict
 from ..config import Config
+from .providers import ProviderStats, build_provider
+from .resilience import CircuitOpenError, DeadlineExceeded, get_breaker
+from .usage import usage_ledger, BudgetExceeded, DEGRADED
+
+# Providers and their stats are shared by every AIService in the process so
+# hedge delays are based on real observed latency.
+_providers = None
+_providers_lock = threading.Lock()
+_stats = {}
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=Config.AI_WORKERS, thread_name_prefix="ai")
+# Shards wait on provider calls, so they get their own pool to avoid starving _executor
+_shard_executor = concurrent.futures.ThreadPoolExecutor(max_workers=Config.AI_WORKERS, thread_name_prefix="ai-shard")
+# Answers generated ahead of time (cache warm-up), each served once so
+# repeat requests for the same preferences still get fresh songs.
+_prefetched = OrderedDict()
+_prefetched_lock = threading.Lock()
+
+# Preference lists a large request can be split along, in priority order
+SHARD_KEYS = ("genres", "decades", "artists")
+SHARD_ANGLES = (
+    "well-known hits",
+    "deeper album cuts",
+    "lesser-known artists with a similar sound",
+    "recent releases",
+    "older classics that shaped the style",
+    "fan favourites and live staples",
+    "crossover tracks from neighbouring genres",
+    "underrated songs from popular artists",
+)
+
+
+def _configured_providers():
+    global _providers
+    with _providers_lock:
+        if _providers is None:
+            built = [build_provider(spec) for spec in Config.AI_PROVIDERS.split(",") if spec.strip()]
+            _providers = [p for p in built if p is not None]
+            for p in _providers:
+                _stats.setdefault(p.name, ProviderStats())
+        return _providers
+
+
+def provider_stats():
+    """Per-provider latency and success rates for monitoring."""
+    return {name: stats.snapshot() for name, stats in _stats.items()}
+
+
+def _prefetch_key(preferences, count):
+    raw = json.dumps(preferences, sort_keys=True) + f"|{count}"
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _take_prefetched(preferences, count):
+    # Pick up a warm-up that finished in another worker since startup
+    from .warmup import refresh_warm_cache
+    refresh_warm_cache()
+    key = _prefetch_key(preferences, count)
+    with _prefetched_lock:
+        entry = _prefetched.pop(key, None)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    return None
+
+
+def buffered_count(playlist_length, lean=False):
+    """
+    Songs to ask the AI for so enough survive the Spotify search: 100% of
+    the requested length extra, at least 10. lean (AI budget running low)
+    asks for 25% extra, at least 3.
+    """
+    if lean:
+        return playlist_length + max(3, playlist_length // 4)
+    return playlist_length + max(10, playlist_length)
+
+
+def store_prefetched(preferences, count, songs, ttl=None):
+    """Keeps songs for the next matching generate_playlist_params call."""
+    ttl = Config.AI_PREFETCH_TTL if ttl is None else ttl
+    with _prefetched_lock:
+        _prefetched[_prefetch_key(preferences, count)] = (time.monotonic() + ttl, songs)
+        while len(_prefetched) > Config.AI_PREFETCH_SIZE:
+            _prefetched.popitem(last=False)
+
+
+def song_key(song):
+    """Normalized (title, artist) so "Song (Remastered)" and "song" dedupe."""
+    title = re.sub(r"\s*[\(\[].*?[\)\]]|\s+-\s+.*$", "", song["name"]).strip().lower()
+    return title, song["artist"].strip().lower()
+
+
+def parse_songs(text):
+    """
+    Parses and validates a model answer. Returns the list of
+    {"name", "artist"} dicts, dropping malformed entries.
+    Raises ValueError if nothing usable came back.
+    """
+    if not text:
+        raise ValueError("Empty response from AI")
+
+    songs = json.loads(text)
+    if isinstance(songs, dict):
+        # Some providers can only return objects, e.g. {"songs": [...]}
+        songs = next((v for v in songs.values() if isinstance(v, list)), None)
+    if not isinstance(songs, list):
+        raise ValueError("AI did not return a list")
+
+    valid = [
+        {"name": s["name"].strip(), "artist": s["artist"].strip()}
+        for s in songs
+        if isinstance(s, dict)
+        and isinstance(s.get("name"), str) and s["name"].strip()
+        and isinstance(s.get("artist"), str) and s["artist"].strip()
+    ]
+    if not valid:
+        raise ValueError("AI returned no valid songs")
+    return valid
+
+
+def parse_refinement(text):
+    """Parses a refinement turn answer, see AIService.refine_playlist."""
+    if not text:
+        raise ValueError("Empty response from AI")
+    answer = json.loads(text)
+    if not isinstance(answer, dict):
+        raise ValueError("AI did not return an object")
+
+    remove = answer.get("remove") or []
+    if not isinstance(remove, list):
+        raise ValueError("'remove' must be a list")
+    add = answer.get("add") or []
+    return {
+        "reply": str(answer.get("reply") or "").strip(),
+        "remove": [str(ref) for ref in remove],
+        # Reuse the song validation, an empty add list is fine here
+        "add": parse_songs(json.dumps(add)) if add else []
+    }
+
 
 class AIService:
-    def __init__(self):
-        if Config.GENAI_API_KEY:
-            genai.configure(api_key=Config.GENAI_API_KEY)
-            self.model = genai.GenerativeModel('gemini-2.0-flash')
-        else:
-            self.model = None
+    def __init__(self, providers=None, deadline=None, user=None, route=None):
+        # Explicit providers (e.g. FakeProvider in tests) bypass the config
+        self.providers = providers if providers is not None else _configured_providers()
+        # Optional per-request Deadline, the race never outlives it
+        self.deadline = deadline
+        # Token use is accounted to, and budgeted for, this user and route
+        self.user = user
+        self.route = route
+        for p in self.providers:
+            _stats.setdefault(p.name, ProviderStats())
+
+    def budget_state(self):
+        """usage.OK, DEGRADED or EXHAUSTED for this service's user."""
+        return usage_ledger.budget_state(self.user)[0]
 
-    def generate_playlist_params(self, preferences, count=20, exclude_tracks=None):
+    def generate_playlist_params(self, preferences, count=20, exclude_tracks=None, lean_count=None, use_prefetched=True):
         """
         Generates a list of songs based on preferences.
         Returns a list of dictionaries: [{"name": "Song Name", "artist": "Artist Name"}]
+        Large requests are split into concurrent shards, see _generate_sharded.
+        Prefetched answers are served even over budget, unless use_prefetched
+        is False. Once the AI budget runs low only lean_count songs are asked
+        for, and BudgetExceeded is raised when it is spent.
+        """
+        if use_prefetched and not exclude_tracks:
+            songs = _take_prefetched(preferences, count)
+            if songs:
+                return songs
+
+        if not self.providers:
+            raise Exception("AI Service not configured (missing API Key)")
+
+        usage_ledger.check(self.user)
+        if lean_count and self.budget_state() == DEGRADED:
+            count = min(count, lean_count)
+
+        try:
+            if count > Config.AI_SHARD_SIZE:
+                return self._generate_sharded(preferences, count, exclude_tracks)
+            return self._generate(self._build_prompt(preferences, count, exclude_tracks))
+        except (TimeoutError, DeadlineExceeded, CircuitOpenError, BudgetExceeded):
+            # Callers map these to 429/503/504 instead of a generic failure
+            raise
+        except Exception as e:
+            print(f"AI Generation Error: {e}")
+            raise Exception(f"Failed to generate playlist: {str(e)}")
+
+    def prefetch(self, preferences, count=20):
+        """
+        Generates an answer now and keeps it for the next matching
+        generate_playlist_params call. Returns the songs.
+        """
+        # Always a fresh answer, recycling a stored one would only extend its TTL
+        songs = self.generate_playlist_params(preferences, count, use_prefetched=False)
+        store_prefetched(preferences, count, songs)
+        return songs
+
+    def refine_playlist(self, context, message):
+        """
+        One conversational refinement turn. context is the compact playlist
+        context built by ChatSession. Returns
+        {"reply": str, "remove": [track refs], "add": [{"name", "artist"}]}.
         """
-        if not self.model:
+        if not self.providers:
             raise Exception("AI Service not configured (missing API Key)")
+        usage_ledger.check(self.user)
 
+        prompt = f"""
+        You are a professional DJ helping a listener refine a playlist.
+        {context}
+
+        Listener: {json.dumps(message)}
+
+        Respond with a strict JSON object with exactly these keys:
+        "reply": one or two sentences telling the listener what you changed,
+        "remove": array of track refs (like "t3") to drop from the current playlist,
+        "add": array of objects with keys "name" and "artist" for new songs.
+        Keep the playlist roughly the same length unless asked otherwise.
+        Do not include markdown formatting. Just return the raw JSON object.
+        """
+        return self._generate(prompt, parser=parse_refinement)
+
+    def _build_prompt(self, preferences, count, exclude_tracks=None, focus=None):
         exclude_text = ""
         if exclude_tracks:
             exclude_text = f"Ensure no songs are repeated from this list: {json.dumps(exclude_tracks)}."
 
-        prompt = f"""
+        focus_text = ""
+        if focus:
+            focus_text = f"Focus this list on {focus}."
+
+        return f"""
         You are a professional DJ and playlist curator.
         Generate a unique list of {count} songs based on the following preferences: {json.dumps(preferences)}.
+        {focus_text}
         {exclude_text}
-        
+
         The output must be a strict JSON array of objects.
         Each object must have exactly these keys: "name", "artist".
-        Do not include markdown formatting like ```json ... ```. 
+        Do not include markdown formatting like ```json ... ```.
         Just return the raw JSON array.
         """
-        
+
+    @staticmethod
+    def _shard_focuses(preferences, shards):
+        """
+        Gives each shard a distinct slice of the preferences: the values of the
+        richest list preference (genres, decades or artists) are dealt out
+        round-robin. Without one, shards get different curation angles.
+        """
+        best_key, best_values = None, []
+        for key in SHARD_KEYS:
+            values = preferences.get(key) if isinstance(preferences, dict) else None
+            if isinstance(values, list) and len(values) > len(best_values):
+                best_key, best_values = key, values
+
+        if len(best_values) < 2:
+            return [SHARD_ANGLES[i % len(SHARD_ANGLES)] for i in range(shards)]
+
+        label = best_key.rstrip("s")
+        if len(best_values) >= shards:
+            return [f"the {label}(s): {', '.join(map(str, best_values[i::shards]))}" for i in range(shards)]
+
+        # Fewer values than shards: reuse values, each time with a new angle
+        return [
+            f"the {label} {best_values[i % len(best_values)]}, "
+            f"favouring {SHARD_ANGLES[i // len(best_values) % len(SHARD_ANGLES)]}"
+            for i in range(shards)
+        ]
+
+    def _generate_sharded(self, preferences, count, exclude_tracks):
+        """
+        Splits a large request into concurrent shards of ~AI_SHARD_SIZE songs,
+        each steered to a different slice of the preferences, then merges them
+        round-robin with duplicates removed. Failed shards are skipped as long
+        as at least one succeeds.
+        """
+        shards = min(Config.AI_MAX_SHARDS, -(-count // Config.AI_SHARD_SIZE))
+        focuses = self._shard_focuses(preferences, shards)
+        sizes = [count // shards + (1 if i < count % shards else 0) for i in range(shards)]
+
+        futures = [
+            _shard_executor.submit(self._generate, self._build_prompt(preferences, size, exclude_tracks, focus))
+            for size, focus in zip(sizes, focuses)
+        ]
+
+        results, errors = [], []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                errors.append(e)
+
+        if not results:
+            raise errors[0]
+        if errors:
+            print(f"{len(errors)}/{shards} AI shards failed: {errors[0]}")
+
+        merged, seen = [], set()
+        for row in itertools.zip_longest(*results):
+            for song in row:
+                if song is None:
+                    continue
+                key = song_key(song)
+                if key not in seen:
+                    seen.add(key)
+                    merged.append(song)
+        return merged
+
+    def _call(self, provider, prompt, timeout, parser):
+        # Abandoned losers still finish (or time out) and are recorded too
+        breaker = get_breaker(f"ai.{provider.name}")
+        start = time.monotonic()
+        try:
+            text, usage = provider.generate(prompt, timeout)
+        except Exception:
+            _stats[provider.name].record(time.monotonic() - start, ok=False)
+            breaker.record_failure()
+            raise
+        # It answered, so the circuit stays closed even if the answer is unusable
+        breaker.record_success()
+        # Hedges that lose still cost tokens, so every answer is accounted
+        usage_ledger.record(self.user, self.route, provider.name, usage["prompt_tokens"], usage["output_tokens"])
+        try:
+            songs = parser(text)
+        except Exception:
+            _stats[provider.name].record(time.monotonic() - start, ok=False)
+            raise
+        _stats[provider.name].record(time.monotonic() - start, ok=True)
+        return songs
+
+    def _hedge_delay(self, provider):
+        observed = _stats[provider.name].percentile(Config.AI_HEDGE_PERCENTILE)
+        if observed is None:
+            return Config.AI_HEDGE_DEFAULT_DELAY
+        return max(Config.AI_HEDGE_MIN_DELAY, observed)
+
+    def _generate(self, prompt, parser=parse_songs):
+        """
+        Races the configured providers: the primary starts immediately and the
+        next one is only launched once the primary is slower than its usual
+        latency percentile (or has failed). The first schema-valid answer wins
+        and the remaining calls are cancelled/abandoned.
+        """
+        budget = Config.AI_TIMEOUT
+        if self.deadline:
+            budget = self.deadline.cap(budget)
+        deadline = time.monotonic() + budget
+        pending = {}
+        errors = []
+        waiting = list(self.providers)
+
+        def launch():
+            # Skip providers whose circuit is open, they'd only burn the budget
+            while waiting:
+                provider = waiting.pop(0)
+                try:
+                    get_breaker(f"ai.{provider.name}").before_call()
+                except CircuitOpenError as e:
+                    errors.append(str(e))
+                    continue
+                timeout = max(0.1, deadline - time.monotonic())
+                pending[_executor.submit(self._call, provider, prompt, timeout, parser)] = provider
+                return provider
+
+        # The first provider with a closed circuit, hedges are timed against it
+        primary = launch()
+        if not pending:
+            raise CircuitOpenError("; ".join(errors))
+        hedge_at = time.monotonic() + self._hedge_delay(primary)
+
         try:
-            # Using generation_config to enforce JSON if possible, or just relying on the prompt
-            response = self.model.generate_content(
-                prompt,
-                generation_config={"response_mime_type": "application/json"}
-            )
-            
-            if not response.text:
-                raise Exception("Empty response from AI")
-                
-            songs = json.loads(response.text)
-            
-            # basic validation
-            if not isinstance(songs, list):
-                raise ValueError("AI did not return a list")
-                
-            return songs
-            
-        except Exception as e:
-            print(f"AI Generation Error: {e}")
-            raise Exception(f"Failed to generate playlist: {str(e)}")
+            while pending:
+                now = time.monotonic()
+                if now >= deadline:
+                    raise TimeoutError(f"No AI provider answered within {budget:.1f}s")
+
+                wait_until = min(deadline, hedge_at) if waiting else deadline
+                done, _ = concurrent.futures.wait(
+                    pending, timeout=max(0, wait_until - now),
+                    return_when=concurrent.futures.FIRST_COMPLETED
+                )
+
+                for future in done:
+                    provider = pending.pop(future)
+                    try:
+                        songs = future.result()
+                    except Exception as e:
+                        errors.append(f"{provider.name}: {e}")
+                        continue
+                    if provider is not primary:
+                        _stats[provider.name].record_hedge_win()
+                    return songs
+
+                # Hedge when the primary is slow, or right away if everything in flight failed
+                if waiting and (time.monotonic() >= hedge_at or not pending):
+                    launch()
+                    hedge_at = time.monotonic() + self._hedge_delay(primary)
+        finally:
+            # Not-yet-started calls are dropped, running ones are left to time out
+            for future, provider in pending.items():
+                if future.cancel():
+                    # It never ran, so it can't settle a half-open trial
+                    get_breaker(f"ai.{provider.name}").release()
+
+        raise Exception("; ".join(errors) or "All AI providers failed")
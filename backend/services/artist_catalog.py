@@ -0,0 +1,110 @@
+import time
+import zlib
+import threading
+from collections import OrderedDict
+from ..config import Config
+from .hydration import HydrationService
+from .coalescing import SingleFlight
+from .matching import normalize, similarity
+from .resilience import CircuitOpenError, DeadlineExceeded
+
+
+class ArtistCatalog:
+    """
+    Fallback for songs the title/artist search can't find. The artist is
+    resolved once per market and their top tracks plus recent album tracks
+    are cached, so later misses for the same artist are local lookups: the
+    closest title above ARTIST_FALLBACK_MIN_SIMILARITY, else (with
+    ARTIST_FALLBACK_TOP_TRACKS) one of the artist's top tracks.
+    """
+
+    def __init__(self, max_artists=None, ttl=None):
+        self.max_artists = max_artists or Config.ARTIST_CATALOG_SIZE
+        self.ttl = ttl or Config.ARTIST_CATALOG_TTL
+        # (market, normalized artist name) -> (expires, catalog or None)
+        self._catalogs = OrderedDict()
+        self._lock = threading.Lock()
+        # Concurrent misses for one artist share a single catalog fetch
+        self._flights = SingleFlight()
+
+    def _cached(self, key):
+        with self._lock:
+            entry = self._catalogs.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return False, None
+            self._catalogs.move_to_end(key)
+            return True, entry[1]
+
+    def _store(self, key, catalog):
+        with self._lock:
+            self._catalogs[key] = (time.monotonic() + self.ttl, catalog)
+            self._catalogs.move_to_end(key)
+            while len(self._catalogs) > self.max_artists:
+                self._catalogs.popitem(last=False)
+
+    def catalog(self, spotify_service, access_token, artist_name):
+        """
+        {"artist_id", "top_tracks", "tracks"} for the artist in the service's
+        market, or None if no artist with a close enough name exists.
+        """
+        key = (spotify_service.market, normalize(artist_name))
+        hit, catalog = self._cached(key)
+        if hit:
+            return catalog
+
+        def load():
+            hit, catalog = self._cached(key)
+            if hit:
+                return catalog
+            catalog = self._fetch(spotify_service, access_token, artist_name)
+            self._store(key, catalog)
+            return catalog
+
+        return self._flights.do(key, load)[0]
+
+    def _fetch(self, spotify_service, access_token, artist_name):
+        artist = spotify_service.search_artist(access_token, artist_name)
+        # The search always returns someone, a hallucinated artist shouldn't match
+        if not artist or similarity(artist['name'], artist_name) < Config.ARTIST_FALLBACK_MIN_SIMILARITY:
+            return None
+
+        top_tracks = spotify_service.get_artist_top_tracks(access_token, artist['id'])
+        album_ids = spotify_service.get_artist_album_ids(access_token, artist['id'], limit=Config.ARTIST_CATALOG_ALBUMS)
+        albums = HydrationService(spotify_service, access_token).add("albums", album_ids).hydrate()["albums"]
+
+        tracks = {t['id']: t for t in top_tracks}
+        for album_id in album_ids:
+            album = albums.get(album_id)
+            if not album:
+                continue
+            # Album track objects are simplified, previews need the album
+            summary = {k: album.get(k) for k in ("id", "name", "images", "release_date")}
+            for t in album.get('tracks', {}).get('items', []):
+                if t.get('id') and t.get('is_playable', True) and t['id'] not in tracks:
+                    tracks[t['id']] = {**t, "album": summary}
+        return {"artist_id": artist['id'], "top_tracks": top_tracks, "tracks": list(tracks.values())}
+
+    def resolve(self, spotify_service, access_token, song_name, artist_name):
+        """Best stand-in track for a missed search, or None."""
+        try:
+            catalog = self.catalog(spotify_service, access_token, artist_name)
+        except (CircuitOpenError, DeadlineExceeded):
+            raise
+        except Exception as e:
+            print(f"Artist catalog for {artist_name} failed: {e}")
+            return None
+        if not catalog:
+            return None
+
+        best = max(catalog["tracks"], key=lambda t: similarity(t['name'], song_name), default=None)
+        if best and similarity(best['name'], song_name) >= Config.ARTIST_FALLBACK_MIN_SIMILARITY:
+            return best
+
+        if Config.ARTIST_FALLBACK_TOP_TRACKS and catalog["top_tracks"]:
+            # Stable pick per title, so different misses get different top tracks
+            top = catalog["top_tracks"]
+            return top[zlib.crc32(normalize(song_name).encode()) % len(top)]
+        return None
+
+
+artist_catalog = ArtistCatalog()
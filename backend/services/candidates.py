@@ -0,0 +1,136 @@
+import time
+import secrets
+import threading
+from collections import OrderedDict, deque
+from ..config import Config
+from .ai import song_key
+
+
+def _label(track):
+    return f"{track['name']} - {track['artists'][0]['name']}"
+
+
+class CandidatePool:
+    """
+    Bounded, per-session store of resolved Spotify tracks left over from a
+    preview, used to serve "replace this track" and refill requests without
+    another AI call. Pools expire after CANDIDATE_POOL_TTL seconds.
+    """
+
+    def __init__(self, max_tracks=None, max_sessions=None, ttl=None):
+        self.max_tracks = max_tracks or Config.CANDIDATE_POOL_SIZE
+        self.max_sessions = max_sessions or Config.CANDIDATE_POOL_SESSIONS
+        self.ttl = ttl or Config.CANDIDATE_POOL_TTL
+        self._pools = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def new_id():
+        return secrets.token_urlsafe(12)
+
+    def _live(self, pool_id):
+        entry = self._pools.get(pool_id)
+        if entry is None:
+            return None
+        if entry["expires"] < time.monotonic():
+            del self._pools[pool_id]
+            return None
+        self._pools.move_to_end(pool_id)
+        return entry
+
+    def reset(self, pool_id, preferences, tracks, in_playlist=()):
+        """
+        Replaces a session's pool with fresh candidates from a new preview.
+        in_playlist: tracks already shown to the user, never offered again.
+        """
+        with self._lock:
+            self._pools[pool_id] = {
+                "preferences": preferences,
+                "tracks": deque(maxlen=self.max_tracks),
+                "seen": {t['id'] for t in in_playlist},
+                "labels": [_label(t) for t in in_playlist],
+                "expires": time.monotonic() + self.ttl
+            }
+            self._pools.move_to_end(pool_id)
+            while len(self._pools) > self.max_sessions:
+                self._pools.popitem(last=False)
+        self.add(pool_id, tracks)
+
+    def add(self, pool_id, tracks):
+        """Adds tracks not seen before in this session. Returns how many were added."""
+        added = 0
+        with self._lock:
+            entry = self._live(pool_id)
+            if entry is None:
+                return 0
+            for track in tracks:
+                if track['id'] in entry["seen"]:
+                    continue
+                entry["seen"].add(track['id'])
+                entry["labels"].append(_label(track))
+                entry["tracks"].append(track)
+                added += 1
+            entry["expires"] = time.monotonic() + self.ttl
+        return added
+
+    def take(self, pool_id, count, exclude_ids=()):
+        """Pops up to count tracks that aren't in exclude_ids."""
+        exclude_ids = set(exclude_ids)
+        taken = []
+        with self._lock:
+            entry = self._live(pool_id)
+            if entry is None:
+                return taken
+            tracks = entry["tracks"]
+            skipped = []
+            while tracks and len(taken) < count:
+                track = tracks.popleft()
+                if track['id'] in exclude_ids:
+                    skipped.append(track)
+                else:
+                    taken.append(track)
+            # Tracks the client already has may be swapped out again later
+            tracks.extendleft(reversed(skipped))
+            entry["expires"] = time.monotonic() + self.ttl
+        return taken
+
+    def claim(self, pool_id, songs):
+        """
+        Pulls pool tracks matching AI suggested {"name", "artist"} songs so
+        they don't need another search. Returns (tracks, unmatched songs).
+        """
+        wanted = {song_key(s): s for s in songs}
+        matched = []
+        with self._lock:
+            entry = self._live(pool_id)
+            if entry is None:
+                return matched, list(songs)
+            keep = deque(maxlen=self.max_tracks)
+            for track in entry["tracks"]:
+                key = song_key({"name": track['name'], "artist": track['artists'][0]['name']})
+                if key in wanted:
+                    del wanted[key]
+                    matched.append(track)
+                else:
+                    keep.append(track)
+            entry["tracks"] = keep
+        return matched, list(wanted.values())
+
+    def preferences(self, pool_id):
+        with self._lock:
+            entry = self._live(pool_id)
+            return entry["preferences"] if entry else None
+
+    def seen_labels(self, pool_id):
+        """Labels ("Song - Artist") of every track this session has seen, for AI exclusion."""
+        with self._lock:
+            entry = self._live(pool_id)
+            return list(entry["labels"]) if entry else []
+
+    def size(self, pool_id):
+        with self._lock:
+            entry = self._live(pool_id)
+            return len(entry["tracks"]) if entry else 0
+
+
+candidate_pool = CandidatePool()
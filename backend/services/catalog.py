@@ -0,0 +1,176 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from collections import Counter
+from ..config import Config
+from .shared_cache import compact_track
+from .matching import normalize, similarity
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    id TEXT NOT NULL,
+    market TEXT NOT NULL,
+    popularity INTEGER,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (id, market)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5(
+    title, artist, album, tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+# bm25 weights of the title, artist and album columns
+RANK = "bm25(tracks_fts, 10.0, 5.0, 1.0)"
+
+
+def _terms(text, prefix=False):
+    """Quoted FTS5 terms for the words of a normalized text, so user input can't inject syntax."""
+    return [f'"{word}"' + ("*" if prefix else "") for word in re.findall(r"\w+", normalize(text))]
+
+
+class LocalCatalog:
+    """
+    Every track we resolved, in SQLite with an FTS5 index over the
+    normalized title, artist names and album. Updated as tracks resolve,
+    and searched before Spotify: search_track takes a local match when
+    title and artist are both at least CATALOG_MIN_CONFIDENCE similar,
+    /Search_Track when CATALOG_SEARCH_MIN_RESULTS tracks match. WAL mode,
+    so the workers on a host share one file.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or Config.CATALOG_PATH
+        self._conn = None
+        self._unavailable = False
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    @property
+    def enabled(self):
+        return Config.CATALOG_ENABLED and not self._unavailable
+
+    def _connection(self):
+        """The process's connection, opened and the schema created on first use. Caller holds the lock."""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.executescript(SCHEMA)
+            except sqlite3.OperationalError as e:
+                # e.g. SQLite built without FTS5
+                conn.close()
+                print(f"Local catalog disabled: {e}")
+                self._unavailable = True
+                raise
+            self._conn = conn
+        return self._conn
+
+    def _query(self, sql, params):
+        with self._lock:
+            return self._connection().execute(sql, params).fetchall()
+
+    def add(self, tracks, market):
+        """Inserts or refreshes tracks resolved in market. Never raises, the catalog is best effort."""
+        tracks = [t for t in tracks if t and t.get('id')]
+        if not self.enabled or not tracks:
+            return 0
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connection()
+                with conn:
+                    for track in tracks:
+                        compact = compact_track(track)
+                        rowid = conn.execute(
+                            "INSERT INTO tracks (id, market, popularity, data, updated) VALUES (?, ?, ?, ?, ?) "
+                            "ON CONFLICT (id, market) DO UPDATE SET popularity = excluded.popularity, "
+                            "data = excluded.data, updated = excluded.updated RETURNING rowid",
+                            (compact['id'], market, compact.get('popularity'), json.dumps(compact), now)
+                        ).fetchone()[0]
+                        conn.execute("DELETE FROM tracks_fts WHERE rowid = ?", (rowid,))
+                        conn.execute(
+                            "INSERT INTO tracks_fts (rowid, title, artist, album) VALUES (?, ?, ?, ?)",
+                            (
+                                rowid,
+                                normalize(compact['name']),
+                                " ".join(normalize(a['name']) for a in compact['artists']),
+                                normalize(compact['album'].get('name'))
+                            )
+                        )
+            self._stats["added"] += len(tracks)
+            return len(tracks)
+        except sqlite3.Error as e:
+            print(f"Local catalog update failed: {e}")
+            return 0
+
+    def _search(self, expression, market, limit):
+        return [
+            json.loads(data) for (data,) in self._query(
+                "SELECT t.data FROM tracks_fts JOIN tracks t ON t.rowid = tracks_fts.rowid "
+                f"WHERE tracks_fts MATCH ? AND t.market = ? ORDER BY {RANK}, t.popularity DESC LIMIT ?",
+                (expression, market, limit)
+            )
+        ]
+
+    def match(self, song_name, artist_name, market):
+        """The cataloged track for an AI suggestion, or None unless title and artist are a confident match."""
+        title_terms, artist_terms = _terms(song_name), _terms(artist_name)
+        if not self.enabled or not title_terms or not artist_terms:
+            return None
+        expression = f"title : ({' AND '.join(title_terms)}) AND artist : ({' OR '.join(artist_terms)})"
+        try:
+            candidates = self._search(expression, market, 20)
+        except sqlite3.Error as e:
+            print(f"Local catalog lookup failed: {e}")
+            return None
+
+        best, best_score = None, 0.0
+        for track in candidates:
+            title_score = similarity(track['name'], song_name)
+            artist_score = max((similarity(a['name'], artist_name) for a in track['artists']), default=0.0)
+            score = min(title_score, artist_score)
+            if score > best_score:
+                best, best_score = track, score
+        if best_score >= Config.CATALOG_MIN_CONFIDENCE:
+            self._stats["match_hits"] += 1
+            return best
+        self._stats["match_misses"] += 1
+        return None
+
+    def search(self, query, market, limit=10):
+        """Tracks matching every word of a free-text query (as prefixes), best first."""
+        terms = _terms(query, prefix=True)
+        if not self.enabled or not terms:
+            return []
+        try:
+            tracks = self._search(" AND ".join(terms), market, limit)
+        except sqlite3.Error as e:
+            print(f"Local catalog search failed: {e}")
+            return []
+        self._stats["searches"] += 1
+        return tracks
+
+    def import_jsonl(self, path, market=None):
+        """
+        Loads tracks from a JSONL file of track objects, e.g. the track
+        index's metadata file, each in its own "market" or the given one.
+        Returns how many were added.
+        """
+        by_market = {}
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    track = json.loads(line)
+                    by_market.setdefault(market or track.get('market') or Config.DEFAULT_MARKET, []).append(track)
+        return sum(self.add(tracks, m) for m, tracks in by_market.items())
+
+    def snapshot(self):
+        return {"enabled": self.enabled, **self._stats}
+
+
+local_catalog = LocalCatalog()
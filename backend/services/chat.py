@@ -0,0 +1,125 @@
+import json
+import time
+import threading
+from collections import OrderedDict, deque
+from ..config import Config
+
+
+def _line(ref, track):
+    year = (track.get('album', {}).get('release_date') or "")[:4]
+    return f"{ref} | {track['name']} | {track['artists'][0]['name']} | {year}"
+
+
+class ChatSession:
+    """
+    Server-side state for refining one preview by conversation.
+
+    To keep each turn's prompt roughly constant in size, the model sees a
+    snapshot of the playlist (stable across turns, so providers can reuse
+    the prefix) plus a short list of changes since that snapshot and the
+    last few messages. The snapshot is only rebuilt once the change list
+    grows past half the playlist.
+    """
+
+    def __init__(self, preferences, tracks):
+        self.preferences = preferences
+        self.tracks = OrderedDict() # ref -> Spotify track object, in playlist order
+        self.next_ref = 1
+        self.messages = deque(maxlen=Config.CHAT_HISTORY_TURNS * 2)
+        self.changes = []
+        self.snapshot = ""
+        self.expires = 0.0
+        self.lock = threading.Lock()
+        for track in tracks:
+            self._append(track)
+        self._take_snapshot()
+
+    def _append(self, track):
+        ref = f"t{self.next_ref}"
+        self.next_ref += 1
+        self.tracks[ref] = track
+        return ref
+
+    def _take_snapshot(self):
+        lines = "\n".join(_line(ref, t) for ref, t in self.tracks.items())
+        self.snapshot = (
+            f"Listener preferences: {json.dumps(self.preferences)}\n"
+            f"Playlist (ref | title | artist | year):\n{lines}"
+        )
+        self.changes = []
+
+    def context(self):
+        """Prompt context for the next turn."""
+        parts = [self.snapshot]
+        if self.changes:
+            parts.append("Changes since that list:\n" + "\n".join(self.changes))
+        if self.messages:
+            parts.append("Recent conversation:\n" + "\n".join(self.messages))
+        return "\n\n".join(parts)
+
+    def track_ids(self):
+        return {t['id'] for t in self.tracks.values()}
+
+    def remove(self, refs=(), track_ids=()):
+        """Removes tracks by ref or Spotify ID. Returns the removed tracks."""
+        track_ids = set(track_ids)
+        removed = []
+        for ref in [r for r, t in self.tracks.items() if r in refs or t['id'] in track_ids]:
+            track = self.tracks.pop(ref)
+            self.changes.append(f"- {ref} removed")
+            removed.append(track)
+        return removed
+
+    def add(self, tracks):
+        """Appends tracks not already in the playlist. Returns the added ones."""
+        present = self.track_ids()
+        added = []
+        for track in tracks:
+            if track['id'] in present:
+                continue
+            present.add(track['id'])
+            ref = self._append(track)
+            self.changes.append(f"+ {_line(ref, track)}")
+            added.append(track)
+        return added
+
+    def record_turn(self, message, reply):
+        self.messages.append(f"Listener: {message}")
+        self.messages.append(f"DJ: {reply}")
+        if len(self.changes) > max(4, len(self.tracks) // 2):
+            self._take_snapshot()
+
+
+class ChatSessionStore:
+    """Bounded, TTL'd map of preview id -> ChatSession, shared per process."""
+
+    def __init__(self, max_sessions=None, ttl=None):
+        self.max_sessions = max_sessions or Config.CANDIDATE_POOL_SESSIONS
+        self.ttl = ttl or Config.CANDIDATE_POOL_TTL
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, session_id, preferences, tracks):
+        chat = ChatSession(preferences, tracks)
+        chat.expires = time.monotonic() + self.ttl
+        with self._lock:
+            self._sessions[session_id] = chat
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return chat
+
+    def get(self, session_id):
+        with self._lock:
+            chat = self._sessions.get(session_id)
+            if chat is None:
+                return None
+            if chat.expires < time.monotonic():
+                del self._sessions[session_id]
+                return None
+            chat.expires = time.monotonic() + self.ttl
+            self._sessions.move_to_end(session_id)
+            return chat
+
+
+chat_sessions = ChatSessionStore()
@@ -0,0 +1,98 @@
+import time
+import hashlib
+import threading
+import concurrent.futures
+from collections import OrderedDict
+from ..config import Config
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Callers arriving while a call
+    for their key is in flight wait for it and get its result (or exception)
+    instead of starting their own.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Returns (fn's result, True if it came from another caller's call)."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self._calls[key] = future
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class IdempotencyStore:
+    """
+    Bounded store of per-key records for requests sent with an
+    Idempotency-Key header. A record holds the finished response, plus
+    checkpoints of upstream side effects so a retry after a failure resumes
+    where the first attempt stopped instead of repeating them. Attempts for
+    the same key never run concurrently. Records expire after IDEMPOTENCY_TTL.
+    """
+
+    def __init__(self, max_keys=None, ttl=None):
+        self.max_keys = max_keys or Config.IDEMPOTENCY_KEYS
+        self.ttl = ttl or Config.IDEMPOTENCY_TTL
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+
+    @staticmethod
+    def fingerprint(payload):
+        return hashlib.sha256(payload).hexdigest()
+
+    def _record(self, key, fingerprint):
+        with self._lock:
+            record = self._records.get(key)
+            if record is None or record["expires"] < time.monotonic():
+                record = {"fingerprint": fingerprint, "expires": time.monotonic() + self.ttl}
+                self._records[key] = record
+            self._records.move_to_end(key)
+            while len(self._records) > self.max_keys:
+                self._records.popitem(last=False)
+            return record
+
+    def run(self, key, fingerprint, fn):
+        """
+        Calls fn(record) for key unless a finished response is already
+        stored, and returns (body, status). fn returns (body, status) and may
+        store checkpoints in record; responses below 500 are kept for
+        retries. A key reused with a different payload gets a 422.
+        """
+        def attempt():
+            record = self._record(key, fingerprint)
+            if record["fingerprint"] != fingerprint:
+                return {"error": "Idempotency-Key was already used for a different request"}, 422
+            if "response" in record:
+                return record["response"]
+            body, status = fn(record)
+            if status < 500:
+                record["response"] = (body, status)
+            return body, status
+
+        return self._flights.do(key, attempt)[0]
+
+
+preview_flights = SingleFlight()
+idempotency_records = IdempotencyStore()
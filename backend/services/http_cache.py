@@ -0,0 +1,165 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict, Counter
+from urllib.parse import urlsplit
+import requests
+from requests.structures import CaseInsensitiveDict
+from ..config import Config
+
+# Response headers kept with a cached body, the rest describe the transfer
+KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Cache-Control", "Expires")
+
+
+def _directives(cache_control):
+    """{"max-age": "60", "no-cache": ""} for a Cache-Control header."""
+    directives = {}
+    for part in (cache_control or "").split(","):
+        name, _, value = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = value.strip('"')
+    return directives
+
+
+def _freshness(headers):
+    """Seconds the response may be reused without revalidating."""
+    directives = _directives(headers.get("Cache-Control"))
+    if "no-cache" in directives:
+        return 0
+    try:
+        max_age = int(directives.get("s-maxage") or directives.get("max-age") or 0)
+        age = int(headers.get("Age") or 0)
+    except ValueError:
+        return 0
+    return max(0, max_age - age)
+
+
+class HttpCache:
+    """
+    Private HTTP cache under SpotifyService GETs, one entry per user (the
+    hashed bearer token) and full URL. Responses are reused as-is while
+    Cache-Control allows it, then revalidated with If-None-Match or
+    If-Modified-Since, a 304 costs a round trip but no body. Writes by a
+    user drop their cached reads of the resource they wrote to.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or Config.SPOTIFY_HTTP_CACHE_BYTES
+        # (user, url) -> {"content", "headers", "encoding", "expires", "size"}
+        self._entries = OrderedDict()
+        self._size = 0
+        self._stats = Counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def user_key(headers):
+        auth = (headers or {}).get("Authorization")
+        return hashlib.sha256(auth.encode()).hexdigest()[:32] if auth else None
+
+    @staticmethod
+    def url_key(url, params=None):
+        """The URL with its query string, as requests would send it."""
+        return requests.Request("GET", url, params=params).prepare().url
+
+    def lookup(self, user, url):
+        """(entry or None, fresh)."""
+        with self._lock:
+            entry = self._entries.get((user, url))
+            if entry is None:
+                self._stats["misses"] += 1
+                return None, False
+            self._entries.move_to_end((user, url))
+            fresh = entry["expires"] > time.monotonic()
+            if fresh:
+                self._stats["fresh_hits"] += 1
+                self._stats["bytes_saved"] += entry["size"]
+            return entry, fresh
+
+    @staticmethod
+    def validators(entry):
+        headers = {}
+        if entry["headers"].get("ETag"):
+            headers["If-None-Match"] = entry["headers"]["ETag"]
+        if entry["headers"].get("Last-Modified"):
+            headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+        return headers
+
+    @staticmethod
+    def response(entry, url):
+        """A fresh requests.Response for a cached entry, callers may consume it like any other."""
+        response = requests.Response()
+        response.status_code = 200
+        response._content = entry["content"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.encoding = entry["encoding"]
+        response.url = url
+        response.from_cache = True
+        return response
+
+    def store(self, user, url, response):
+        """Keeps a 200 that has a validator or a max-age and doesn't forbid storing."""
+        headers = response.headers
+        if response.status_code != 200 or "no-store" in _directives(headers.get("Cache-Control")):
+            return
+        freshness = _freshness(headers)
+        if not (freshness or headers.get("ETag") or headers.get("Last-Modified")):
+            return
+        size = len(response.content)
+        # One huge body shouldn't flush everyone else's entries
+        if size > self.max_bytes // 10:
+            return
+
+        entry = {
+            "content": response.content,
+            "headers": {h: headers[h] for h in KEPT_HEADERS if h in headers},
+            "encoding": response.encoding,
+            "expires": time.monotonic() + freshness,
+            "size": size,
+        }
+        with self._lock:
+            self._pop((user, url))
+            self._entries[(user, url)] = entry
+            self._size += size
+            self._stats["stored"] += 1
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted["size"]
+
+    def revalidated(self, user, url, entry, not_modified):
+        """Updates a cached entry from a 304 and returns it as a response."""
+        # A 304 may carry newer validators and freshness
+        for header in KEPT_HEADERS[1:]:
+            if header in not_modified.headers:
+                entry["headers"][header] = not_modified.headers[header]
+        entry["expires"] = time.monotonic() + _freshness(not_modified.headers)
+        with self._lock:
+            self._stats["revalidated"] += 1
+            self._stats["bytes_saved"] += entry["size"]
+        return self.response(entry, url)
+
+    def invalidate(self, user, url):
+        """
+        Drops user's entries under the resource a write targeted, e.g. a
+        POST to /playlists/{id}/tracks drops /playlists/{id} and its pages.
+        Playlist writes also drop /me/playlists.
+        """
+        segments = urlsplit(url).path.split("/")
+        prefixes = ["/".join(segments[:4])]
+        if "playlists" in segments:
+            prefixes.append("/v1/me/playlists")
+        under = lambda path: any(path == p or path.startswith(p + "/") for p in prefixes)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == user and under(urlsplit(k[1]).path)]:
+                self._pop(key)
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._size -= entry["size"]
+
+    def snapshot(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, **self._stats}
+
+
+http_cache = HttpCache()
@@ -0,0 +1,145 @@
+import time
+import threading
+import concurrent.futures
+from collections import OrderedDict
+from ..config import Config
+from .shared_cache import track_cache, compact_track
+
+# Most IDs Spotify accepts per multi-ID call
+BATCH_SIZES = {"tracks": 50, "albums": 20, "artists": 50}
+# Tracks and albums are relinked per market, artists aren't
+MARKET_KINDS = {"tracks", "albums"}
+
+
+class MetadataCache:
+    """
+    Process-wide LRU of Spotify track, album and artist objects keyed by
+    (kind, market, id), entries expire after METADATA_CACHE_TTL. None is
+    cached for IDs Spotify doesn't know.
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = max_entries or Config.METADATA_CACHE_SIZE
+        self.ttl = ttl or Config.METADATA_CACHE_TTL
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(kind, market, object_id):
+        return kind, market if kind in MARKET_KINDS else None, object_id
+
+    def get_many(self, kind, market, ids):
+        """Returns {id: object or None} for the IDs cached and still fresh."""
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for object_id in ids:
+                key = self._key(kind, market, object_id)
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[0] < now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[object_id] = entry[1]
+        return found
+
+    def put_many(self, kind, market, objects):
+        """objects: {id: object or None}."""
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for object_id, obj in objects.items():
+                key = self._key(kind, market, object_id)
+                self._entries[key] = (expires, obj)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+metadata_cache = MetadataCache()
+
+
+def track_id_from_uri(uri):
+    """ID of a "spotify:track:<id>" URI or open.spotify.com track link, else None."""
+    if not isinstance(uri, str):
+        return None
+    if uri.startswith("spotify:track:"):
+        track_id = uri.rsplit(":", 1)[1]
+    elif "open.spotify.com/track/" in uri:
+        track_id = uri.split("open.spotify.com/track/", 1)[1].split("?")[0].strip("/")
+    else:
+        return None
+    return track_id if track_id.isalnum() else None
+
+
+class HydrationService:
+    """
+    Collects track, album and artist IDs from anywhere in a request and
+    fetches the ones not in metadata_cache with the multi-ID endpoints:
+    deduped, in full batches, every batch concurrently.
+
+        hydrator = HydrationService(spotify_service, access_token)
+        hydrator.add("tracks", ids)
+        objects = hydrator.hydrate(expand=True)["tracks"]
+    """
+
+    def __init__(self, spotify_service, access_token):
+        self.spotify_service = spotify_service
+        self.access_token = access_token
+        self.market = spotify_service.market
+        # dicts as ordered sets, so duplicates across callers collapse
+        self._wanted = {kind: {} for kind in BATCH_SIZES}
+
+    def add(self, kind, ids):
+        self._wanted[kind].update(dict.fromkeys(i for i in ids if i))
+        return self
+
+    def _fetch_round(self, kinds):
+        result = {}
+        jobs = []
+        for kind in kinds:
+            ids = list(self._wanted[kind])
+            result[kind] = metadata_cache.get_many(kind, self.market, ids)
+            if kind == "tracks":
+                # Tracks other workers on this host resolved or hydrated
+                for i in ids:
+                    if i not in result[kind]:
+                        track = track_cache.get(f"track:{self.market}:{i}")
+                        if track:
+                            result[kind][i] = track
+            missing = [i for i in ids if i not in result[kind]]
+            size = BATCH_SIZES[kind]
+            jobs += [(kind, missing[i:i + size]) for i in range(0, len(missing), size)]
+
+        def fetch(job):
+            kind, batch = job
+            objects = self.spotify_service.get_several(self.access_token, kind, batch)
+            fetched = {object_id: obj for object_id, obj in zip(batch, objects)}
+            metadata_cache.put_many(kind, self.market, fetched)
+            if kind == "tracks":
+                for object_id, obj in fetched.items():
+                    if obj:
+                        track_cache.put(f"track:{self.market}:{object_id}", compact_track(obj))
+            return kind, fetched
+
+        if jobs:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(Config.HYDRATION_WORKERS, len(jobs))) as executor:
+                for kind, fetched in executor.map(fetch, jobs):
+                    result[kind].update(fetched)
+        return result
+
+    def hydrate(self, expand=False):
+        """
+        Returns {"tracks": {id: track or None}, "albums": {...}, "artists": {...}}
+        for everything added. With expand, the albums and artists of the
+        hydrated tracks are fetched too, in a second concurrent round.
+        """
+        result = self._fetch_round(["tracks"] if expand else list(BATCH_SIZES))
+        if expand:
+            for track in result["tracks"].values():
+                if track:
+                    self.add("albums", [track.get("album", {}).get("id")])
+                    self.add("artists", [a.get("id") for a in track.get("artists", [])])
+            result.update(self._fetch_round(["albums", "artists"]))
+        return result
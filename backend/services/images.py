@@ -0,0 +1,196 @@
+import io
+import base64
+import binascii
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from ..config import Config
+
+# Spotify caps the *Base64* request body at 256 KB, so the raw JPEG has to fit
+# in roughly three quarters of that.
+SPOTIFY_COVER_LIMIT = 256 * 1024
+
+
+def _max_jpeg_bytes(max_b64_bytes):
+    return (max_b64_bytes // 4) * 3
+
+
+def _encode_jpeg(img, quality):
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+def _gevent_patched():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
+
+
+def _compress_cover(raw, target_size, max_bytes, min_quality):
+    """
+    Runs inside a worker process: decode, downsize and recompress a cover
+    until the JPEG fits in max_bytes. Returns the JPEG bytes.
+    """
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(raw))
+    img.load()
+
+    # Already a small enough JPEG, nothing to do
+    if img.format == "JPEG" and len(raw) <= max_bytes and max(img.size) <= target_size:
+        return raw
+
+    # JPEG has no alpha channel, flatten onto white
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        img = background
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+
+    img.thumbnail((target_size, target_size), Image.LANCZOS)
+
+    while True:
+        # Binary search for the highest quality that still fits
+        best = None
+        low, high = min_quality, 95
+        while low <= high:
+            quality = (low + high) // 2
+            data = _encode_jpeg(img, quality)
+            if len(data) <= max_bytes:
+                best = data
+                low = quality + 1
+            else:
+                high = quality - 1
+
+        if best is not None:
+            return best
+
+        # Even the lowest quality is too big, shrink and go again
+        if max(img.size) <= 64:
+            raise ValueError("Cover image cannot be compressed under the size limit")
+        img = img.resize((max(1, int(img.width * 0.75)), max(1, int(img.height * 0.75))), Image.LANCZOS)
+
+
+class ImageService:
+    """
+    Prepares playlist cover images for Spotify. Decoding and recompression run
+    in a shared process pool (native threads under gevent) and results are
+    cached by content hash.
+    """
+    _executor = None
+    _executor_lock = threading.Lock()
+    _cache = OrderedDict()
+    _cache_lock = threading.Lock()
+
+    def __init__(self, target_size=None, max_b64_bytes=None):
+        self.target_size = target_size or Config.COVER_IMAGE_SIZE
+        self.max_b64_bytes = max_b64_bytes or Config.COVER_MAX_BYTES
+
+    @classmethod
+    def _get_executor(cls):
+        with cls._executor_lock:
+            if cls._executor is None:
+                if _gevent_patched():
+                    # multiprocessing hangs in monkey-patched gevent workers.
+                    # gevent's pool runs on real OS threads and Pillow releases
+                    # the GIL while resizing/encoding, so the hub keeps serving.
+                    from gevent.threadpool import ThreadPoolExecutor
+                    cls._executor = ThreadPoolExecutor(max_workers=Config.COVER_WORKERS)
+                else:
+                    cls._executor = ProcessPoolExecutor(max_workers=Config.COVER_WORKERS)
+            return cls._executor
+
+    @staticmethod
+    def decode(image_b64):
+        """
+        Validates and decodes a Base64 (optionally data-URL) image string.
+        Raises ValueError on malformed input.
+        """
+        if not image_b64 or not isinstance(image_b64, str):
+            raise ValueError("Cover image must be a Base64 string")
+
+        # Strip header if present (e.g. data:image/jpeg;base64,...)
+        if "," in image_b64:
+            image_b64 = image_b64.split(",", 1)[1]
+        # Line-wrapped Base64 (MIME style) is still valid
+        image_b64 = "".join(image_b64.split())
+
+        try:
+            raw = base64.b64decode(image_b64, validate=True)
+        except (binascii.Error, ValueError) as e:
+            raise ValueError(f"Cover image is not valid Base64: {e}")
+
+        if not raw:
+            raise ValueError("Cover image is empty")
+
+        # Only the header is parsed here, pixels are decoded in the worker
+        from PIL import Image
+        try:
+            with Image.open(io.BytesIO(raw)) as img:
+                img.verify()
+        except Exception as e:
+            raise ValueError(f"Cover image is not a readable image: {e}")
+        return raw
+
+    def prepare_cover_async(self, image_b64):
+        """
+        Starts preparing a cover and returns a Future resolving to the Base64
+        JPEG body ready for upload. Identical images share one Future.
+        """
+        raw = self.decode(image_b64)
+        key = (hashlib.sha256(raw).hexdigest(), self.target_size, self.max_b64_bytes)
+
+        with self._cache_lock:
+            future = self._cache.get(key)
+            if future is not None:
+                self._cache.move_to_end(key)
+                return future
+
+            job = self._get_executor().submit(
+                _compress_cover,
+                raw,
+                self.target_size,
+                _max_jpeg_bytes(self.max_b64_bytes),
+                Config.COVER_MIN_QUALITY
+            )
+            future = _EncodedFuture(job)
+            self._cache[key] = future
+            while len(self._cache) > Config.COVER_CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+        def _evict_on_error(f):
+            if f.exception() is not None:
+                with self._cache_lock:
+                    if self._cache.get(key) is future:
+                        del self._cache[key]
+
+        job.add_done_callback(_evict_on_error)
+        return future
+
+    def prepare_cover(self, image_b64, timeout=None):
+        return self.prepare_cover_async(image_b64).result(timeout=timeout)
+
+
+class _EncodedFuture:
+    """Wraps a worker Future so the Base64 encoding happens once per image."""
+
+    def __init__(self, job):
+        self._job = job
+        self._encoded = None
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._job.done()
+
+    def result(self, timeout=None):
+        jpeg = self._job.result(timeout=timeout)
+        with self._lock:
+            if self._encoded is None:
+                self._encoded = base64.b64encode(jpeg).decode("ascii")
+            return self._encoded
@@ -0,0 +1,15 @@
+import re
+import difflib
+import unicodedata
+
+
+def normalize(text):
+    """Lowercase title or name without bracketed or " - Remastered" suffixes, punctuation and accents."""
+    text = re.sub(r"\s*[\(\[].*?[\)\]]|\s+-\s+.*$", "", text or "")
+    text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return re.sub(r"[^\w\s]", "", text).strip().lower()
+
+
+def similarity(a, b):
+    """How alike two titles or names are once normalized, 0.0 to 1.0."""
+    return difflib.SequenceMatcher(None, normalize(a), normalize(b)).ratio()
@@ -0,0 +1,72 @@
+import gzip
+import json
+import hashlib
+from ..config import Config
+
+_brotli = None
+
+
+def _brotli_module():
+    """The optional brotli package, or False when it isn't installed."""
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli
+
+
+def _pick(row, paths):
+    projected = {}
+    for path in paths:
+        source, target = row, projected
+        *parents, leaf = path.split(".")
+        for name in parents:
+            source = source.get(name) if isinstance(source, dict) else None
+            target = target.setdefault(name, {})
+        if isinstance(source, dict) and leaf in source:
+            target[leaf] = source[leaf]
+    return projected
+
+
+def project(payload, fields):
+    """
+    Keeps only the requested fields of every row, e.g. "id,title,image"
+    or "name,owner.display_name". Rows are the payload itself if it is a
+    list, else its "items" or "tracks" list; the envelope (counts, paging)
+    is kept as is. Unknown fields are left out rather than rejected.
+    """
+    paths = [f.strip() for f in (fields or "").split(",") if f.strip()]
+    if not paths:
+        return payload
+    if isinstance(payload, list):
+        return [_pick(row, paths) for row in payload]
+    if isinstance(payload, dict):
+        for key in ("items", "tracks"):
+            if isinstance(payload.get(key), list):
+                return {**payload, key: [_pick(row, paths) for row in payload[key]]}
+    return payload
+
+
+def encode(payload):
+    """Canonical JSON bytes (sorted keys, no whitespace) and their ETag."""
+    body = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()
+    return body, hashlib.sha1(body).hexdigest()
+
+
+def compress(body, accepted):
+    """
+    (body, Content-Encoding or None) for the codings the client accepts,
+    e.g. {"br", "gzip"}; brotli is preferred when installed. Bodies under
+    RESPONSE_COMPRESS_MIN_BYTES aren't worth the CPU and go out as they are.
+    """
+    if len(body) < Config.RESPONSE_COMPRESS_MIN_BYTES:
+        return body, None
+    brotli = _brotli_module()
+    if brotli and "br" in accepted:
+        return brotli.compress(body, quality=Config.RESPONSE_BROTLI_QUALITY), "br"
+    if "gzip" in accepted:
+        return gzip.compress(body, compresslevel=Config.RESPONSE_GZIP_LEVEL), "gzip"
+    return body, None
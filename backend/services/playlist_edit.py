@@ -0,0 +1,218 @@
+import bisect
+import requests
+from collections import Counter, defaultdict
+from ..config import Config
+
+
+class SnapshotConflict(Exception):
+    """The playlist changed since the snapshot the client was editing."""
+
+    def __init__(self, snapshot_id, uris):
+        super().__init__("Playlist was modified since the given snapshot")
+        self.snapshot_id = snapshot_id
+        self.uris = uris
+
+
+def _longest_increasing(values):
+    """Returns the indices of one longest strictly increasing subsequence."""
+    tails, tail_idx = [], []
+    parent = [-1] * len(values)
+    for i, v in enumerate(values):
+        pos = bisect.bisect_left(tails, v)
+        if pos == len(tails):
+            tails.append(v)
+            tail_idx.append(i)
+        else:
+            tails[pos] = v
+            tail_idx[pos] = i
+        parent[i] = tail_idx[pos - 1] if pos else -1
+
+    result = []
+    i = tail_idx[-1] if tail_idx else -1
+    while i != -1:
+        result.append(i)
+        i = parent[i]
+    return result[::-1]
+
+
+def _batches(count):
+    return -(-count // 100)
+
+
+def request_count(plan):
+    """Number of Spotify write requests needed to apply a plan."""
+    if "replace" in plan:
+        return max(1, _batches(len(plan["replace"])))
+    return (
+        _batches(len(plan["remove"]))
+        + len(plan["moves"])
+        + sum(_batches(len(uris)) for _, uris in plan["inserts"])
+    )
+
+
+def diff_tracks(current, desired):
+    """
+    Computes the edit plan that turns the current URI list into the desired
+    one with as few batched API calls as possible. Returns a dict with:
+      remove: URIs to remove (the API removes every occurrence)
+      moves:  [(range_start, insert_before, range_length)] applied in order
+      inserts: [(position, [uris])] applied in order
+    or {"replace": desired} when rewriting the whole list takes fewer calls.
+    """
+    current_counts, desired_counts = Counter(current), Counter(desired)
+
+    # Spotify removes all occurrences of a URI, so a URI that has to lose
+    # some copies is removed entirely and its remaining copies re-inserted.
+    remove = [uri for uri in current_counts if current_counts[uri] > desired_counts[uri]]
+    removed = set(remove)
+
+    # Tag each occurrence so duplicates stay distinguishable: (uri, nth copy)
+    seen = defaultdict(int)
+    kept = []
+    for uri in current:
+        if uri in removed:
+            continue
+        kept.append((uri, seen[uri]))
+        seen[uri] += 1
+
+    seen = defaultdict(int)
+    target = []
+    for uri in desired:
+        target.append((uri, seen[uri]))
+        seen[uri] += 1
+
+    kept_set = set(kept)
+    target_index = {item: i for i, item in enumerate(target)}
+    ordered = [item for item in target if item in kept_set]
+
+    # Tracks on the longest run already in the right relative order stay put,
+    # everything else kept is moved once.
+    anchored = {kept[i] for i in _longest_increasing([target_index[item] for item in kept])}
+
+    moves = []
+    simulated = list(kept)
+    t = 0
+    while t < len(ordered):
+        item = ordered[t]
+        if item in anchored:
+            t += 1
+            continue
+
+        start = simulated.index(item)
+        # Extend the range while the next tracks also need moving and
+        # already sit right behind this one
+        length = 1
+        while (t + length < len(ordered)
+               and start + length < len(simulated)
+               and ordered[t + length] not in anchored
+               and simulated[start + length] == ordered[t + length]):
+            length += 1
+
+        insert_before = simulated.index(ordered[t - 1]) + 1 if t else 0
+        if insert_before != start:
+            moves.append((start, insert_before, length))
+            block = simulated[start:start + length]
+            del simulated[start:start + length]
+            at = insert_before if insert_before < start else insert_before - length
+            simulated[at:at] = block
+        t += length
+
+    # Everything left in the desired list is new, insert runs left to right
+    inserts = []
+    for i, item in enumerate(target):
+        if item in kept_set:
+            continue
+        if inserts and inserts[-1][0] + len(inserts[-1][1]) == i:
+            inserts[-1][1].append(item[0])
+        else:
+            inserts.append((i, [item[0]]))
+
+    plan = {"remove": remove, "moves": moves, "inserts": inserts}
+    if request_count(plan) > request_count({"replace": desired}):
+        return {"replace": list(desired)}
+    return plan
+
+
+def _is_snapshot_conflict(response):
+    """
+    True if Spotify rejected an edit because the snapshot_id is stale:
+    409/412, or a 400 whose error message is about the snapshot.
+    """
+    if response is None:
+        return False
+    if response.status_code in (409, 412):
+        return True
+    if response.status_code != 400:
+        return False
+    try:
+        message = response.json().get("error", {}).get("message", "")
+    except ValueError:
+        return False
+    return "snapshot" in str(message).lower()
+
+
+class PlaylistEditService:
+    """
+    Applies a desired track list to an existing playlist using the minimal
+    set of removals, moves and inserts, chained through snapshot IDs.
+    """
+
+    def __init__(self, spotify_service, access_token):
+        self.spotify_service = spotify_service
+        self.access_token = access_token
+
+    def apply(self, playlist_id, desired, expected_snapshot=None, dry_run=False):
+        """
+        Edits the playlist to match desired. If expected_snapshot is given and
+        the playlist has changed since, raises SnapshotConflict. If the
+        playlist changes while edits are applied, the diff is recomputed from
+        the fresh state and retried.
+        """
+        attempts = 0
+        while True:
+            snapshot_id, current = self.spotify_service.get_playlist_tracks(self.access_token, playlist_id)
+            if expected_snapshot and snapshot_id != expected_snapshot:
+                raise SnapshotConflict(snapshot_id, current)
+
+            plan = diff_tracks(current, desired)
+            if "replace" in plan:
+                summary = {"replaced": len(desired), "requests": request_count(plan)}
+            else:
+                summary = {
+                    "removed": len(plan["remove"]),
+                    "moved": sum(length for _, _, length in plan["moves"]),
+                    "inserted": sum(len(uris) for _, uris in plan["inserts"]),
+                    "requests": request_count(plan)
+                }
+            if dry_run:
+                return snapshot_id, summary
+
+            try:
+                return self._execute(playlist_id, plan, snapshot_id), summary
+            except requests.HTTPError as e:
+                attempts += 1
+                # Stale snapshot: someone else edited mid-way, rebase and retry.
+                # Anything else (bad URIs, bad ranges) won't get better on retry.
+                if not _is_snapshot_conflict(e.response) or attempts > Config.PLAYLIST_EDIT_RETRIES:
+                    raise
+                print(f"Playlist edit conflict ({e.response.status_code}), retrying from fresh snapshot")
+                expected_snapshot = None
+
+    def _execute(self, playlist_id, plan, snapshot_id):
+        sp, token = self.spotify_service, self.access_token
+
+        if "replace" in plan:
+            return sp.replace_playlist_tracks(token, playlist_id, plan["replace"])
+
+        if plan["remove"]:
+            snapshot_id = sp.remove_tracks_from_playlist(token, playlist_id, plan["remove"], snapshot_id)
+
+        for range_start, insert_before, range_length in plan["moves"]:
+            snapshot_id = sp.reorder_playlist_tracks(
+                token, playlist_id, range_start, insert_before, range_length, snapshot_id
+            )
+
+        for position, uris in plan["inserts"]:
+            snapshot_id = sp.add_tracks_to_playlist(token, playlist_id, uris, position, snapshot_id)
+
+        return snapshot_id
@@ -0,0 +1,73 @@
+import threading
+from .resilience import DeadlineExceeded
+
+# Most URIs Spotify accepts per add-tracks call
+INSERT_BATCH = 100
+
+
+class PlaylistAppender:
+    """
+    Appends tracks to a playlist while they are still being found. URIs
+    passed to add() are sent by one background thread in the order they
+    arrived: it waits for the playlist to exist, then each insert takes
+    everything queued so far (up to 100), so inserts overlap with the
+    search and batches grow on their own when Spotify is slow.
+
+        appender = PlaylistAppender(spotify_service, access_token, playlist_future)
+        appender.add([track['uri']])
+        added = appender.close(timeout=deadline.remaining())
+    """
+
+    def __init__(self, spotify_service, access_token, playlist_future, added=None):
+        self.spotify_service = spotify_service
+        self.access_token = access_token
+        # Future of the playlist ID, e.g. from an executor creating it
+        self.playlist_future = playlist_future
+        # URIs Spotify confirmed, shared with the caller so a retry can resume
+        self.added = added if added is not None else []
+        self._seen = set(self.added)
+        self._pending = []
+        self._closed = False
+        self._error = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, uris):
+        """Queues URIs not added or queued before. Raises the insert thread's error, if any."""
+        with self._cond:
+            if self._error:
+                raise self._error
+            for uri in uris:
+                if uri not in self._seen:
+                    self._seen.add(uri)
+                    self._pending.append(uri)
+            self._cond.notify()
+
+    def close(self, timeout=None):
+        """Waits for the queued inserts and returns every URI added."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            raise DeadlineExceeded("Timed out adding tracks to the playlist")
+        if self._error:
+            raise self._error
+        return self.added
+
+    def _run(self):
+        try:
+            playlist_id = self.playlist_future.result()
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._pending or self._closed)
+                    if not self._pending:
+                        return
+                    batch = self._pending[:INSERT_BATCH]
+                    del self._pending[:INSERT_BATCH]
+                self.spotify_service.add_tracks_to_playlist(self.access_token, playlist_id, batch)
+                self.added.extend(batch)
+        except Exception as e:
+            with self._cond:
+                self._error = e
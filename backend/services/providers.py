@@ -0,0 +1,176 @@
+import json
+import time
+import random
+import threading
+from collections import deque
+from ..config import Config
+
+
+class ProviderStats:
+    """Rolling latency samples and success/failure counts for one provider."""
+
+    def __init__(self, window=200):
+        self.latencies = deque(maxlen=window)
+        self.successes = 0
+        self.failures = 0
+        self.hedges_won = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency, ok):
+        with self._lock:
+            if ok:
+                self.successes += 1
+                self.latencies.append(latency)
+            else:
+                self.failures += 1
+
+    def record_hedge_win(self):
+        with self._lock:
+            self.hedges_won += 1
+
+    def percentile(self, p, min_samples=5):
+        """Latency percentile in seconds, or None until enough samples exist."""
+        with self._lock:
+            if len(self.latencies) < min_samples:
+                return None
+            return _percentile(self.latencies, p)
+
+    def snapshot(self):
+        with self._lock:
+            total = self.successes + self.failures
+            return {
+                "successes": self.successes,
+                "failures": self.failures,
+                "success_rate": round(self.successes / total, 3) if total else None,
+                "hedges_won": self.hedges_won,
+                "p50_ms": _ms(_percentile(self.latencies, 50)),
+                "p90_ms": _ms(_percentile(self.latencies, 90)),
+            }
+
+
+def _percentile(samples, p):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def _ms(seconds):
+    return round(seconds * 1000) if seconds is not None else None
+
+
+class GeminiProvider:
+    def __init__(self, model_name, api_key):
+        # Imported on first use, the SDK pulls in grpc/protobuf and takes
+        # most of the backend's import time
+        import google.generativeai as genai
+
+        # gRPC blocks gevent workers, they use the REST transport instead
+        genai.configure(api_key=api_key, transport=Config.GEMINI_TRANSPORT)
+        self.name = f"gemini:{model_name}"
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt, timeout):
+        response = self.model.generate_content(
+            prompt,
+            generation_config={"response_mime_type": "application/json"},
+            request_options={"timeout": timeout}
+        )
+        usage = getattr(response, "usage_metadata", None)
+        return response.text, {
+            "prompt_tokens": getattr(usage, "prompt_token_count", 0) or 0,
+            "output_tokens": getattr(usage, "candidates_token_count", 0) or 0
+        }
+
+
+class OpenAIProvider:
+    def __init__(self, model_name, api_key):
+        # Optional dependency, only needed when an OpenAI provider is configured
+        from openai import OpenAI
+
+        self.name = f"openai:{model_name}"
+        self.model_name = model_name
+        self.client = OpenAI(api_key=api_key)
+
+    def generate(self, prompt, timeout):
+        # JSON mode only allows objects, so the array is wrapped under "songs"
+        response = self.client.chat.completions.create(
+            model=self.model_name,
+            messages=[{
+                "role": "user",
+                "content": prompt + '\nWrap the array in an object: {"songs": [...]}.'
+            }],
+            response_format={"type": "json_object"},
+            timeout=timeout
+        )
+        return response.choices[0].message.content, {
+            "prompt_tokens": response.usage.prompt_tokens if response.usage else 0,
+            "output_tokens": response.usage.completion_tokens if response.usage else 0
+        }
+
+
+class FakeProvider:
+    """
+    Offline provider for development and tests. Returns numbered songs (or,
+    for a refinement prompt, a refinement object) after a configurable
+    delay, or fails when fail=True.
+    """
+
+    def __init__(self, name="fake", latency=0.0, jitter=0.0, fail=False, songs=None):
+        self.name = name
+        self.latency = latency
+        self.jitter = jitter
+        self.fail = fail
+        self.songs = songs
+
+    def generate(self, prompt, timeout):
+        """Returns (text, usage) like the real providers, tokens estimated at 4 chars each."""
+        delay = self.latency + random.uniform(0, self.jitter)
+        time.sleep(min(delay, timeout))
+        if self.fail or delay > timeout:
+            raise TimeoutError(f"{self.name} did not answer")
+        if self.songs is not None:
+            return self._answer(prompt, json.dumps(self.songs))
+        if '"reply"' in prompt:
+            return self._answer(prompt, json.dumps({
+                "reply": "Added a fake song.",
+                "remove": [],
+                "add": [{"name": "Fake Refinement", "artist": "Fake Artist"}]
+            }))
+
+        # Honour the requested count so callers get realistic sizes
+        count = 20
+        for word in prompt.split():
+            if word.isdigit():
+                count = int(word)
+                break
+        return self._answer(prompt, json.dumps([{"name": f"Fake Song {i + 1}", "artist": "Fake Artist"} for i in range(count)]))
+
+    @staticmethod
+    def _answer(prompt, text):
+        return text, {"prompt_tokens": len(prompt) // 4, "output_tokens": len(text) // 4}
+
+
+def build_provider(spec):
+    """
+    Builds a provider from a spec like "gemini", "gemini:gemini-2.0-flash-lite",
+    "openai:gpt-4o-mini", "fake" or "fake:<latency seconds>". Returns None if it isn't configured.
+    A provider's generate(prompt, timeout) returns (text, {"prompt_tokens", "output_tokens"}).
+    """
+    kind, _, model_name = spec.strip().partition(":")
+    kind = kind.lower()
+
+    if kind == "gemini":
+        if not Config.GENAI_API_KEY:
+            return None
+        return GeminiProvider(model_name or Config.GEMINI_MODEL, Config.GENAI_API_KEY)
+    if kind == "openai":
+        if not Config.OPENAI_API_KEY:
+            return None
+        return OpenAIProvider(model_name or Config.OPENAI_MODEL, Config.OPENAI_API_KEY)
+    if kind == "fake":
+        # "fake:1.5" answers after 1.5s, handy for load tests
+        return FakeProvider(name=spec.strip(), latency=float(model_name or 0))
+
+    print(f"Unknown AI provider '{spec}', skipping")
+    return None
@@ -0,0 +1,404 @@
+import os
+import re
+import json
+import zlib
+import threading
+import numpy as np
+from ..config import Config
+from .matching import normalize
+
+try:
+    import fcntl
+except ImportError: # Windows: no cross-process write lock, single worker only
+    fcntl = None
+
+AUDIO_KEYS = ("energy", "valence", "danceability", "acousticness",
+              "instrumentalness", "speechiness", "liveness", "tempo")
+DECADES = tuple(range(1950, 2030, 10))
+# Few enough genre tokens collide at this size that unrelated genres don't match
+GENRE_DIMS = 256
+
+# Vector layout: [audio | has_audio | decade one-hot | popularity | genre tokens].
+# Artists aren't hashed into the vector, they are matched exactly on the
+# index's metadata. Bump LAYOUT when this changes, old index files are ignored.
+AUDIO = slice(0, len(AUDIO_KEYS))
+HAS_AUDIO = len(AUDIO_KEYS)
+DECADE = slice(HAS_AUDIO + 1, HAS_AUDIO + 1 + len(DECADES))
+POPULARITY = DECADE.stop
+GENRE = slice(POPULARITY + 1, POPULARITY + 1 + GENRE_DIMS)
+DIM = GENRE.stop
+LAYOUT = 2
+
+# Rough audio targets for common moods, only the listed features are compared
+MOODS = {
+    "happy": {"valence": 0.8, "energy": 0.7},
+    "sad": {"valence": 0.2, "energy": 0.3},
+    "energetic": {"energy": 0.9, "danceability": 0.7},
+    "upbeat": {"energy": 0.8, "valence": 0.7},
+    "chill": {"energy": 0.3, "acousticness": 0.6},
+    "relaxed": {"energy": 0.3, "acousticness": 0.6},
+    "calm": {"energy": 0.2, "acousticness": 0.7},
+    "focus": {"energy": 0.4, "instrumentalness": 0.6, "speechiness": 0.05},
+    "party": {"danceability": 0.85, "energy": 0.85},
+    "romantic": {"valence": 0.6, "energy": 0.4, "acousticness": 0.5},
+    "angry": {"energy": 0.95, "valence": 0.25},
+    "melancholic": {"valence": 0.25, "energy": 0.35},
+    "workout": {"energy": 0.9, "tempo": 0.65},
+}
+
+BLOCK_WEIGHTS = {"audio": 1.0, "decade": 1.0, "genre": 1.5, "artist": 2.0}
+
+
+def _bucket(text, dims):
+    # crc32 is stable across processes, unlike hash()
+    return zlib.crc32(text.encode()) % dims
+
+
+def _tokens(text):
+    return re.findall(r"[a-z0-9]+", str(text).lower())
+
+
+def artist_keys(artist):
+    """
+    Keys an artist matches on: its Spotify ID and its normalized name.
+    artist is a track's artist object or a preference, a name or an object.
+    """
+    if not isinstance(artist, dict):
+        artist = {"id": str(artist).strip(), "name": str(artist)}
+    keys = set()
+    if artist.get('id'):
+        keys.add("id:" + artist['id'])
+    if normalize(artist.get('name')):
+        keys.add("name:" + normalize(artist['name']))
+    return keys
+
+
+def _decade(value):
+    """Parses "80s", "1980s", "1985" or "1985-06-01" into 1980."""
+    match = re.search(r"(\d{2,4})", str(value))
+    if not match:
+        return None
+    year = int(match.group(1))
+    if year < 100:
+        year += 1900 if year >= 30 else 2000
+    return year // 10 * 10
+
+
+def track_vector(track, features=None, genres=()):
+    vec = np.zeros(DIM, dtype=np.float32)
+    if features:
+        for i, key in enumerate(AUDIO_KEYS):
+            value = features.get(key) or 0.0
+            vec[i] = min(value / 200.0, 1.0) if key == "tempo" else value
+        vec[HAS_AUDIO] = 1.0
+
+    decade = _decade(track.get('album', {}).get('release_date'))
+    if decade in DECADES:
+        vec[DECADE.start + DECADES.index(decade)] = 1.0
+
+    vec[POPULARITY] = (track.get('popularity') or 0) / 100.0
+
+    for token in {t for g in genres for t in _tokens(g)}:
+        vec[GENRE.start + _bucket(token, GENRE_DIMS)] += 1.0
+    norm = np.linalg.norm(vec[GENRE])
+    if norm:
+        vec[GENRE] /= norm
+    return vec
+
+
+def query_vector(preferences):
+    """
+    Turns a preferences dict into (query vector, active blocks). Blocks the
+    preferences say nothing about are left out of the score; the "artist"
+    block is the set of artist_keys to match.
+    """
+    vec = np.zeros(DIM, dtype=np.float32)
+    blocks = {}
+
+    audio_mask = np.zeros(len(AUDIO_KEYS), dtype=np.float32)
+    for mood in preferences.get("moods") or []:
+        for key, target in MOODS.get(str(mood).strip().lower(), {}).items():
+            i = AUDIO_KEYS.index(key)
+            # Average targets when several moods mention the same feature
+            vec[i] = (vec[i] * audio_mask[i] + target) / (audio_mask[i] + 1)
+            audio_mask[i] += 1
+    if audio_mask.any():
+        blocks["audio"] = audio_mask > 0
+
+    for value in preferences.get("decades") or []:
+        decade = _decade(value)
+        if decade in DECADES:
+            vec[DECADE.start + DECADES.index(decade)] = 1.0
+            blocks["decade"] = True
+
+    for token in {t for g in preferences.get("genres") or [] for t in _tokens(g)}:
+        vec[GENRE.start + _bucket(token, GENRE_DIMS)] += 1.0
+        blocks["genre"] = True
+    norm = np.linalg.norm(vec[GENRE])
+    if norm:
+        vec[GENRE] /= norm
+
+    artists = set().union(*(artist_keys(a) for a in preferences.get("artists") or []))
+    if artists:
+        blocks["artist"] = artists
+
+    return vec, blocks
+
+
+def score_block(X, q, blocks, artist_match=None):
+    """
+    Scores a (rows x DIM) block of vectors against one query, in [0, 1].
+    artist_match flags the rows by a requested artist, for the "artist" block.
+    """
+    total = np.zeros(len(X), dtype=np.float32)
+    weight = 0.0
+
+    if "audio" in blocks:
+        mask = blocks["audio"]
+        diff = np.abs(X[:, AUDIO][:, mask] - q[AUDIO][mask]).mean(axis=1)
+        # Tracks without audio features get a neutral score
+        audio = np.where(X[:, HAS_AUDIO] > 0, 1.0 - diff, 0.5)
+        total += BLOCK_WEIGHTS["audio"] * audio
+        weight += BLOCK_WEIGHTS["audio"]
+    if "decade" in blocks:
+        total += BLOCK_WEIGHTS["decade"] * (X[:, DECADE] @ q[DECADE])
+        weight += BLOCK_WEIGHTS["decade"]
+    if "genre" in blocks:
+        # Tracks whose artist has no genres on Spotify get a neutral score
+        genre = np.where(X[:, GENRE].any(axis=1), X[:, GENRE] @ q[GENRE], 0.5)
+        total += BLOCK_WEIGHTS["genre"] * genre
+        weight += BLOCK_WEIGHTS["genre"]
+    if "artist" in blocks:
+        if artist_match is not None:
+            total += BLOCK_WEIGHTS["artist"] * artist_match
+        weight += BLOCK_WEIGHTS["artist"]
+
+    if not weight:
+        # No usable preferences: fall back to popularity
+        return X[:, POPULARITY].copy()
+    return total / weight
+
+
+class TrackIndex:
+    """
+    On-disk index of every track we've resolved. Vectors live in a
+    memory-mapped float32 file (rows x DIM), metadata in a JSONL file whose
+    line count is the committed row count. A track is indexed once per
+    market it was resolved in. Appends take an exclusive file lock so
+    several workers can share one index directory.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or Config.RECOMMENDER_DIR
+        self.vectors_path = os.path.join(self.directory, f"vectors.v{LAYOUT}.f32")
+        self.meta_path = os.path.join(self.directory, f"tracks.v{LAYOUT}.jsonl")
+        self.lock_path = os.path.join(self.directory, "index.lock")
+        self._lock = threading.Lock()
+        self._meta = []
+        # (track ID, market) -> row
+        self._keys = {}
+        # Track ID -> rows, and artist key -> rows
+        self._ids = {}
+        self._artists = {}
+        self._meta_offset = 0
+        self._vectors = None
+
+    def __len__(self):
+        self.refresh()
+        return len(self._meta)
+
+    def refresh(self):
+        """Picks up rows appended by this or any other process."""
+        with self._lock:
+            if not os.path.exists(self.meta_path):
+                return
+            if os.path.getsize(self.meta_path) == self._meta_offset:
+                return
+            with open(self.meta_path, "rb") as f:
+                f.seek(self._meta_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break # Partially written line, picked up next time
+                    self._meta_offset += len(line)
+                    row = json.loads(line)
+                    n = len(self._meta)
+                    self._keys[(row["id"], row.get("market"))] = n
+                    self._ids.setdefault(row["id"], []).append(n)
+                    for artist in row.get("artists", []):
+                        for key in artist_keys(artist):
+                            self._artists.setdefault(key, []).append(n)
+                    self._meta.append(row)
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(len(self._meta), DIM)) if self._meta else None
+
+    def contains(self, track_id, market=None):
+        self.refresh()
+        return (track_id, market) in self._keys
+
+    def add(self, rows, market=None):
+        """
+        Appends [(track, vector)] for tracks not indexed in this market yet,
+        tagged with the market they were resolved in. Vectors are written before metadata so
+        a crash never exposes a row without one.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                rows = [(t, v) for t, v in rows if (t['id'], market) not in self._keys]
+                if not rows:
+                    return 0
+
+                start = len(self._meta)
+                matrix = np.stack([v for _, v in rows]).astype(np.float32)
+                with open(self.vectors_path, "ab") as f:
+                    f.truncate(start * DIM * 4) # Drop rows from a crashed append
+                    f.write(matrix.tobytes())
+
+                with open(self.meta_path, "a") as f:
+                    for track, _ in rows:
+                        f.write(json.dumps(_compact(track, market)) + "\n")
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        self.refresh()
+        return len(rows)
+
+    def search(self, queries, k=20, max_per_artist=2, exclude_ids=(), market=None):
+        """
+        Batched nearest-neighbour search. queries is a list of
+        (vector, blocks) from query_vector. Returns, per query, a list of
+        (score, track) best first, with at most max_per_artist per artist.
+        With a market, tracks resolved in another market are skipped.
+        """
+        self.refresh()
+        if self._vectors is None:
+            return [[] for _ in queries]
+
+        exclude = {row for i in exclude_ids for row in self._ids.get(i, ())}
+        # Over-fetch so the per-artist cap and exclusions can be applied after
+        fetch = min(len(self._meta), k * (max_per_artist + 3) + len(exclude))
+        chunk = Config.RECOMMENDER_CHUNK_ROWS
+        results = []
+        for q, blocks in queries:
+            artist_rows = np.zeros(len(self._meta), dtype=np.float32)
+            for key in blocks.get("artist", ()):
+                artist_rows[self._artists.get(key, [])] = 1.0
+            best_scores = np.empty(0, dtype=np.float32)
+            best_rows = np.empty(0, dtype=np.int64)
+            for start in range(0, len(self._meta), chunk):
+                scores = score_block(
+                    np.asarray(self._vectors[start:start + chunk]), q, blocks, artist_rows[start:start + chunk]
+                )
+                top = np.argpartition(-scores, min(fetch, len(scores)) - 1)[:fetch]
+                best_scores = np.concatenate([best_scores, scores[top]])
+                best_rows = np.concatenate([best_rows, top + start])
+                keep = np.argsort(-best_scores)[:fetch]
+                best_scores, best_rows = best_scores[keep], best_rows[keep]
+
+            picked, per_artist = [], {}
+            for score, row in zip(best_scores, best_rows):
+                if row in exclude:
+                    continue
+                track = self._meta[row]
+                if market and track.get('market') not in (None, market):
+                    continue
+                artist = track['artists'][0]['name'] if track.get('artists') else ""
+                if per_artist.get(artist, 0) >= max_per_artist:
+                    continue
+                per_artist[artist] = per_artist.get(artist, 0) + 1
+                picked.append((float(score), track))
+                if len(picked) == k:
+                    break
+            results.append(picked)
+        return results
+
+
+def _compact(track, market=None):
+    """Keeps just the fields previews, stats and sequencing need."""
+    album = track.get('album', {})
+    return {
+        "id": track['id'],
+        "uri": track['uri'],
+        "name": track['name'],
+        "artists": [{"id": a.get('id'), "name": a['name']} for a in track.get('artists', [])],
+        "album": {
+            "name": album.get('name'),
+            "images": album.get('images', []),
+            "release_date": album.get('release_date')
+        },
+        "duration_ms": track.get('duration_ms', 0),
+        "popularity": track.get('popularity'),
+        "preview_url": track.get('preview_url'),
+        "market": market
+    }
+
+
+class RecommenderService:
+    """
+    AI-free recommendations from the local TrackIndex. Used as a fast path
+    or fallback for /Generate_Preview and fed with every resolved track.
+    """
+    _index = None
+    _index_lock = threading.Lock()
+
+    def __init__(self, spotify_service=None, access_token=None):
+        self.spotify_service = spotify_service
+        self.access_token = access_token
+
+    @classmethod
+    def index(cls):
+        with cls._index_lock:
+            if cls._index is None:
+                cls._index = TrackIndex()
+            return cls._index
+
+    def recommend(self, preferences, count, exclude_ids=(), market=None):
+        """
+        Returns up to count tracks scoring at least RECOMMENDER_MIN_SCORE for
+        the preferences, best first, only ones resolved in market if given.
+        """
+        if not Config.RECOMMENDER_ENABLED:
+            return []
+        try:
+            matches = self.index().search([query_vector(preferences)], k=count, exclude_ids=exclude_ids, market=market)[0]
+        except Exception as e:
+            print(f"Track index lookup failed: {e}")
+            return []
+        return [t for score, t in matches if score >= Config.RECOMMENDER_MIN_SCORE]
+
+    def index_tracks(self, tracks):
+        """Embeds and stores tracks not yet indexed. Returns how many were added."""
+        index = self.index()
+        market = self.spotify_service.market if self.spotify_service else None
+        tracks = [t for t in tracks if t.get('id') and not index.contains(t['id'], market)]
+        if not tracks:
+            return 0
+
+        features, artists = {}, {}
+        if self.spotify_service and self.access_token:
+            features = self.spotify_service.get_audio_features(self.access_token, [t['id'] for t in tracks])
+            artists = self.spotify_service.get_artists(
+                self.access_token, [a.get('id') for t in tracks for a in t.get('artists', [])[:1]]
+            )
+
+        rows = []
+        for t in tracks:
+            artist_id = t['artists'][0].get('id') if t.get('artists') else None
+            genres = (artists.get(artist_id) or {}).get('genres', [])
+            rows.append((t, track_vector(t, features.get(t['id']), genres)))
+        return index.add(rows, market=market)
+
+    def index_tracks_async(self, tracks):
+        """Indexes in a background thread so previews aren't slowed down."""
+        if not Config.RECOMMENDER_ENABLED or not tracks:
+            return
+
+        def run():
+            try:
+                self.index_tracks(tracks)
+            except Exception as e:
+                print(f"Track indexing failed: {e}")
+
+        threading.Thread(target=run, daemon=True).start()
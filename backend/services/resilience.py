@@ -0,0 +1,118 @@
+import time
+import threading
+from ..config import Config
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out before the call could be made."""
+
+
+class CircuitOpenError(Exception):
+    """The upstream endpoint is failing and calls are being short-circuited."""
+
+
+class Deadline:
+    """
+    Time budget for one incoming request. Created in the route and passed
+    down to services so every upstream call uses what is left of it.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    def cap(self, timeout):
+        """Returns timeout limited to the remaining budget, or raises DeadlineExceeded."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Request deadline of {self.seconds}s exceeded")
+        return min(timeout, remaining) if timeout is not None else remaining
+
+
+def cap_timeout(deadline, timeout):
+    """cap() that also accepts a missing deadline."""
+    return deadline.cap(timeout) if deadline else timeout
+
+
+class CircuitBreaker:
+    """
+    Classic closed / open / half-open breaker. After failure_threshold
+    consecutive failures the circuit opens and calls fail fast for
+    reset_timeout seconds, then a single trial call decides whether to close.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or Config.BREAKER_FAILURE_THRESHOLD
+        self.reset_timeout = reset_timeout or Config.BREAKER_RESET_TIMEOUT
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raises CircuitOpenError if the call should not be attempted."""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+
+            if self.state == self.HALF_OPEN:
+                if self._trial_in_flight:
+                    raise CircuitOpenError(f"{self.name} is recovering (circuit half-open)")
+                self._trial_in_flight = True
+
+    def release(self):
+        """Frees the half-open trial taken by a before_call() whose call never ran."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"Circuit opened for {self.name}")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def snapshot(self):
+        with self._lock:
+            return {"state": self.state, "failures": self.failures}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """Returns the process-wide breaker for an upstream endpoint."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
+
+
+def breaker_states():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {b.name: b.snapshot() for b in breakers}
@@ -0,0 +1,197 @@
+import time
+import numpy as np
+from ..config import Config
+
+# Energy curve shapes, expressed as quantile levels of the playlist's own
+# energy values so every target is reachable with the tracks we have.
+CURVES = {
+    "build_up": lambda x: x,
+    "wind_down": lambda x: 1.0 - x,
+    "peak": lambda x: np.interp(x, [0.0, 0.7, 1.0], [0.0, 1.0, 0.4]),
+    "wave": lambda x: 0.5 - 0.5 * np.cos(x * 4 * np.pi),
+}
+
+
+def normalize_curve(curve):
+    """Maps user input like "Build Up" or "wind-down" to a CURVES key, or None."""
+    if not curve or not isinstance(curve, str):
+        return None
+    key = curve.strip().lower().replace("-", "_").replace(" ", "_")
+    return key if key in CURVES else None
+
+
+def camelot(key, mode):
+    """
+    Converts Spotify pitch class (0-11) and mode (1 major, 0 minor) arrays to
+    Camelot wheel numbers (1-12). C major is 8B, A minor is 8A.
+    """
+    relative_major = np.where(mode == 1, key, (key + 3) % 12)
+    return (relative_major * 7 + 7) % 12 + 1
+
+
+class SequencingService:
+    """
+    Orders tracks so consecutive songs transition smoothly (tempo, harmonic key
+    and energy), optionally following an energy curve across the playlist.
+    Uses a greedy walk over a pairwise cost matrix, refined with 2-opt.
+    """
+    TEMPO_WEIGHT = 1.0
+    KEY_WEIGHT = 1.0
+    ENERGY_WEIGHT = 1.0
+    CURVE_WEIGHT = 2.0
+
+    def __init__(self, spotify_service, access_token):
+        self.spotify_service = spotify_service
+        self.access_token = access_token
+
+    def order(self, tracks, curve=None):
+        """
+        Returns the tracks reordered. Tracks come back unchanged when there are
+        too few of them or Spotify has no audio features for them.
+        """
+        if len(tracks) < 3:
+            return tracks
+
+        features = self.spotify_service.get_audio_features(
+            self.access_token, [t['id'] for t in tracks]
+        )
+        matrix = self._feature_matrix([features.get(t['id']) for t in tracks])
+        if matrix is None:
+            return tracks
+
+        # The time budget covers the whole ordering step, not the feature fetch
+        deadline = time.perf_counter() + Config.SEQUENCING_TIME_BUDGET_MS / 1000
+        tempo, key, mode, energy = matrix
+        cost = self.transition_costs(tempo, key, mode, energy)
+
+        target = None
+        curve = normalize_curve(curve)
+        if curve:
+            shape = CURVES[curve](np.linspace(0.0, 1.0, len(tracks)))
+            target = np.quantile(energy, np.clip(shape, 0.0, 1.0))
+
+        path = self._greedy(cost, energy, target)
+        path = self._two_opt(path, cost, energy, target, deadline)
+        return [tracks[i] for i in path]
+
+    @staticmethod
+    def _feature_matrix(rows):
+        if not any(rows):
+            return None
+
+        def column(name, fill):
+            values = np.array([
+                (r.get(name) if r and r.get(name) is not None else np.nan) for r in rows
+            ], dtype=np.float64)
+            # Impute tracks without features with the playlist median
+            missing = np.isnan(values)
+            if missing.all():
+                values[:] = fill
+            elif missing.any():
+                values[missing] = np.nanmedian(values)
+            return values
+
+        tempo = column("tempo", 120.0)
+        key = column("key", 0.0)
+        key[key < 0] = 0  # -1 means no key detected
+        mode = column("mode", 1.0)
+        energy = column("energy", 0.5)
+        return tempo, key.astype(np.int64), np.round(mode).astype(np.int64), energy
+
+    def transition_costs(self, tempo, key, mode, energy):
+        """Builds the symmetric n x n transition cost matrix."""
+        # Tempo: allow half/double time mixes, 20 BPM apart counts as a full step
+        t1, t2 = tempo[:, None], tempo[None, :]
+        tempo_cost = np.abs(t1 - t2)
+        np.minimum(tempo_cost, np.abs(2 * t1 - t2), out=tempo_cost)
+        np.minimum(tempo_cost, np.abs(t1 - 2 * t2), out=tempo_cost)
+        tempo_cost /= 20.0
+        np.minimum(tempo_cost, 1.0, out=tempo_cost)
+
+        # Harmonic: same Camelot number, or +-1 with the same letter, mixes cleanly
+        wheel = camelot(key, mode)
+        step = np.abs(wheel[:, None] - wheel[None, :])
+        step = np.minimum(step, 12 - step)
+        letter = (mode[:, None] != mode[None, :]).astype(np.float64)
+        compatible = (step == 0) | ((step == 1) & (letter == 0))
+        key_cost = np.where(compatible, 0.0, np.minimum((step + letter) / 6.0, 1.0))
+
+        energy_cost = np.abs(energy[:, None] - energy[None, :])
+
+        cost = (
+            self.TEMPO_WEIGHT * tempo_cost
+            + self.KEY_WEIGHT * key_cost
+            + self.ENERGY_WEIGHT * energy_cost
+        )
+        np.fill_diagonal(cost, np.inf)
+        return cost
+
+    def _greedy(self, cost, energy, target):
+        n = len(energy)
+        if target is not None:
+            current = int(np.argmin(np.abs(energy - target[0])))
+        else:
+            # Start from the track that is hardest to place anywhere else
+            finite = np.where(np.isinf(cost), 0.0, cost)
+            current = int(np.argmax(finite.sum(axis=1)))
+
+        visited = np.zeros(n, dtype=bool)
+        visited[current] = True
+        path = [current]
+        for position in range(1, n):
+            step = cost[current].copy()
+            if target is not None:
+                step += self.CURVE_WEIGHT * np.abs(energy - target[position])
+            step[visited] = np.inf
+            current = int(np.argmin(step))
+            visited[current] = True
+            path.append(current)
+        return np.array(path)
+
+    def _two_opt(self, path, cost, energy, target, deadline):
+        """
+        Segment-reversal local search on the open path. Each position scans
+        all segment ends at once; with an energy curve the scan is limited
+        to a window because position costs change under reversal.
+        """
+        n = len(path)
+        window = n if target is None else min(n, Config.SEQUENCING_CURVE_WINDOW)
+        if target is not None:
+            grid = np.add.outer(np.arange(window), np.arange(window))
+
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            improved = False
+            for i in range(n - 1):
+                if time.perf_counter() >= deadline:
+                    break
+
+                js = np.arange(i + 1, min(n, i + window))
+                if not len(js):
+                    continue
+                oi, oj = path[i], path[js]
+
+                delta = np.zeros(len(js))
+                if i > 0:
+                    prev = path[i - 1]
+                    delta += cost[prev, oj] - cost[prev, oi]
+                after = js + 1
+                has_next = after < n
+                nxt = path[np.minimum(after, n - 1)]
+                delta += np.where(has_next, cost[oi, nxt] - cost[oj, nxt], 0.0)
+
+                if target is not None:
+                    m = len(js) + 1
+                    block = np.abs(energy[path[i:i + m]][None, :] - target[i:i + m][:, None])
+                    # Reversing [i..j] puts track i+j-p at position p: anti-diagonal sums
+                    flat = grid[:m, :m].ravel()
+                    reversed_cost = np.bincount(flat, weights=block.ravel(), minlength=2 * m)[1:m]
+                    current_cost = np.cumsum(np.diag(block))[1:m]
+                    delta += self.CURVE_WEIGHT * (reversed_cost - current_cost)
+
+                best = int(np.argmin(delta))
+                if delta[best] < -1e-9:
+                    j = js[best]
+                    path[i:j + 1] = path[i:j + 1][::-1].copy()
+                    improved = True
+        return path
@@ -0,0 +1,228 @@
+import os
+import json
+import mmap
+import time
+import zlib
+import struct
+import hashlib
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from ..config import Config
+
+try:
+    import fcntl
+except ImportError: # Windows: no cross-process write lock, the cache stays off
+    fcntl = None
+
+MAGIC = b"JGTC"
+VERSION = 1
+# magic, version, slots, record size, unix time of the last compaction
+FILE_HEADER = struct.Struct("<4sIIIQ")
+HEADER_BYTES = 64
+# key hash (0 = empty), sequence (odd while being written), payload length,
+# expires (unix seconds), payload CRC32. The payload follows.
+SLOT_HEADER = struct.Struct("<QIIII")
+SEQ = struct.Struct("<I")
+SEQ_OFFSET = 8
+# A key lives in one of this many slots from its home slot
+PROBES = 8
+
+
+def compact_track(track):
+    """The track fields previews, stats, sequencing and hydration read."""
+    album = track.get('album') or {}
+    return {
+        "id": track['id'],
+        "uri": track['uri'],
+        "name": track['name'],
+        "artists": [{"id": a.get('id'), "name": a['name']} for a in track.get('artists', [])],
+        "album": {
+            "id": album.get('id'),
+            "name": album.get('name'),
+            "images": album.get('images', []),
+            "release_date": album.get('release_date')
+        },
+        "duration_ms": track.get('duration_ms', 0),
+        "popularity": track.get('popularity'),
+        "preview_url": track.get('preview_url'),
+        "is_playable": track.get('is_playable', True)
+    }
+
+
+class SharedTrackCache:
+    """
+    Track cache shared by every worker process on a host, one copy in the
+    page cache instead of one per worker. TRACK_CACHE_FILE is memory-mapped
+    and laid out as an open-addressed hash table of fixed-size records.
+
+    Reads take no lock: a record's sequence number is odd while it is being
+    rewritten and its payload carries a CRC, so a torn read is a miss.
+    Writes take an exclusive file lock, one writer at a time across
+    processes, and replace the same key, a free or expired slot, or the
+    record expiring soonest. Whichever writer first finds
+    TRACK_CACHE_COMPACT_INTERVAL passed clears expired records for everyone.
+    """
+
+    def __init__(self, path=None, slots=None, record_size=None, ttl=None):
+        self.path = path or Config.TRACK_CACHE_FILE
+        self.lock_path = f"{self.path}.lock"
+        self.slots = slots or Config.TRACK_CACHE_SLOTS
+        self.record_size = record_size or Config.TRACK_CACHE_RECORD_BYTES
+        self.ttl = ttl or Config.TRACK_CACHE_TTL
+        self._mm = None
+        self._open_lock = threading.Lock()
+        # flock doesn't exclude threads sharing a process
+        self._write_lock = threading.Lock()
+        self._stats = Counter()
+
+    @property
+    def enabled(self):
+        return Config.TRACK_CACHE_ENABLED and fcntl is not None
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _map(self):
+        """The shared mapping, opened (and the file created) on first use."""
+        if self._mm is None:
+            with self._open_lock:
+                if self._mm is None:
+                    self._mm = self._open()
+        return self._mm
+
+    def _open(self):
+        size = HEADER_BYTES + self.slots * self.record_size
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._file_lock():
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                magic, version, slots, record_size, _ = FILE_HEADER.unpack(
+                    os.pread(fd, FILE_HEADER.size, 0).ljust(FILE_HEADER.size, b"\0")
+                )
+                if (magic, version, slots, record_size) != (MAGIC, VERSION, self.slots, self.record_size) \
+                        or os.fstat(fd).st_size != size:
+                    # New file, or one laid out for other settings: start empty
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, size)
+                    os.pwrite(fd, FILE_HEADER.pack(MAGIC, VERSION, self.slots, self.record_size, int(time.time())), 0)
+                return mmap.mmap(fd, size)
+            finally:
+                # The mapping keeps the file open
+                os.close(fd)
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+    def _offsets(self, key_hash):
+        for probe in range(PROBES):
+            yield HEADER_BYTES + ((key_hash + probe) % self.slots) * self.record_size
+
+    def get(self, key):
+        """The value stored for key, or None if missing or expired."""
+        if not self.enabled:
+            return None
+        mm = self._map()
+        key_hash = self._hash(key)
+        now = time.time()
+        for offset in self._offsets(key_hash):
+            slot_hash, seq, length, expires, crc = SLOT_HEADER.unpack_from(mm, offset)
+            if slot_hash != key_hash or seq & 1 or expires < now or length > self.record_size - SLOT_HEADER.size:
+                continue
+            start = offset + SLOT_HEADER.size
+            payload = mm[start:start + length]
+            # Rewritten while we copied it
+            if zlib.crc32(payload) != crc or SEQ.unpack_from(mm, offset + SEQ_OFFSET)[0] != seq:
+                continue
+            try:
+                stored_key, value = json.loads(payload)
+            except ValueError:
+                continue
+            if stored_key == key:
+                self._stats["hits"] += 1
+                return value
+        self._stats["misses"] += 1
+        return None
+
+    def put(self, key, value):
+        """Stores a JSON-serializable value, False if it doesn't fit a record."""
+        if not self.enabled:
+            return False
+        payload = json.dumps([key, value], separators=(",", ":")).encode()
+        if len(payload) > self.record_size - SLOT_HEADER.size:
+            self._stats["too_large"] += 1
+            return False
+        mm = self._map()
+        key_hash = self._hash(key)
+
+        with self._write_lock, self._file_lock():
+            now = time.time()
+            # Same key, else a free or expired slot, else the one expiring soonest
+            target, target_rank = None, None
+            for offset in self._offsets(key_hash):
+                slot_hash, seq, _, expires, _ = SLOT_HEADER.unpack_from(mm, offset)
+                if slot_hash == key_hash:
+                    target, target_rank = (offset, seq), 0
+                    break
+                rank = 0 if not slot_hash or expires < now else expires
+                if target_rank is None or rank < target_rank:
+                    target, target_rank = (offset, seq), rank
+            if target_rank:
+                self._stats["evictions"] += 1
+            self._write(mm, *target, key_hash, int(now + self.ttl), payload)
+            self._stats["writes"] += 1
+
+            last_compaction = FILE_HEADER.unpack_from(mm, 0)[4]
+            if now - last_compaction > Config.TRACK_CACHE_COMPACT_INTERVAL:
+                self._compact(mm, now)
+        return True
+
+    @staticmethod
+    def _write(mm, offset, seq, key_hash, expires, payload):
+        # Odd while the record changes, readers skip it until it is even again
+        SEQ.pack_into(mm, offset + SEQ_OFFSET, (seq + 1) & 0xFFFFFFFF)
+        start = offset + SLOT_HEADER.size
+        mm[start:start + len(payload)] = payload
+        SLOT_HEADER.pack_into(mm, offset, key_hash, (seq + 1) & 0xFFFFFFFF, len(payload), expires, zlib.crc32(payload))
+        SEQ.pack_into(mm, offset + SEQ_OFFSET, (seq + 2) & 0xFFFFFFFF)
+
+    def _compact(self, mm, now):
+        """Clears expired records so their slots are taken before live ones. Caller holds the locks."""
+        removed = 0
+        for slot in range(self.slots):
+            offset = HEADER_BYTES + slot * self.record_size
+            slot_hash, seq, _, expires, _ = SLOT_HEADER.unpack_from(mm, offset)
+            if slot_hash and expires < now:
+                self._write(mm, offset, seq, 0, 0, b"")
+                removed += 1
+        FILE_HEADER.pack_into(mm, 0, MAGIC, VERSION, self.slots, self.record_size, int(now))
+        self._stats["compactions"] += 1
+        self._stats["compacted"] += removed
+        return removed
+
+    def compact(self):
+        """Clears expired records now. Returns how many were removed."""
+        if not self.enabled:
+            return 0
+        mm = self._map()
+        with self._write_lock, self._file_lock():
+            return self._compact(mm, time.time())
+
+    def snapshot(self):
+        return {
+            "enabled": self.enabled,
+            "slots": self.slots,
+            "record_bytes": self.record_size,
+            # This process's counters
+            **self._stats
+        }
+
+
+track_cache = SharedTrackCache()
@@ -1,15 +1,85 @@
 import time
 import requests
 import base64
+import threading
+import concurrent.futures
+from collections import OrderedDict
 from urllib.parse import urlencode
+from ..config import Config
+from .images import ImageService
+from .hydration import metadata_cache
+from .http_cache import http_cache
+from .shared_cache import track_cache, compact_track
+from .artist_catalog import artist_catalog
+from .catalog import local_catalog
+from .resilience import get_breaker, cap_timeout, CircuitOpenError, DeadlineExceeded
 
 class SpotifyService:
     BASE_URL = "https://api.spotify.com/v1"
     AUTH_URL = "https://accounts.spotify.com/api/token"
 
-    def __init__(self, client_id, client_secret):
+    # Audio features never change for a track ID, so they are shared across
+    # requests and users. None marks IDs Spotify has no features for.
+    _audio_features_cache = {}
+    _audio_features_lock = threading.Lock()
+    # Artist objects (genres, images) change rarely, shared the same way
+    _artists_cache = {}
+    _artists_lock = threading.Lock()
+    # (market, title, artist) -> resolved track, LRU so warm-ups and repeat
+    # suggestions skip the search round trips. Per market, since a track
+    # playable in one country may be missing or relinked in another.
+    _search_cache = OrderedDict()
+    _search_lock = threading.Lock()
+
+    def __init__(self, client_id, client_secret, deadline=None, market=None):
         self.client_id = client_id
         self.client_secret = client_secret
+        # Optional per-request Deadline, every call's timeout is capped by it
+        self.deadline = deadline
+        # User's country from their profile, searches only return tracks playable there
+        self.market = market or Config.DEFAULT_MARKET
+
+    def _request(self, method, endpoint, url, timeout=None, **kwargs):
+        """
+        Sends a request through the circuit breaker for this upstream
+        endpoint, with a timeout capped by the request deadline.
+        5xx, 429 and network errors count as breaker failures.
+        GETs go through http_cache: fresh entries are served without a
+        call, stale ones are revalidated and a 304 is answered from cache.
+        """
+        cached, user = None, None
+        if Config.SPOTIFY_HTTP_CACHE_ENABLED:
+            user = http_cache.user_key(kwargs.get("headers"))
+        if user and method == "GET":
+            cache_url = http_cache.url_key(url, kwargs.get("params"))
+            cached, fresh = http_cache.lookup(user, cache_url)
+            if fresh:
+                return http_cache.response(cached, cache_url)
+            if cached:
+                kwargs["headers"] = {**kwargs["headers"], **http_cache.validators(cached)}
+
+        breaker = get_breaker(f"spotify.{endpoint}")
+        timeout = cap_timeout(self.deadline, timeout or Config.SPOTIFY_TIMEOUT)
+        breaker.before_call()
+        try:
+            response = requests.request(method, url, timeout=timeout, **kwargs)
+        except requests.RequestException:
+            breaker.record_failure()
+            raise
+
+        if response.status_code >= 500 or response.status_code == 429:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+        if user and method == "GET":
+            if response.status_code == 304 and cached:
+                return http_cache.revalidated(user, cache_url, cached, response)
+            http_cache.store(user, cache_url, response)
+        elif user and response.status_code < 400:
+            # Reads of what was just written must not be served stale
+            http_cache.invalidate(user, url)
+        return response
 
     def get_auth_headers(self, access_token):
         return {
@@ -29,7 +99,7 @@ class SpotifyService:
             'grant_type': "authorization_code"
         }
         
-        response = requests.post(self.AUTH_URL, data=data, headers=headers)
+        response = self._request("POST", "token", self.AUTH_URL, data=data, headers=headers)
         if response.status_code != 200:
             raise Exception(f"Token exchange failed: {response.text}")
         
@@ -46,32 +116,124 @@ class SpotifyService:
             'refresh_token': refresh_token
         }
         
-        response = requests.post(self.AUTH_URL, data=data, headers=headers)
+        response = self._request("POST", "token", self.AUTH_URL, data=data, headers=headers)
         if response.status_code != 200:
             raise Exception(f"Token refresh failed: {response.text}")
             
         return response.json()
 
+    def get_client_token(self):
+        """
+        App-only token (client credentials flow) for background jobs like
+        the cache warm-up. It can search and read the catalog, not user data.
+        """
+        auth_header = base64.b64encode(f"{self.client_id}:{self.client_secret}".encode()).decode("ascii")
+        headers = {
+            "Authorization": f"Basic {auth_header}",
+            "Content-Type": "application/x-www-form-urlencoded"
+        }
+        response = self._request("POST", "token", self.AUTH_URL, data={'grant_type': 'client_credentials'}, headers=headers)
+        if response.status_code != 200:
+            raise Exception(f"Client token request failed: {response.text}")
+        return response.json()['access_token']
+
     def search_track(self, access_token, song_name, artist_name):
         """
         Search for a track by name and artist. 
-        Returns the first match or None.
+        Returns the first match or None. When both searches miss, the
+        artist's cached catalog is tried, see ArtistCatalog.
         """
         # Sanitize inputs
         if not song_name or not artist_name:
             return None
-            
+
+        cache_key = self._search_key(song_name, artist_name, self.market)
+        with self._search_lock:
+            if cache_key in self._search_cache:
+                self._search_cache.move_to_end(cache_key)
+                return self._search_cache[cache_key]
+
+        # Resolved by another worker on this host
+        shared_key = "search:" + "\x1f".join(cache_key)
+        track = track_cache.get(shared_key)
+        if track:
+            self._remember(cache_key, track)
+            return track
+
+        # A confident match among every track resolved before
+        track = local_catalog.match(song_name, artist_name, self.market)
+        if track or Config.CATALOG_OFFLINE:
+            if track:
+                self._remember(cache_key, track)
+            return track
+
+        track, not_found = self._search_track(access_token, song_name, artist_name)
+        # Only for songs Spotify has no match for: after a 429 or an error the
+        # artist's catalog calls would most likely fail (and count) the same way
+        if not track and not_found and Config.ARTIST_FALLBACK_ENABLED:
+            # Closest title (or a top track) from the artist's cached catalog
+            track = artist_catalog.resolve(self, access_token, song_name, artist_name)
+        # Misses aren't cached, they may be rate limits or transient errors
+        if track:
+            self._remember(cache_key, track)
+            # Search results are full track objects, so hydrating them later is free
+            metadata_cache.put_many("tracks", self.market, {track['id']: track})
+            compact = compact_track(track)
+            track_cache.put(shared_key, compact)
+            track_cache.put(f"track:{self.market}:{track['id']}", compact)
+            local_catalog.add([track], self.market)
+        return track
+
+    @classmethod
+    def _remember(cls, key, track):
+        """Caches a resolved search, evicting the least recently used past SEARCH_CACHE_SIZE."""
+        with cls._search_lock:
+            cls._search_cache[key] = track
+            cls._search_cache.move_to_end(key)
+            while len(cls._search_cache) > Config.SEARCH_CACHE_SIZE:
+                cls._search_cache.popitem(last=False)
+
+    @staticmethod
+    def _search_key(song_name, artist_name, market):
+        return market, song_name.strip().lower(), artist_name.strip().lower()
+
+    @classmethod
+    def seed_search_cache(cls, entries):
+        """
+        Loads [(song_name, artist_name, track, market)] resolved elsewhere,
+        e.g. by a warm-up. Entries without a market are DEFAULT_MARKET's.
+        """
+        with cls._search_lock:
+            for song_name, artist_name, track, *market in entries:
+                market = market[0] if market else Config.DEFAULT_MARKET
+                cls._search_cache[cls._search_key(song_name, artist_name, market)] = track
+            while len(cls._search_cache) > Config.SEARCH_CACHE_SIZE:
+                cls._search_cache.popitem(last=False)
+
+    @staticmethod
+    def _playable(items):
+        # With a market, Spotify flags tracks that can't be played there
+        return [t for t in items if t and t.get("is_playable", True)]
+
+    def _search_track(self, access_token, song_name, artist_name):
+        """
+        (track or None, not_found). not_found is True only when Spotify
+        answered both searches without a playable match, False after a
+        rate limit or an error.
+        """
         query = f"track:{song_name} artist:{artist_name}"
         params = {
             "q": query,
             "type": "track",
-            "market": "US",
-            "limit": 1
+            "market": self.market,
+            # A few candidates, the top hit may be unplayable in this market
+            "limit": 5
         }
         
         try:
             # 1. Try strict search first
-            response = requests.get(
+            response = self._request(
+                "GET", "search",
                 f"{self.BASE_URL}/search", 
                 headers=self.get_auth_headers(access_token),
                 params=params,
@@ -80,19 +242,21 @@ class SpotifyService:
             
             if response.status_code == 200:
                 data = response.json()
-                items = data.get("tracks", {}).get("items", [])
+                items = self._playable(data.get("tracks", {}).get("items", []))
                 if items:
-                    return items[0]
+                    return items[0], False
             elif response.status_code == 429:
                 print("Rate limited by Spotify")
-                return None
+                return None, False
+            answered = response.status_code == 200
 
             # 2. Fallback: Relaxed search (just string matching)
             # Sometimes AI gives "Title - Remastered" or slightly off artist names
             relaxed_query = f"{song_name} {artist_name}"
             params["q"] = relaxed_query
             
-            response = requests.get(
+            response = self._request(
+                "GET", "search",
                 f"{self.BASE_URL}/search", 
                 headers=self.get_auth_headers(access_token),
                 params=params,
@@ -101,15 +265,182 @@ class SpotifyService:
             
             if response.status_code == 200:
                 data = response.json()
-                items = data.get("tracks", {}).get("items", [])
+                items = self._playable(data.get("tracks", {}).get("items", []))
                 if items:
                     print(f"Fallback search successful for: {song_name}")
-                    return items[0]
-            
-            return None
+                    return items[0], False
+            elif response.status_code == 429:
+                print("Rate limited by Spotify")
+
+            return None, answered and response.status_code == 200
+        except (CircuitOpenError, DeadlineExceeded):
+            # Callers turn these into 503/504 instead of "not found"
+            raise
         except Exception as e:
             print(f"Error searching for {song_name} by {artist_name}: {e}")
-            return None
+            return None, False
+
+    def search_tracks(self, access_token, query, limit=10):
+        """
+        Free-text track search. Returns the list of track objects. Answered
+        from the local catalog when it has CATALOG_SEARCH_MIN_RESULTS matches.
+        """
+        local = local_catalog.search(query, self.market, limit)
+        if Config.CATALOG_OFFLINE or len(local) >= min(limit, Config.CATALOG_SEARCH_MIN_RESULTS):
+            return local
+
+        response = self._request(
+            "GET", "search",
+            f"{self.BASE_URL}/search",
+            headers=self.get_auth_headers(access_token),
+            params={
+                "q": query,
+                "type": "track",
+                "market": self.market,
+                "limit": limit
+            }
+        )
+        response.raise_for_status()
+        tracks = self._playable(response.json().get('tracks', {}).get('items', []))
+        local_catalog.add(tracks, self.market)
+        return tracks
+
+    def get_several(self, access_token, kind, ids):
+        """
+        One call to a multi-ID endpoint ("tracks", "albums" or "artists")
+        for a batch within its limit. Returns objects in ID order, None for
+        unknown IDs. Use HydrationService for caching and batching.
+        """
+        params = {"ids": ",".join(ids)}
+        if kind != "artists":
+            params["market"] = self.market
+        response = self._request(
+            "GET", kind,
+            f"{self.BASE_URL}/{kind}",
+            headers=self.get_auth_headers(access_token),
+            params=params,
+            timeout=5
+        )
+        response.raise_for_status()
+        return response.json().get(kind) or []
+
+    def search_artist(self, access_token, artist_name):
+        """Best matching artist object for a name, or None."""
+        response = self._request(
+            "GET", "search",
+            f"{self.BASE_URL}/search",
+            headers=self.get_auth_headers(access_token),
+            params={"q": artist_name, "type": "artist", "limit": 1},
+            timeout=5
+        )
+        response.raise_for_status()
+        items = response.json().get('artists', {}).get('items', [])
+        return items[0] if items else None
+
+    def get_artist_top_tracks(self, access_token, artist_id):
+        """The artist's most popular tracks in this market (up to 10)."""
+        response = self._request(
+            "GET", "artist_top_tracks",
+            f"{self.BASE_URL}/artists/{artist_id}/top-tracks",
+            headers=self.get_auth_headers(access_token),
+            params={"market": self.market},
+            timeout=5
+        )
+        response.raise_for_status()
+        return self._playable(response.json().get('tracks', []))
+
+    def get_artist_album_ids(self, access_token, artist_id, limit=20):
+        """IDs of the artist's most recent albums and singles available in this market."""
+        response = self._request(
+            "GET", "artist_albums",
+            f"{self.BASE_URL}/artists/{artist_id}/albums",
+            headers=self.get_auth_headers(access_token),
+            params={"include_groups": "album,single", "market": self.market, "limit": limit},
+            timeout=5
+        )
+        response.raise_for_status()
+        return [a['id'] for a in response.json().get('items', []) if a.get('id')]
+
+    def get_audio_features(self, access_token, track_ids):
+        """
+        Fetches audio features for many tracks using the batched endpoint
+        (100 IDs per call). Returns {track_id: features or None}.
+        """
+        ids = list(dict.fromkeys(i for i in track_ids if i))
+        with self._audio_features_lock:
+            result = {i: self._audio_features_cache[i] for i in ids if i in self._audio_features_cache}
+        missing = [i for i in ids if i not in result]
+        if not missing:
+            return result
+
+        batches = [missing[i:i + 100] for i in range(0, len(missing), 100)]
+
+        def fetch(batch):
+            try:
+                response = self._request(
+                    "GET", "audio_features",
+                    f"{self.BASE_URL}/audio-features",
+                    headers=self.get_auth_headers(access_token),
+                    params={"ids": ",".join(batch)},
+                    timeout=5
+                )
+            except Exception as e:
+                print(f"Audio features request failed: {e}")
+                return {}
+            if response.status_code != 200:
+                # Endpoint is restricted for some apps, callers treat features as optional
+                print(f"Audio features request failed: {response.status_code}")
+                return {}
+            features = response.json().get("audio_features") or []
+            return {tid: f for tid, f in zip(batch, features)}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(5, len(batches))) as executor:
+            for fetched in executor.map(fetch, batches):
+                with self._audio_features_lock:
+                    self._audio_features_cache.update(fetched)
+                result.update(fetched)
+
+        return result
+
+    def get_artists(self, access_token, artist_ids):
+        """
+        Fetches artist objects using the batched endpoint (50 IDs per call).
+        Returns {artist_id: artist or None}.
+        """
+        ids = list(dict.fromkeys(i for i in artist_ids if i))
+        with self._artists_lock:
+            result = {i: self._artists_cache[i] for i in ids if i in self._artists_cache}
+        missing = [i for i in ids if i not in result]
+        if not missing:
+            return result
+
+        batches = [missing[i:i + 50] for i in range(0, len(missing), 50)]
+
+        def fetch(batch):
+            try:
+                response = self._request(
+                    "GET", "artists",
+                    f"{self.BASE_URL}/artists",
+                    headers=self.get_auth_headers(access_token),
+                    params={"ids": ",".join(batch)},
+                    timeout=5
+                )
+            except Exception as e:
+                print(f"Artists request failed: {e}")
+                return {}
+            if response.status_code != 200:
+                print(f"Artists request failed: {response.status_code}")
+                return {}
+            artists = response.json().get("artists") or []
+            return {aid: a for aid, a in zip(batch, artists)}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(5, len(batches))) as executor:
+            for fetched in executor.map(fetch, batches):
+                with self._artists_lock:
+                    self._artists_cache.update(fetched)
+                result.update(fetched)
+
+        return result
 
     def create_playlist(self, access_token, user_id, name, description="Generated by Jam Genie", public=True):
         url = f"{self.BASE_URL}/users/{user_id}/playlists"
@@ -119,7 +450,8 @@ class SpotifyService:
             "public": public
         }
         
-        response = requests.post(
+        response = self._request(
+            "POST", "playlists",
             url, 
             headers=self.get_auth_headers(access_token),
             json=data
@@ -127,25 +459,133 @@ class SpotifyService:
         response.raise_for_status()
         return response.json()
 
-    def add_tracks_to_playlist(self, access_token, playlist_id, uris):
+    def unfollow_playlist(self, access_token, playlist_id):
+        """Removes a playlist from the user's library, which is how Spotify deletes one."""
+        response = self._request(
+            "DELETE", "playlist_followers",
+            f"{self.BASE_URL}/playlists/{playlist_id}/followers",
+            headers=self.get_auth_headers(access_token)
+        )
+        response.raise_for_status()
+
+    def add_tracks_to_playlist(self, access_token, playlist_id, uris, position=None, snapshot_id=None):
+        """
+        Adds tracks in batches of 100 (the API limit per request).
+        With position, tracks are inserted there in order instead of appended.
+        Returns the playlist's latest snapshot_id.
+        """
         if not uris:
-            return
-            
-        # Spotify API limit is 100 tracks per request
-        # split into chunks if needed (though our AI limits are usually lower)
+            return snapshot_id
+
         url = f"{self.BASE_URL}/playlists/{playlist_id}/tracks"
-        
-        data = {"uris": uris}
-        response = requests.post(
-            url,
+
+        for i in range(0, len(uris), 100):
+            data = {"uris": uris[i:i + 100]}
+            if position is not None:
+                data["position"] = position + i
+            response = self._request(
+                "POST", "playlist_tracks",
+                url,
+                headers=self.get_auth_headers(access_token),
+                json=data
+            )
+            response.raise_for_status()
+            snapshot_id = response.json().get("snapshot_id", snapshot_id)
+        return snapshot_id
+
+    def get_playlist_tracks(self, access_token, playlist_id):
+        """
+        Returns (snapshot_id, [track uris]) for a playlist. Pages after the
+        first are fetched concurrently since the total is known up front.
+        """
+        headers = self.get_auth_headers(access_token)
+        response = self._request(
+            "GET", "playlists",
+            f"{self.BASE_URL}/playlists/{playlist_id}",
+            headers=headers,
+            params={"fields": "snapshot_id,tracks(total,items(track(uri)))"},
+            timeout=10
+        )
+        response.raise_for_status()
+        playlist = response.json()
+        first_page = playlist.get("tracks", {})
+        total = first_page.get("total", 0)
+
+        def fetch(offset):
+            page = self._request(
+                "GET", "playlist_tracks",
+                f"{self.BASE_URL}/playlists/{playlist_id}/tracks",
+                headers=headers,
+                params={"fields": "items(track(uri))", "offset": offset, "limit": 100},
+                timeout=10
+            )
+            page.raise_for_status()
+            return page.json().get("items", [])
+
+        pages = [first_page.get("items", [])]
+        offsets = range(len(pages[0]), total, 100)
+        if offsets:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(5, len(offsets))) as executor:
+                pages.extend(executor.map(fetch, offsets))
+
+        # Local files and removed tracks come back with a null track
+        uris = [item["track"]["uri"] for page in pages for item in page if item.get("track")]
+        return playlist.get("snapshot_id"), uris
+
+    def remove_tracks_from_playlist(self, access_token, playlist_id, uris, snapshot_id=None):
+        """
+        Removes every occurrence of the given URIs, 100 per request.
+        Returns the playlist's latest snapshot_id.
+        """
+        url = f"{self.BASE_URL}/playlists/{playlist_id}/tracks"
+
+        for i in range(0, len(uris), 100):
+            data = {"tracks": [{"uri": uri} for uri in uris[i:i + 100]]}
+            if snapshot_id:
+                data["snapshot_id"] = snapshot_id
+            response = self._request(
+                "DELETE", "playlist_tracks",
+                url,
+                headers=self.get_auth_headers(access_token),
+                json=data
+            )
+            response.raise_for_status()
+            snapshot_id = response.json().get("snapshot_id", snapshot_id)
+        return snapshot_id
+
+    def replace_playlist_tracks(self, access_token, playlist_id, uris):
+        """Replaces the whole track list. Returns the new snapshot_id."""
+        response = self._request(
+            "PUT", "playlist_tracks",
+            f"{self.BASE_URL}/playlists/{playlist_id}/tracks",
+            headers=self.get_auth_headers(access_token),
+            json={"uris": uris[:100]}
+        )
+        response.raise_for_status()
+        snapshot_id = response.json().get("snapshot_id")
+        return self.add_tracks_to_playlist(access_token, playlist_id, uris[100:], snapshot_id=snapshot_id)
+
+    def reorder_playlist_tracks(self, access_token, playlist_id, range_start, insert_before, range_length=1, snapshot_id=None):
+        """Moves a contiguous range of tracks. Returns the new snapshot_id."""
+        data = {
+            "range_start": range_start,
+            "insert_before": insert_before,
+            "range_length": range_length
+        }
+        if snapshot_id:
+            data["snapshot_id"] = snapshot_id
+        response = self._request(
+            "PUT", "playlist_tracks",
+            f"{self.BASE_URL}/playlists/{playlist_id}/tracks",
             headers=self.get_auth_headers(access_token),
             json=data
         )
         response.raise_for_status()
-        return response.json()
+        return response.json().get("snapshot_id", snapshot_id)
 
     def get_user_profile(self, access_token):
-        response = requests.get(
+        response = self._request(
+            "GET", "me",
             f"{self.BASE_URL}/me",
             headers=self.get_auth_headers(access_token)
         )
@@ -153,29 +593,40 @@ class SpotifyService:
             raise Exception(f"Failed to fetch profile: {response.text}")
         return response.json()
 
+    def get_current_user_playlists(self, access_token, limit=50):
+        response = self._request(
+            "GET", "me_playlists",
+            f"{self.BASE_URL}/me/playlists",
+            headers=self.get_auth_headers(access_token),
+            params={"limit": limit}
+        )
+        return response.json()
+
     def upload_playlist_cover(self, access_token, playlist_id, image_b64):
         """
         Uploads a custom cover image to a playlist.
-        image_b64: Base64 encoded JPEG image data (max 256KB)
+        image_b64: Base64 encoded image data, or a Future from
+        ImageService.prepare_cover_async. Images are resized and recompressed
+        to fit Spotify's 256KB limit before upload.
         """
         url = f"{self.BASE_URL}/playlists/{playlist_id}/images"
-        
-        # NOTE: the API wants the raw Base64 string in the body
-        # Strip header if present (e.g. data:image/jpeg;base64,...)
-        if "," in image_b64:
-            image_b64 = image_b64.split(",")[1]
-            
-        # Per user request:
+
+        if isinstance(image_b64, str):
+            image_b64 = ImageService().prepare_cover_async(image_b64)
+        body = image_b64.result(timeout=cap_timeout(self.deadline, 30))
+
         headers = {
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "image/jpeg",
             "Accept": "application/json"
         }
         
-        response = requests.put(
+        response = self._request(
+            "PUT", "images",
             url,
             headers=headers,
-            data=image_b64
+            data=body,
+            timeout=15
         )
         
         if response.status_code == 202:
@@ -0,0 +1,120 @@
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+import numpy as np
+from ..config import Config
+
+FEATURE_KEYS = ("energy", "tempo", "valence", "danceability")
+PERCENTILES = (25, 50, 75, 90)
+
+
+def format_duration(ms):
+    """Formats milliseconds as M:SS, or H:MM:SS for an hour or more."""
+    seconds = int(round(ms / 1000))
+    hours, rem = divmod(seconds, 3600)
+    minutes, secs = divmod(rem, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes}:{secs:02d}"
+
+
+def _decade(release_date):
+    # release_date is "YYYY", "YYYY-MM" or "YYYY-MM-DD" depending on precision
+    try:
+        year = int(str(release_date)[:4])
+    except (TypeError, ValueError):
+        return None
+    return f"{year // 10 * 10}s"
+
+
+def _distribution(values):
+    return {
+        "mean": round(float(values.mean()), 3),
+        "min": round(float(values.min()), 3),
+        "max": round(float(values.max()), 3),
+        **{f"p{p}": round(float(v), 3) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+    }
+
+
+class StatsService:
+    """
+    Computes playlist statistics (durations, artist/decade spread, audio
+    feature distributions) over a list of Spotify track objects.
+    Results are cached per track set.
+    """
+    _cache = OrderedDict()
+    _cache_lock = threading.Lock()
+
+    def __init__(self, spotify_service=None, access_token=None):
+        # Audio features are optional, stats still work without a Spotify client
+        self.spotify_service = spotify_service
+        self.access_token = access_token
+
+    def _cache_key(self, tracks):
+        # Stats computed without a Spotify client have no audioFeatures,
+        # they must not be served to callers that asked for them
+        with_features = bool(self.spotify_service and self.access_token)
+        ids = sorted(t['id'] for t in tracks if t.get('id'))
+        return hashlib.sha1(f"{with_features}|{','.join(ids)}".encode()).hexdigest()
+
+    def compute(self, tracks):
+        if not tracks:
+            return None
+
+        key = self._cache_key(tracks)
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        stats = self._duration_stats(tracks)
+        stats.update(self._spread_stats(tracks))
+
+        features = self._feature_stats(tracks)
+        if features:
+            stats["audioFeatures"] = features
+
+        with self._cache_lock:
+            self._cache[key] = stats
+            while len(self._cache) > Config.STATS_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return stats
+
+    def _duration_stats(self, tracks):
+        durations = np.fromiter((t.get('duration_ms') or 0 for t in tracks), dtype=np.int64, count=len(tracks))
+        total = int(durations.sum())
+        percentiles = np.percentile(durations, PERCENTILES)
+        return {
+            "totalDurationMs": total,
+            "totalDuration": format_duration(total),
+            "averageDurationMs": int(durations.mean()),
+            "averageDuration": format_duration(durations.mean()),
+            "durationPercentiles": {f"p{p}": format_duration(v) for p, v in zip(PERCENTILES, percentiles)},
+            "shortest": format_duration(durations.min()),
+            "longest": format_duration(durations.max())
+        }
+
+    def _spread_stats(self, tracks):
+        artists = Counter(t['artists'][0]['name'] for t in tracks if t.get('artists'))
+        decades = Counter(
+            d for d in (_decade(t.get('album', {}).get('release_date')) for t in tracks) if d
+        )
+        return {
+            "uniqueArtists": len(artists),
+            "topArtists": [{"name": name, "count": count} for name, count in artists.most_common(5)],
+            "decades": dict(sorted(decades.items()))
+        }
+
+    def _feature_stats(self, tracks):
+        if not self.spotify_service or not self.access_token:
+            return None
+
+        features = self.spotify_service.get_audio_features(
+            self.access_token, [t['id'] for t in tracks if t.get('id')]
+        )
+        rows = [f for f in features.values() if f]
+        if not rows:
+            return None
+
+        matrix = np.array([[f.get(k) or 0.0 for k in FEATURE_KEYS] for f in rows], dtype=np.float64)
+        return {k: _distribution(matrix[:, i]) for i, k in enumerate(FEATURE_KEYS)}
@@ -0,0 +1,139 @@
+import os
+import hashlib
+import threading
+from urllib.parse import urlparse
+import requests
+from ..config import Config
+from .resilience import get_breaker
+
+# Neutral square shown when a track has no album art, inline so nothing is hotlinked
+PLACEHOLDER_IMAGE = (
+    "data:image/svg+xml,%3Csvg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 100 100'%3E"
+    "%3Crect width='100' height='100' fill='%23282828'/%3E"
+    "%3Ccircle cx='50' cy='50' r='22' fill='none' stroke='%23727272' stroke-width='6'/%3E"
+    "%3Ccircle cx='50' cy='50' r='5' fill='%23727272'/%3E%3C/svg%3E"
+)
+
+# Only Spotify's image CDNs are proxied, the endpoint is not an open proxy
+PROXY_HOSTS = ("i.scdn.co", "mosaic.scdn.co", "image-cdn-ak.spotifycdn.com", "image-cdn-fa.spotifycdn.com")
+
+
+def select_image(images, size):
+    """
+    URL of the smallest image at least size px wide, the largest one if
+    none is, or None. Spotify lists album art at 640, 300 and 64 px.
+    """
+    images = [i for i in images or [] if i.get('url')]
+    if not images:
+        return None
+    # Unsized images (user uploaded playlist covers) sort as large
+    width = lambda i: i.get('width') or i.get('height') or 10 ** 6
+    big_enough = [i for i in images if width(i) >= size]
+    if big_enough:
+        return min(big_enough, key=width)['url']
+    return max(images, key=width)['url']
+
+
+def proxyable(url):
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return False
+    return parsed.scheme == "https" and parsed.hostname in PROXY_HOSTS
+
+
+class ThumbnailCache:
+    """
+    Disk-backed LRU of proxied album art in IMAGE_CACHE_DIR, one file per
+    URL named by its hash (which doubles as the ETag, Spotify image URLs are
+    content addressed). Recency is the file mtime, touched on every hit;
+    the oldest files are removed once IMAGE_CACHE_MAX_BYTES is exceeded.
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or Config.IMAGE_CACHE_DIR
+        self.max_bytes = max_bytes or Config.IMAGE_CACHE_MAX_BYTES
+        self._size = None # Bytes on disk, computed on first write
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def etag(url):
+        return hashlib.sha1(url.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, url):
+        """Returns (bytes, content type, etag), fetching and caching on a miss."""
+        key = self.etag(url)
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            return data, _content_type(data), key
+        except FileNotFoundError:
+            pass
+
+        breaker = get_breaker("spotify.images")
+        breaker.before_call()
+        try:
+            response = requests.get(url, timeout=Config.SPOTIFY_TIMEOUT)
+        except requests.RequestException:
+            breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        response.raise_for_status()
+
+        data = response.content
+        self._store(key, data)
+        return data, response.headers.get('Content-Type') or _content_type(data), key
+
+    def _store(self, key, data):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._path(key))
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(e.stat().st_size for e in os.scandir(self.directory) if e.is_file())
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Oldest first, down to 90% so eviction doesn't run on every write
+        entries = sorted(
+            (e for e in os.scandir(self.directory) if e.is_file() and not e.name.endswith(".tmp")),
+            key=lambda e: e.stat().st_mtime
+        )
+        self._size = sum(e.stat().st_size for e in entries)
+        for entry in entries:
+            if self._size <= self.max_bytes * 0.9:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self._size -= size
+            except FileNotFoundError:
+                continue
+
+
+def _content_type(data):
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+thumbnail_cache = ThumbnailCache()
+
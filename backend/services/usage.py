@@ -0,0 +1,182 @@
+import os
+import time
+import sqlite3
+import threading
+from ..config import Config
+
+OK, DEGRADED, EXHAUSTED = "ok", "degraded", "exhausted"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    hour INTEGER NOT NULL,
+    user TEXT NOT NULL,
+    route TEXT NOT NULL,
+    model TEXT NOT NULL,
+    calls INTEGER NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    PRIMARY KEY (hour, user, route, model)
+);
+CREATE INDEX IF NOT EXISTS usage_user ON usage (user, hour);
+"""
+
+
+class BudgetExceeded(Exception):
+    """The user's or the global AI token budget is spent. status is 429 or 503."""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def _price(model):
+    """(input, output) USD per million tokens for a provider name like "gemini:gemini-2.0-flash"."""
+    prices = Config.AI_TOKEN_PRICES
+    return prices.get(model) or prices.get(model.partition(":")[2]) or (0.0, 0.0)
+
+
+class UsageLedger:
+    """
+    Tokens used by AI calls, aggregated per hour, user, route and model and
+    kept for USAGE_RETENTION_HOURS. Feeds the token budgets (a rolling 24h
+    window) and the /AI_Usage report. Stored in SQLite at USAGE_DB_PATH
+    (WAL mode) and updated with upserts, so every worker on a host counts
+    against the same budgets and usage survives restarts.
+    """
+
+    def __init__(self, path=None, retention_hours=None):
+        self.path = path or Config.USAGE_DB_PATH
+        self.retention_hours = retention_hours or Config.USAGE_RETENTION_HOURS
+        self._conn = None
+        self._current_hour = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _hour(ts=None):
+        return int((ts or time.time()) // 3600) * 3600
+
+    def _connection(self):
+        """The process's connection, opened and the schema created on first use. Caller holds the lock."""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def record(self, user, route, model, prompt_tokens, output_tokens):
+        """Adds one call. Never raises, losing a sample beats failing the request."""
+        hour = self._hour()
+        try:
+            with self._lock:
+                conn = self._connection()
+                with conn:
+                    if hour != self._current_hour:
+                        # New hour: drop buckets past the retention window
+                        conn.execute("DELETE FROM usage WHERE hour < ?", (hour - self.retention_hours * 3600,))
+                        self._current_hour = hour
+                    # Calls made outside a user request (warm-up) only count globally
+                    conn.execute(
+                        "INSERT INTO usage VALUES (?, ?, ?, ?, 1, ?, ?) ON CONFLICT (hour, user, route, model) "
+                        "DO UPDATE SET calls = calls + 1, prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                        "output_tokens = output_tokens + excluded.output_tokens",
+                        (hour, user or "system", route or "other", model, prompt_tokens or 0, output_tokens or 0)
+                    )
+        except sqlite3.Error as e:
+            print(f"Usage ledger update failed: {e}")
+
+    def _query(self, sql, hours, user):
+        sql += " WHERE hour >= ?"
+        params = [self._hour() - (hours - 1) * 3600]
+        if user is not None:
+            sql += " AND user = ?"
+            params.append(user)
+        try:
+            with self._lock:
+                return self._connection().execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            # Budgets fail open rather than blocking every AI call
+            print(f"Usage ledger lookup failed: {e}")
+            return []
+
+    def _rows(self, hours, user=None):
+        return [
+            (tuple(row[:4]), list(row[4:]))
+            for row in self._query("SELECT hour, user, route, model, calls, prompt_tokens, output_tokens FROM usage", hours, user)
+        ]
+
+    def tokens(self, hours=24, user=None):
+        rows = self._query("SELECT SUM(prompt_tokens + output_tokens) FROM usage", hours, user)
+        return (rows[0][0] if rows else None) or 0
+
+    def budget_state(self, user):
+        """
+        OK, DEGRADED once AI_BUDGET_DEGRADE_AT of the user's or the global
+        daily budget is used, EXHAUSTED when either is spent. Returns
+        (state, "user" or "global"). Without a user only the global budget applies.
+        """
+        state, scope = OK, None
+        for scope_name, limit, used in (
+            ("global", Config.AI_GLOBAL_DAILY_TOKENS, lambda: self.tokens()),
+            ("user", Config.AI_USER_DAILY_TOKENS if user else 0, lambda: self.tokens(user=user)),
+        ):
+            if not limit:
+                continue
+            spent = used()
+            if spent >= limit:
+                return EXHAUSTED, scope_name
+            if spent >= limit * Config.AI_BUDGET_DEGRADE_AT and state == OK:
+                state, scope = DEGRADED, scope_name
+        return state, scope
+
+    def check(self, user):
+        """Raises BudgetExceeded if no more AI calls are allowed for user."""
+        state, scope = self.budget_state(user)
+        if state == EXHAUSTED:
+            if scope == "user":
+                raise BudgetExceeded("Daily AI budget used up, try again later", 429)
+            raise BudgetExceeded("AI generation is over its daily budget", 503)
+
+    def report(self, hours=24, user=None):
+        """Totals plus breakdowns by hour, route, model and (for all users) user."""
+        rows = self._rows(hours, user)
+        totals = {"calls": 0, "prompt_tokens": 0, "output_tokens": 0, "cost_usd": 0.0}
+        breakdowns = {"by_hour": {}, "by_route": {}, "by_model": {}}
+        if user is None:
+            breakdowns["by_user"] = {}
+
+        for (hour, row_user, route, model), (calls, prompt, output) in rows:
+            input_price, output_price = _price(model)
+            cost = (prompt * input_price + output * output_price) / 1_000_000
+            labels = {
+                "by_hour": time.strftime("%Y-%m-%dT%H:00Z", time.gmtime(hour)),
+                "by_route": route,
+                "by_model": model,
+                "by_user": row_user,
+            }
+            for target in [totals] + [
+                breakdowns[name].setdefault(labels[name], {"calls": 0, "prompt_tokens": 0, "output_tokens": 0, "cost_usd": 0.0})
+                for name in breakdowns
+            ]:
+                target["calls"] += calls
+                target["prompt_tokens"] += prompt
+                target["output_tokens"] += output
+                target["cost_usd"] += cost
+
+        for entry in [totals] + [e for b in breakdowns.values() for e in b.values()]:
+            entry["cost_usd"] = round(entry["cost_usd"], 6)
+        breakdowns["by_hour"] = dict(sorted(breakdowns["by_hour"].items()))
+        if user is None:
+            # Heaviest users first
+            breakdowns["by_user"] = dict(sorted(
+                breakdowns["by_user"].items(),
+                key=lambda kv: -(kv[1]["prompt_tokens"] + kv[1]["output_tokens"])
+            )[:50])
+
+        state, scope = self.budget_state(user)
+        return {"hours": hours, **totals, **breakdowns, "budget": {"state": state, "scope": scope}}
+
+
+usage_ledger = UsageLedger()
@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import queue
+import threading
+import concurrent.futures
+from collections import Counter, deque
+from ..config import Config
+from .ai import AIService, buffered_count, store_prefetched
+from .spotify import SpotifyService
+from .recommender import RecommenderService
+from .resilience import CircuitOpenError
+
+try:
+    import fcntl
+except ImportError: # Windows: no cross-process locks, single worker only
+    fcntl = None
+
+# mtime of the warm cache file this process last loaded
+_warm_cache_mtime = None
+_warm_cache_lock = threading.Lock()
+
+_history_queue = queue.SimpleQueue()
+_history_writer = None
+_history_writer_lock = threading.Lock()
+
+
+def _canonical(preferences):
+    return json.dumps(preferences, sort_keys=True)
+
+
+def _locked(f, flags):
+    """flock wrapper, returns False if a non-blocking lock is already held."""
+    if not fcntl:
+        return True
+    try:
+        fcntl.flock(f, flags)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def record_profile(preferences):
+    """
+    Queues a generated preview's preferences for the warm-up history. The
+    write happens on a background thread, off the request path.
+    """
+    global _history_writer
+    if not Config.WARMUP_HISTORY_FILE:
+        return
+    _history_queue.put(_canonical(preferences))
+    with _history_writer_lock:
+        if _history_writer is None:
+            _history_writer = threading.Thread(target=_write_history, daemon=True, name="warmup-history")
+            _history_writer.start()
+
+
+def _write_history():
+    path = Config.WARMUP_HISTORY_FILE
+    written = 0
+    while True:
+        lines = [_history_queue.get()]
+        while True:
+            try:
+                lines.append(_history_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            with open(path, "a+") as f:
+                _locked(f, fcntl.LOCK_EX if fcntl else 0)
+                f.write("".join(line + "\n" for line in lines))
+                written += len(lines)
+                # Only the tail is ever read, so every WARMUP_HISTORY_LINES
+                # writes the file is cut back to that tail
+                if written >= Config.WARMUP_HISTORY_LINES:
+                    f.seek(0)
+                    tail = deque(f, maxlen=Config.WARMUP_HISTORY_LINES)
+                    f.seek(0)
+                    f.truncate()
+                    f.writelines(tail)
+                    written = 0
+        except OSError as e:
+            print(f"Failed to record preference profiles: {e}")
+
+
+def top_profiles(n, profiles_file=None):
+    """
+    The n preference profiles to warm. A profiles file (JSON list of
+    preference dicts) wins over the recorded history, where the most
+    frequent of the last WARMUP_HISTORY_LINES generations are used.
+    """
+    profiles_file = profiles_file or Config.WARMUP_PROFILES_FILE
+    if profiles_file:
+        with open(profiles_file) as f:
+            return json.load(f)[:n]
+
+    path = Config.WARMUP_HISTORY_FILE
+    if not path or not os.path.exists(path):
+        return []
+    with open(path) as f:
+        lines = deque(f, maxlen=Config.WARMUP_HISTORY_LINES)
+
+    counts = Counter()
+    for line in lines:
+        try:
+            counts[_canonical(json.loads(line))] += 1
+        except ValueError:
+            continue # Partially written line
+    return [json.loads(key) for key, _ in counts.most_common(n)]
+
+
+def _playlist_length(preferences):
+    length = preferences.get("playlistLength", 20)
+    if isinstance(length, list):
+        length = length[0]
+    try:
+        return int(length)
+    except (TypeError, ValueError):
+        return 20
+
+
+def save_warm_cache(prefetched, searches):
+    """Writes warm-up results to WARMUP_CACHE_FILE for serving processes to load."""
+    path = Config.WARMUP_CACHE_FILE
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({
+            "expires": time.time() + Config.AI_PREFETCH_TTL,
+            "prefetched": prefetched,
+            "searches": searches
+        }, f)
+    os.replace(tmp, path)
+
+
+def load_warm_cache():
+    """
+    Seeds this process's AI prefetch and search caches from the last
+    warm-up, so a warm-up run in another process (the CLI, another worker)
+    still benefits the workers serving traffic. Returns entries loaded.
+    """
+    global _warm_cache_mtime
+    path = Config.WARMUP_CACHE_FILE
+    if not path or not os.path.exists(path):
+        return 0
+    try:
+        mtime = os.path.getmtime(path)
+        with open(path) as f:
+            warm = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Failed to load warm cache: {e}")
+        return 0
+    _warm_cache_mtime = mtime
+
+    ttl = warm.get("expires", 0) - time.time()
+    if ttl > 0:
+        for preferences, count, songs in warm.get("prefetched", []):
+            store_prefetched(preferences, count, songs, ttl=ttl)
+    SpotifyService.seed_search_cache(warm.get("searches", []))
+    return len(warm.get("prefetched", [])) + len(warm.get("searches", []))
+
+
+def refresh_warm_cache():
+    """
+    Reloads the warm cache if it was rewritten since this process loaded
+    it, e.g. by the warm-up another worker ran after startup. A stat per
+    call, the file is only read when it changed.
+    """
+    path = Config.WARMUP_CACHE_FILE
+    try:
+        mtime = os.path.getmtime(path) if path else None
+    except OSError:
+        return 0
+    if mtime is None or mtime == _warm_cache_mtime:
+        return 0
+    with _warm_cache_lock:
+        if mtime == _warm_cache_mtime:
+            return 0
+        return load_warm_cache()
+
+
+def warm_up(top_n=None, profiles_file=None, rate=None, markets=None):
+    """
+    Replays the top preference profiles through the AI and track resolution
+    path before traffic arrives. AI answers (served once per process to the
+    first matching preview) and resolved searches are saved to
+    WARMUP_CACHE_FILE, which serving processes load on startup and
+    reload whenever it changes (see refresh_warm_cache); audio
+    features, artists and the on-disk track index are filled as well.
+    Songs are resolved once per market in `markets` (WARMUP_MARKETS).
+    Profiles are started at most `rate` per second. Returns a report dict.
+    """
+    top_n = top_n or Config.WARMUP_TOP_N
+    rate = rate or Config.WARMUP_RATE
+    markets = markets or [m.strip() for m in Config.WARMUP_MARKETS.split(",") if m.strip()]
+    start = time.monotonic()
+    report = {"profiles": 0, "warmed": 0, "failed": 0, "songs": 0, "resolved": 0}
+
+    profiles = top_profiles(top_n, profiles_file)
+    report["profiles"] = len(profiles)
+    if not profiles:
+        report["coverage"] = 0.0
+        report["seconds"] = round(time.monotonic() - start, 2)
+        print("Warm-up: no preference profiles to replay")
+        return report
+
+    access_token = SpotifyService(Config.SPOTIFY_CLIENT_ID, Config.SPOTIFY_CLIENT_SECRET).get_client_token()
+    ai_service = AIService(route="warmup")
+    prefetched, searches = [], []
+
+    for i, preferences in enumerate(profiles):
+        # Bounded rate so a warm-up never competes with live traffic for quota
+        wait = start + i / rate - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+        count = buffered_count(_playlist_length(preferences))
+        try:
+            songs = ai_service.prefetch(preferences, count)
+        except Exception as e:
+            report["failed"] += 1
+            print(f"Warm-up: AI generation failed for {_canonical(preferences)}: {e}")
+            continue
+        prefetched.append([preferences, count, songs])
+
+        for market in markets:
+            spotify_service = SpotifyService(Config.SPOTIFY_CLIENT_ID, Config.SPOTIFY_CLIENT_SECRET, market=market)
+
+            def search(song):
+                try:
+                    return spotify_service.search_track(access_token, song['name'], song['artist'])
+                except CircuitOpenError:
+                    return None
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+                results = list(executor.map(search, songs))
+            tracks = [t for t in results if t]
+            searches.extend([s['name'], s['artist'], t, market] for s, t in zip(songs, results) if t)
+
+            spotify_service.get_audio_features(access_token, [t['id'] for t in tracks])
+            if Config.RECOMMENDER_ENABLED:
+                RecommenderService(spotify_service, access_token).index_tracks(tracks)
+
+            report["songs"] += len(songs)
+            report["resolved"] += len(tracks)
+
+        report["warmed"] += 1
+
+    if prefetched:
+        save_warm_cache(prefetched, searches)
+
+    report["coverage"] = round(report["resolved"] / report["songs"], 3) if report["songs"] else 0.0
+    report["seconds"] = round(time.monotonic() - start, 2)
+    print(
+        f"Warm-up: {report['warmed']}/{report['profiles']} profiles, "
+        f"{report['resolved']}/{report['songs']} songs resolved "
+        f"({report['coverage']:.0%}) in {report['seconds']}s"
+    )
+    return report
+
+
+def warm_up_async():
+    """
+    Startup hook: runs warm_up in a background thread, in only one process
+    per host (whichever takes the lock first) and not again while the warm
+    cache is younger than WARMUP_MIN_INTERVAL, so AI spend doesn't scale
+    with the worker count or restarts.
+    """
+    def run():
+        try:
+            with open(f"{Config.WARMUP_CACHE_FILE}.lock", "a") as lock_file:
+                if not _locked(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB if fcntl else 0):
+                    print("Warm-up already running in another process, skipping")
+                    return
+                path = Config.WARMUP_CACHE_FILE
+                if os.path.exists(path) and time.time() - os.path.getmtime(path) < Config.WARMUP_MIN_INTERVAL:
+                    print("Warm cache is recent, skipping warm-up")
+                    return
+                warm_up()
+        except Exception as e:
+            print(f"Warm-up failed: {e}")
+
+    threading.Thread(target=run, daemon=True, name="warmup").start()
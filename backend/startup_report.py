@@ -0,0 +1,70 @@
+"""
+Cold-start profile of the backend: how long a fresh interpreter takes to
+import and build the app, its peak memory, and which modules cost the most.
+
+    python -m backend.startup_report [--top 25]
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+from .config import Config
+
+_PROBE = """
+import json, time, resource
+start = time.perf_counter()
+from backend.app import create_app
+create_app()
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "create_app_ms": round(elapsed * 1000),
+    # ru_maxrss is KB on Linux, bytes on macOS
+    "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if __import__("sys").platform == "darwin" else 1024), 1)
+}))
+"""
+
+
+def measure_cold_start(import_times=False):
+    """
+    Runs create_app() in a fresh interpreter and returns
+    {"create_app_ms", "max_rss_mb"}, plus "imports" (module -> cumulative
+    ms, slowest first) when import_times is set.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable]
+    if import_times:
+        command += ["-X", "importtime"]
+    result = subprocess.run(
+        command + ["-c", _PROBE],
+        cwd=root, capture_output=True, text=True, check=True
+    )
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+
+    if import_times:
+        # Lines look like "import time:  self [us] | cumulative | module"
+        imports = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative, module = line[len("import time:"):].split("|")
+            imports[module.strip()] = round(int(cumulative) / 1000, 1)
+        report["imports"] = dict(sorted(imports.items(), key=lambda kv: -kv[1]))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=25, help="Slowest modules to list.")
+    args = parser.parse_args()
+
+    report = measure_cold_start(import_times=True)
+    print(f"create_app(): {report['create_app_ms']} ms (budget {Config.STARTUP_TIME_BUDGET_MS} ms)")
+    print(f"Peak RSS:     {report['max_rss_mb']} MB (budget {Config.STARTUP_RSS_BUDGET_MB} MB)")
+    print(f"\nSlowest imports (cumulative ms):")
+    for module, ms in list(report["imports"].items())[:args.top]:
+        print(f"{ms:>10.1f}  {module}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+# Production server settings: gunicorn -c gunicorn.conf.py run:app
+# Values come from Config so .env works the same as for the dev server.
+from backend.config import Config
+
+bind = f"{Config.SERVER_HOST}:{Config.SERVER_PORT}"
+workers = Config.SERVER_WORKERS
+worker_class = Config.SERVER_WORKER_CLASS
+worker_connections = Config.SERVER_WORKER_CONNECTIONS
+threads = Config.SERVER_THREADS
+timeout = Config.SERVER_TIMEOUT
+keepalive = 5
+accesslog = "-"
+
+
+def post_fork(server, worker):
+    # Runs in each worker before the app is imported
+    if worker_class == "gevent":
+        # Greenlets are cheap, let every connection have a provider call in flight
+        Config.AI_WORKERS = max(Config.AI_WORKERS, worker_connections)
+        # gRPC doesn't cooperate with gevent's monkey patching
+        Config.GEMINI_TRANSPORT = Config.GEMINI_TRANSPORT or "rest"
+
+
+def post_worker_init(worker):
+    if Config.WARMUP_ON_STARTUP:
+        # Only one worker per host actually warms, see warm_up_async
+        from backend.services.warmup import warm_up_async
+        warm_up_async()
@@ -1,4 +1,5 @@
 from backend.app import create_app
+from backend.config import Config
 import os
 
 app = create_app()
@@ -6,5 +7,10 @@ app = create_app()
 if __name__ == "__main__":
     # Ensure session dir exists
     os.makedirs(app.config['SESSION_FILE_DIR'], exist_ok=True)
-    # Run
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # The reloader's parent process never serves, only warm the child
+    if Config.WARMUP_ON_STARTUP and (Config.IS_PRODUCTION or os.environ.get("WERKZEUG_RUN_MAIN")):
+        from backend.services.warmup import warm_up_async
+        warm_up_async()
+    # Development server only, production runs under gunicorn:
+    #   gunicorn -c gunicorn.conf.py run:app
+    app.run(host=Config.SERVER_HOST, port=Config.SERVER_PORT, debug=not Config.IS_PRODUCTION, threaded=True)
@@ -0,0 +1,82 @@
+"""
+Concurrent load test for the backend.
+
+Run it once against the threaded dev server (python run.py) and once against
+gunicorn (gunicorn -c gunicorn.conf.py run:app) with the same settings to
+compare how many in-flight requests each model sustains. Setting
+AI_PROVIDERS=fake:2 on the server makes every AI call take 2s offline.
+
+    python scripts/load_test.py --path /Generate_Preview \\
+        --cookie "spotify_session=<cookie from a logged in browser>" \\
+        --body '{"preferences": {"genres": ["rock"], "playlistLength": 10}}' \\
+        --concurrency 200 --requests 1000
+"""
+import json
+import time
+import asyncio
+import argparse
+from collections import Counter
+import httpx
+
+
+def percentile(samples, p):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+async def run(args):
+    headers = {"Content-Type": "application/json"}
+    if args.cookie:
+        headers["Cookie"] = args.cookie
+    body = json.loads(args.body) if args.body else None
+    method = "POST" if body is not None else "GET"
+
+    latencies, statuses = [], Counter()
+    remaining = iter(range(args.requests))
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=args.url, headers=headers, timeout=args.timeout, limits=limits) as client:
+        async def user():
+            for _ in remaining:
+                start = time.monotonic()
+                try:
+                    response = await client.request(method, args.path, json=body)
+                    statuses[response.status_code] += 1
+                except httpx.HTTPError as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append(time.monotonic() - start)
+
+        start = time.monotonic()
+        await asyncio.gather(*(user() for _ in range(args.concurrency)))
+        elapsed = time.monotonic() - start
+
+    return {
+        "requests": len(latencies),
+        "concurrency": args.concurrency,
+        "seconds": round(elapsed, 2),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            f"p{p}": round(percentile(latencies, p) * 1000) for p in (50, 95, 99)
+        },
+        "statuses": {str(k): v for k, v in statuses.items()}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--body", help="JSON body, the request is a POST when given")
+    parser.add_argument("--cookie", help="Session cookie for authenticated endpoints")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import threading
+import time
+import pytest
+from backend.services.admission import AdmissionController, Rejected
+
+
+def controller(**kwargs):
+    settings = {"max_active": 2, "max_queue": 0, "per_user": 5, "queue_timeout": 1.0}
+    settings.update(kwargs)
+    return AdmissionController("test", **settings)
+
+
+def test_rejects_at_capacity_with_retry_after():
+    admission = controller()
+    admission.acquire("a")
+    admission.acquire("b")
+
+    with pytest.raises(Rejected) as e:
+        admission.acquire("c")
+
+    assert e.value.status == 503
+    assert e.value.retry_after >= 1
+    assert admission.snapshot()["rejected"] == {"queue_full": 1}
+
+
+def test_released_slot_admits_again():
+    admission = controller(max_active=1)
+    with admission.admit("a"):
+        with pytest.raises(Rejected):
+            admission.acquire("b")
+
+    admission.acquire("b")
+    assert admission.snapshot()["active"] == 1
+
+
+def test_user_over_their_cap_gets_429():
+    admission = controller(max_active=10, per_user=2)
+    admission.acquire("a")
+    admission.acquire("a")
+
+    with pytest.raises(Rejected) as e:
+        admission.acquire("a")
+
+    assert e.value.status == 429
+    # Other users are unaffected
+    admission.acquire("b")
+
+
+def test_queued_request_waits_for_a_slot():
+    admission = controller(max_active=1, max_queue=1)
+    admission.acquire("a")
+    admitted = threading.Event()
+
+    def waiter():
+        admission.acquire("b")
+        admitted.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    time.sleep(0.05)
+    assert not admitted.is_set()
+    assert admission.snapshot()["queued"] == 1
+
+    admission.release("a", run_time=0.05)
+    thread.join(1)
+
+    assert admitted.is_set()
+    assert admission.snapshot()["active"] == 1
+
+
+def test_queue_timeout_gets_503():
+    admission = controller(max_active=1, max_queue=1, queue_timeout=0.05)
+    admission.acquire("a")
+
+    with pytest.raises(Rejected) as e:
+        admission.acquire("b")
+
+    assert e.value.status == 503
+    snapshot = admission.snapshot()
+    assert snapshot["queued"] == 0
+    assert snapshot["rejected"] == {"queue_timeout": 1}
@@ -0,0 +1,137 @@
+import time
+import itertools
+import threading
+import concurrent.futures
+import pytest
+from backend.config import Config
+from backend.services import ai
+from backend.services.ai import AIService, _stats
+from backend.services.providers import FakeProvider
+from backend.services.resilience import get_breaker
+
+_ids = itertools.count()
+
+
+class CountingProvider(FakeProvider):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = 0
+
+    def generate(self, prompt, timeout):
+        self.calls += 1
+        return super().generate(prompt, timeout)
+
+
+def provider(label, **kwargs):
+    # Stats and breakers are process-wide, so every provider gets a fresh name
+    return CountingProvider(name=f"{label}-{next(_ids)}", **kwargs)
+
+
+def songs(label):
+    return [{"name": f"{label} song", "artist": f"{label} artist"}]
+
+
+@pytest.fixture(autouse=True)
+def fast_hedging(monkeypatch):
+    monkeypatch.setattr(Config, "AI_HEDGE_MIN_DELAY", 0.05)
+    monkeypatch.setattr(Config, "AI_TIMEOUT", 5)
+
+
+def seed_latency(p, seconds, samples=10):
+    service = AIService(providers=[p]) # registers the stats entry
+    for _ in range(samples):
+        _stats[p.name].record(seconds, ok=True)
+    return service
+
+
+def test_no_hedge_while_primary_is_within_its_percentile():
+    primary = provider("primary", latency=0.02, songs=songs("primary"))
+    hedge = provider("hedge", songs=songs("hedge"))
+    seed_latency(primary, 0.2)
+
+    result = AIService(providers=[primary, hedge])._generate("prompt")
+
+    assert result == songs("primary")
+    assert hedge.calls == 0
+
+
+def test_hedge_launches_after_primary_percentile_and_fast_answer_wins():
+    primary = provider("primary", latency=1.0, songs=songs("primary"))
+    hedge = provider("hedge", latency=0.02, songs=songs("hedge"))
+    seed_latency(primary, 0.1)
+
+    start = time.monotonic()
+    result = AIService(providers=[primary, hedge])._generate("prompt")
+    elapsed = time.monotonic() - start
+
+    assert result == songs("hedge")
+    # Launched at the ~0.1s p90, not the 5s default delay
+    assert 0.1 <= elapsed < 0.5
+    assert _stats[hedge.name].snapshot()["hedges_won"] == 1
+
+
+def test_first_valid_answer_wins_over_earlier_invalid_one():
+    # The hedge answers first but with nothing usable, the slower primary wins
+    primary = provider("primary", latency=0.3, songs=songs("primary"))
+    hedge = provider("hedge", latency=0.0, songs=[{"title": "missing keys"}])
+    seed_latency(primary, 0.05)
+
+    result = AIService(providers=[primary, hedge])._generate("prompt")
+
+    assert result == songs("primary")
+    assert hedge.calls == 1
+    # A bad answer is the model's fault, not an outage
+    assert get_breaker(f"ai.{hedge.name}").snapshot()["failures"] == 0
+
+
+def test_failed_primary_hedges_immediately():
+    primary = provider("primary", fail=True)
+    hedge = provider("hedge", songs=songs("hedge"))
+
+    start = time.monotonic()
+    result = AIService(providers=[primary, hedge])._generate("prompt")
+
+    assert result == songs("hedge")
+    # No latency samples, so waiting for the hedge delay would take AI_HEDGE_DEFAULT_DELAY
+    assert time.monotonic() - start < Config.AI_HEDGE_DEFAULT_DELAY / 2
+
+
+def test_provider_with_open_circuit_is_skipped():
+    primary = provider("primary", songs=songs("primary"))
+    hedge = provider("hedge", songs=songs("hedge"))
+    breaker = get_breaker(f"ai.{primary.name}")
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+    start = time.monotonic()
+    result = AIService(providers=[primary, hedge])._generate("prompt")
+
+    assert result == songs("hedge")
+    assert primary.calls == 0
+    assert time.monotonic() - start < Config.AI_HEDGE_DEFAULT_DELAY / 2
+    # The hedge was the first provider to start, so it didn't win a race
+    assert _stats[hedge.name].snapshot()["hedges_won"] == 0
+
+
+def test_cancelled_call_releases_half_open_trial(monkeypatch):
+    p = provider("primary", songs=songs("primary"))
+    breaker = get_breaker(f"ai.{p.name}")
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    breaker.opened_at -= breaker.reset_timeout # due for a trial call
+
+    # A busy pool, so the trial call is still queued when the deadline hits
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    release = threading.Event()
+    pool.submit(release.wait)
+    monkeypatch.setattr(ai, "_executor", pool)
+    monkeypatch.setattr(Config, "AI_TIMEOUT", 0.2)
+    try:
+        with pytest.raises(TimeoutError):
+            AIService(providers=[p])._generate("prompt")
+    finally:
+        release.set()
+        pool.shutdown()
+
+    assert p.calls == 0
+    breaker.before_call() # the trial is free again
@@ -0,0 +1,95 @@
+import threading
+import time
+from backend.services.coalescing import IdempotencyStore
+
+
+def test_replay_returns_the_stored_response():
+    store = IdempotencyStore(max_keys=10, ttl=60)
+    calls = []
+
+    def create(record):
+        calls.append(1)
+        return {"playlist_id": "pl1"}, 200
+
+    first = store.run(("u1", "key"), "fp", create)
+    second = store.run(("u1", "key"), "fp", create)
+
+    assert first == second == ({"playlist_id": "pl1"}, 200)
+    assert len(calls) == 1
+
+
+def test_client_errors_are_replayed_too():
+    store = IdempotencyStore(max_keys=10, ttl=60)
+    calls = []
+
+    def create(record):
+        calls.append(1)
+        return {"error": "No tracks provided"}, 400
+
+    store.run("key", "fp", create)
+
+    assert store.run("key", "fp", create) == ({"error": "No tracks provided"}, 400)
+    assert len(calls) == 1
+
+
+def test_retry_after_server_error_resumes_from_checkpoints():
+    store = IdempotencyStore(max_keys=10, ttl=60)
+    created = []
+
+    def create(record):
+        if "playlist_id" not in record:
+            created.append(1)
+            record["playlist_id"] = "pl1"
+        if len(created) == 1 and not record.get("retried"):
+            record["retried"] = True
+            return {"error": "Spotify unavailable"}, 503
+        return {"playlist_id": record["playlist_id"]}, 200
+
+    assert store.run("key", "fp", create)[1] == 503
+    assert store.run("key", "fp", create) == ({"playlist_id": "pl1"}, 200)
+    # The playlist from the failed attempt was reused
+    assert len(created) == 1
+
+
+def test_key_reused_for_another_payload_is_rejected():
+    store = IdempotencyStore(max_keys=10, ttl=60)
+    store.run("key", "fp1", lambda record: ({"ok": True}, 200))
+
+    body, status = store.run("key", "fp2", lambda record: ({"ok": True}, 200))
+
+    assert status == 422
+    assert "different request" in body["error"]
+
+
+def test_concurrent_attempts_run_once():
+    store = IdempotencyStore(max_keys=10, ttl=60)
+    calls = []
+
+    def create(record):
+        calls.append(1)
+        time.sleep(0.1)
+        return {"playlist_id": "pl1"}, 200
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(store.run("key", "fp", create))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert results == [({"playlist_id": "pl1"}, 200)] * 5
+
+
+def test_expired_records_run_again():
+    store = IdempotencyStore(max_keys=10, ttl=0.05)
+    calls = []
+
+    def create(record):
+        calls.append(1)
+        return {"n": len(calls)}, 200
+
+    store.run("key", "fp", create)
+    time.sleep(0.1)
+
+    assert store.run("key", "fp", create) == ({"n": 2}, 200)
@@ -0,0 +1,101 @@
+import random
+from backend.services.playlist_edit import diff_tracks, request_count
+
+
+def apply_plan(current, plan):
+    """Replays a plan the way Spotify applies it."""
+    if "replace" in plan:
+        return list(plan["replace"])
+    removed = set(plan["remove"])
+    uris = [uri for uri in current if uri not in removed]
+    for start, insert_before, length in plan["moves"]:
+        block = uris[start:start + length]
+        del uris[start:start + length]
+        at = insert_before if insert_before < start else insert_before - length
+        uris[at:at] = block
+    for position, added in plan["inserts"]:
+        uris[position:position] = added
+    return uris
+
+
+def test_unchanged_list_needs_no_requests():
+    plan = diff_tracks(["a", "b", "c"], ["a", "b", "c"])
+
+    assert plan == {"remove": [], "moves": [], "inserts": []}
+    assert request_count(plan) == 0
+
+
+def test_moved_track_is_a_single_move():
+    current = ["a", "b", "c", "d", "e"]
+    desired = ["b", "c", "d", "e", "a"]
+
+    plan = diff_tracks(current, desired)
+
+    assert plan["remove"] == [] and plan["inserts"] == []
+    assert len(plan["moves"]) == 1
+    assert apply_plan(current, plan) == desired
+
+
+def test_adjacent_moved_tracks_move_as_one_range():
+    current = ["a", "b", "c", "d", "e", "f"]
+    desired = ["c", "d", "a", "b", "e", "f"]
+
+    plan = diff_tracks(current, desired)
+
+    assert len(plan["moves"]) == 1
+    assert plan["moves"][0][2] == 2
+    assert apply_plan(current, plan) == desired
+
+
+def test_adds_and_removes():
+    # Long enough that diffing beats rewriting the list (3 requests)
+    tail = [f"t{i}" for i in range(250)]
+    current = ["a", "b", "c", "d"] + tail
+    desired = ["a", "x", "y", "c", "d"] + tail + ["z"]
+
+    plan = diff_tracks(current, desired)
+
+    assert plan["remove"] == ["b"]
+    assert plan["moves"] == []
+    # Consecutive new tracks share one insert
+    assert plan["inserts"] == [(1, ["x", "y"]), (255, ["z"])]
+    assert apply_plan(current, plan) == desired
+
+
+def test_dropping_one_duplicate_reinserts_the_other():
+    # Spotify removes every copy of a URI
+    tail = [f"t{i}" for i in range(250)]
+    current = ["a", "b", "a", "c"] + tail
+    desired = ["a", "b", "c"] + tail
+
+    plan = diff_tracks(current, desired)
+
+    assert plan["remove"] == ["a"]
+    assert plan["inserts"] == [(0, ["a"])]
+    assert apply_plan(current, plan) == desired
+
+
+def test_small_edit_to_short_list_is_a_replace():
+    assert diff_tracks(["a", "b", "c"], ["a", "x", "c"]) == {"replace": ["a", "x", "c"]}
+
+
+def test_full_reorder_falls_back_to_replace():
+    current = [f"t{i}" for i in range(10)]
+    desired = current[::-1]
+
+    assert diff_tracks(current, desired) == {"replace": desired}
+
+
+def test_random_edits_round_trip():
+    rng = random.Random(1234)
+    for _ in range(500):
+        current = [rng.choice("abcdefghij") for _ in range(rng.randint(0, 15))]
+        if rng.random() < 0.5:
+            desired = rng.sample(current, len(current))
+        else:
+            desired = [rng.choice("abcdefghijkl") for _ in range(rng.randint(0, 15))]
+
+        plan = diff_tracks(current, desired)
+
+        assert apply_plan(current, plan) == desired, (current, desired, plan)
+        assert request_count(plan) <= max(1, request_count({"replace": desired}))
@@ -0,0 +1,102 @@
+import numpy as np
+from backend.services.sequencing import SequencingService, normalize_curve
+
+
+class FeatureSource:
+    """Stands in for SpotifyService.get_audio_features."""
+
+    def __init__(self, features):
+        self.features = features
+        self.calls = 0
+
+    def get_audio_features(self, access_token, ids):
+        self.calls += 1
+        return {i: self.features[i] for i in ids if i in self.features}
+
+
+def tracks(n):
+    return [{"id": f"t{i}"} for i in range(n)]
+
+
+def sequence(features, curve=None):
+    service = SequencingService(FeatureSource(features), "token")
+    return [t["id"] for t in service.order(tracks(len(features)), curve=curve)]
+
+
+def feature(tempo=120.0, key=0, mode=1, energy=0.5):
+    return {"tempo": tempo, "key": key, "mode": mode, "energy": energy}
+
+
+def test_short_playlists_are_left_alone():
+    source = FeatureSource({})
+    service = SequencingService(source, "token")
+
+    assert service.order(tracks(2)) == tracks(2)
+    assert source.calls == 0
+
+
+def test_tracks_without_features_keep_their_order():
+    service = SequencingService(FeatureSource({}), "token")
+
+    assert service.order(tracks(5)) == tracks(5)
+
+
+def test_order_is_a_permutation():
+    rng = np.random.default_rng(7)
+    features = {
+        f"t{i}": feature(rng.uniform(70, 170), int(rng.integers(0, 12)), int(rng.integers(0, 2)), rng.uniform())
+        for i in range(40)
+    }
+
+    ordered = sequence(features)
+
+    assert sorted(ordered) == sorted(features)
+
+
+def test_similar_tempos_end_up_next_to_each_other():
+    # Alternating slow and fast songs, same key and energy
+    tempos = [90, 125, 92, 127, 94, 129, 96, 131]
+    features = {f"t{i}": feature(tempo=t) for i, t in enumerate(tempos)}
+
+    ordered = sequence(features)
+
+    slow = [features[i]["tempo"] < 110 for i in ordered]
+    # A single switch between the slow and the fast group
+    assert sum(a != b for a, b in zip(slow, slow[1:])) == 1
+
+
+def test_order_lowers_the_transition_cost():
+    rng = np.random.default_rng(3)
+    features = {
+        f"t{i}": feature(rng.uniform(70, 170), int(rng.integers(0, 12)), int(rng.integers(0, 2)), rng.uniform())
+        for i in range(30)
+    }
+    service = SequencingService(FeatureSource(features), "token")
+    rows = [features[f"t{i}"] for i in range(30)]
+    cost = service.transition_costs(
+        np.array([r["tempo"] for r in rows]),
+        np.array([r["key"] for r in rows]),
+        np.array([r["mode"] for r in rows]),
+        np.array([r["energy"] for r in rows]),
+    )
+
+    def total(ids):
+        path = [int(i[1:]) for i in ids]
+        return sum(cost[a, b] for a, b in zip(path, path[1:]))
+
+    assert total(sequence(features)) < total(f"t{i}" for i in range(30))
+
+
+def test_build_up_curve_raises_energy():
+    energies = [0.9, 0.1, 0.5, 0.3, 0.7, 0.2, 0.8]
+    features = {f"t{i}": feature(energy=e) for i, e in enumerate(energies)}
+
+    ordered = sequence(features, curve="Build Up")
+
+    assert [features[i]["energy"] for i in ordered] == sorted(energies)
+
+
+def test_curve_names_are_normalized():
+    assert normalize_curve("Wind-Down") == "wind_down"
+    assert normalize_curve("sideways") is None
+    assert normalize_curve(None) is None
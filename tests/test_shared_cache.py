@@ -0,0 +1,138 @@
+import pytest
+from backend.config import Config
+from backend.services import shared_cache
+from backend.services.shared_cache import SharedTrackCache, SLOT_HEADER, HEADER_BYTES, PROBES
+
+pytest.importorskip("fcntl")
+
+
+class Clock:
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class CollidingCache(SharedTrackCache):
+    """Keys hash to whatever the test says, to force collisions."""
+    hashes = {}
+
+    @classmethod
+    def _hash(cls, key):
+        return cls.hashes[key]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # Only the cache module sees the fake clock
+    monkeypatch.setattr(shared_cache, "time", clock)
+    return clock
+
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setattr(Config, "TRACK_CACHE_ENABLED", True)
+    monkeypatch.setattr(Config, "TRACK_CACHE_COMPACT_INTERVAL", 3600)
+
+
+def cache(tmp_path, cls=SharedTrackCache, slots=16, ttl=60):
+    return cls(path=str(tmp_path / "tracks.bin"), slots=slots, record_size=256, ttl=ttl)
+
+
+def test_put_then_get(tmp_path, clock):
+    c = cache(tmp_path)
+    track = {"id": "t1", "name": "Song"}
+
+    assert c.put("track:US:t1", track)
+    assert c.get("track:US:t1") == track
+    assert c.get("track:US:t2") is None
+
+
+def test_other_processes_see_writes(tmp_path, clock):
+    cache(tmp_path).put("k", {"v": 1})
+
+    # A second mapping of the same file, like another worker
+    assert cache(tmp_path).get("k") == {"v": 1}
+
+
+def test_values_too_large_for_a_record_are_refused(tmp_path, clock):
+    c = cache(tmp_path)
+
+    assert not c.put("k", {"v": "x" * 300})
+    assert c.get("k") is None
+
+
+def test_keys_sharing_a_home_slot_probe_onwards(tmp_path, clock):
+    # Same home slot (hash % 16 == 3), different hashes
+    CollidingCache.hashes = {f"k{i}": 3 + 16 * (i + 1) for i in range(PROBES + 1)}
+    c = cache(tmp_path, CollidingCache)
+    for i in range(PROBES):
+        clock.now += 1 # k0 expires first
+        c.put(f"k{i}", i)
+
+    assert [c.get(f"k{i}") for i in range(PROBES)] == list(range(PROBES))
+
+    # Every probe slot is taken, so the one expiring soonest is evicted
+    c.put(f"k{PROBES}", PROBES)
+    assert c.get("k0") is None
+    assert c.get(f"k{PROBES}") == PROBES
+    assert c.snapshot()["evictions"] == 1
+
+
+def test_hash_collision_never_returns_another_keys_value(tmp_path, clock):
+    CollidingCache.hashes = {"a": 42, "b": 42}
+    c = cache(tmp_path, CollidingCache)
+    c.put("a", "value of a")
+
+    assert c.get("b") is None
+    assert c.get("a") == "value of a"
+
+
+def test_torn_record_is_a_miss(tmp_path, clock):
+    c = cache(tmp_path)
+    c.put("k", {"v": 1})
+    mm = c._map()
+    offset = HEADER_BYTES + (c._hash("k") % c.slots) * c.record_size
+    # Flip a payload byte as if a writer were halfway through
+    start = offset + SLOT_HEADER.size
+    mm[start + 2] ^= 0xFF
+
+    assert c.get("k") is None
+
+
+def test_expired_records_are_misses_and_compacted(tmp_path, clock):
+    c = cache(tmp_path, ttl=10)
+    c.put("old", 1)
+    clock.now += 5
+    c.put("new", 2)
+    clock.now += 6
+
+    assert c.get("old") is None
+    assert c.get("new") == 2
+    assert c.compact() == 1
+    assert c.compact() == 0
+    assert c.get("new") == 2
+
+
+def test_writes_compact_once_the_interval_passed(tmp_path, clock, monkeypatch):
+    c = cache(tmp_path, ttl=10)
+    c.put("old", 1)
+    clock.now += 20
+    monkeypatch.setattr(Config, "TRACK_CACHE_COMPACT_INTERVAL", 15)
+
+    c.put("new", 2)
+
+    snapshot = c.snapshot()
+    assert snapshot["compactions"] == 1
+    assert snapshot["compacted"] == 1
+
+
+def test_disabled_cache_stores_nothing(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(Config, "TRACK_CACHE_ENABLED", False)
+    c = cache(tmp_path)
+
+    assert not c.put("k", 1)
+    assert c.get("k") is None
+    assert not (tmp_path / "tracks.bin").exists()
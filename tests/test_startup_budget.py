@@ -0,0 +1,20 @@
+from backend.config import Config
+from backend.startup_report import measure_cold_start
+
+# Loaded on first use, never by create_app()
+HEAVY_MODULES = {"google.generativeai", "grpc", "openai", "PIL"}
+
+
+def test_create_app_within_time_and_memory_budget():
+    report = measure_cold_start()
+    assert report["create_app_ms"] <= Config.STARTUP_TIME_BUDGET_MS, report
+    assert report["max_rss_mb"] <= Config.STARTUP_RSS_BUDGET_MB, report
+
+
+def test_create_app_defers_heavy_sdks():
+    report = measure_cold_start(import_times=True)
+    loaded = [
+        module for module in report["imports"]
+        if any(module == heavy or module.startswith(heavy + ".") for heavy in HEAVY_MODULES)
+    ]
+    assert not loaded, f"imported at startup: {loaded}"